@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+'''checks cold import times of our entry points against a budget.
+
+    python scripts/import_budget.py          # or: make importtime
+
+each module is imported in a fresh interpreter under -X importtime;
+the cumulative time of the module itself is compared to its budget
+(milliseconds, scaled by IMPORT_BUDGET_SCALE for slow machines)'''
+import os, re, sys, subprocess
+
+BUDGET_MS = {
+    'memoriesdb.api':          30,  # no psycopg2/pgvector until connect
+    'memoriesdb.api.rest':    150,  # + bottle
+    'memoriesdb.embedding_loop': 400,
+    'memoriesdb.hub':         600,  # gevent, bottle, geventwebsocket
+    'memoriesdb.convo':       500,  # no ollama until the first chat
+}
+SCALE = float(os.getenv('IMPORT_BUDGET_SCALE', 1))
+LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def measure(module):
+    proc = subprocess.run([sys.executable, '-X', 'importtime',
+                           '-c', f'import {module}'],
+                          capture_output=True, text=True)
+    if proc.returncode:
+        return None, proc.stderr.strip().splitlines()[-1]
+    for line in proc.stderr.splitlines():
+        if (m:= LINE.match(line)) and m.group(4) == module:
+            return int(m.group(2)) / 1000, None
+    return None, 'not in -X importtime output'
+
+
+def main():
+    failed = 0
+    for module, budget in BUDGET_MS.items():
+        ms, error = measure(module)
+        budget *= SCALE
+        if ms is None:
+            print(f'{module:28} ERROR  {error}')
+            failed += 1
+            continue
+        ok = ms <= budget
+        failed += not ok
+        print(f'{module:28} {ms:8.1f}ms / {budget:6.0f}ms'
+              f'  {"ok" if ok else "OVER BUDGET"}')
+        pass
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,10 @@
+-- optional content dedup, see memories_content() below
+CREATE TABLE memory_blobs (
+  hash BYTEA PRIMARY KEY, -- sha256 of the text
+  content TEXT NOT NULL,
+  refcount INT NOT NULL DEFAULT 1
+);
+
 CREATE TABLE memories (
 
   id UUID PRIMARY KEY DEFAULT uuid_generate_v1mc(),
@@ -17,16 +24,173 @@ CREATE TABLE memories (
 
   content TEXT,
   content__drift BOOLEAN NOT NULL DEFAULT FALSE, -- is content allowed to drift?
---  content__embeddings VECTOR(384),
-  content__embeddings VECTOR(1024),
+  -- api.EMBED_DIM values, MRL-truncated + renormalized client side
+  -- (see get_embeddings.MODEL_DIMS)
+  content__embeddings VECTOR(384),
+--  content__embeddings VECTOR(1024),
+  -- keyword side of api.hybrid_search, row2dict leaves it out.
+  -- kept by memories_content(): a generated column would only see
+  -- the NULL content of deduplicated rows
+  content__tsv TSVECTOR,
+  -- set when the text lives in memory_blobs (and content is NULL)
+  content__blob BYTEA REFERENCES memory_blobs(hash),
 
-  _json JSONB NOT NULL DEFAULT '{}'
+  _json JSONB NOT NULL DEFAULT '{}' -- keep last, row2dict reads row[-1]
 );
+-- read back by api.bootstrap(), bump with api.SCHEMA_VERSION
+COMMENT ON TABLE memories IS 'memoriesdb schema 9';
+-- when a memory was made, read off its v1 uuid (100ns ticks since 1582)
+CREATE FUNCTION uuid_v1_time(u UUID) RETURNS TIMESTAMPTZ AS $$
+  SELECT to_timestamp(
+    (('x' || lpad(substr(u::text, 16, 3) || substr(u::text, 10, 4)
+                  || substr(u::text, 1, 8), 16, '0'))::bit(64)::bigint
+     - 122192928000000000) / 10000000.0)
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+CREATE INDEX memories__time ON memories (uuid_v1_time(id));
+-- uuids compare byte by byte and a v1 uuid starts with the low 32 bits
+-- of its timestamp, which wrap every ~7 minutes: id order is NOT time
+-- order. history/model reads are
+--   "WHERE _parent=? ORDER BY uuid_v1_time(id) DESC, id DESC"
+-- and keyset pages/deltas seek on (uuid_v1_time(id), id), all on this index
+CREATE INDEX memories__parent_time ON memories (_parent, uuid_v1_time(id), id);
+-- in-edges for api.graph traversals (_parent is covered above)
+CREATE INDEX memories__src ON memories (_src) WHERE _src IS NOT NULL;
+CREATE INDEX memories__dst ON memories (_dst) WHERE _dst IS NOT NULL;
+-- compact ANN indexes, searched first and then reranked at full precision
+-- (api.search_similar); halfvec is half the size, the bit index 1/32nd.
+-- 384 here and in content__embeddings is api.EMBED_DIM, change them
+-- together: api.init() refuses to run when they disagree
+CREATE INDEX memories__embeddings_half ON memories
+  USING hnsw ((content__embeddings::halfvec(384)) halfvec_cosine_ops);
+CREATE INDEX memories__embeddings_bit ON memories
+  USING hnsw ((binary_quantize(content__embeddings)::bit(384)) bit_hamming_ops);
+-- _json attribute lookups (api.find_by_json): @>, @? and @@ only
+CREATE INDEX memories__json ON memories USING gin (_json jsonb_path_ops);
+-- full text, fastupdate off so searches never wade through a pending list
+CREATE INDEX memories__tsv ON memories USING gin (content__tsv)
+  WITH (fastupdate = off);
 CREATE TABLE embedding_schedule (
    id UUID PRIMARY KEY DEFAULT uuid_generate_v1mc(),
   rec UUID NOT NULL REFERENCES memories(id),
---   created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+   created_at TIMESTAMP NOT NULL DEFAULT NOW(),
    started_at TIMESTAMP,
   finished_at TIMESTAMP,
-    error_msg TEXT
+    error_msg TEXT,
+     attempts INT NOT NULL DEFAULT 0,
+       worker TEXT,      -- who holds the lease
+  lease_until TIMESTAMP, -- claimed until; expired leases get reclaimed
+     retry_at TIMESTAMP, -- backoff after a failed attempt
+      dead_at TIMESTAMP  -- gave up (dead letter), see error_msg
+);
+-- the claim query only ever looks at open jobs, oldest first
+CREATE INDEX embedding_schedule__open ON embedding_schedule (created_at, id)
+  WHERE finished_at IS NULL AND dead_at IS NULL;
+-- in-flight jobs of a row, see embedding_loop.CLAIM
+CREATE INDEX embedding_schedule__rec ON embedding_schedule (rec)
+  WHERE finished_at IS NULL AND dead_at IS NULL;
+
+-- _types that never get embeddings, rows of these types aren't enqueued
+CREATE TABLE embedding_skip_types (
+  _type VARCHAR(14) PRIMARY KEY
+);
+INSERT INTO embedding_skip_types (_type) VALUES
+  ('category'), ('role'), ('user'), ('session'), ('model');
+
+-- at most one not-yet-claimed job per row, repeated edits coalesce into it
+CREATE UNIQUE INDEX embedding_schedule__pending ON embedding_schedule (rec)
+  WHERE started_at IS NULL;
+
+CREATE FUNCTION enqueue_embedding() RETURNS TRIGGER AS $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM embedding_skip_types WHERE _type = NEW._type) THEN
+    INSERT INTO embedding_schedule (rec) VALUES (NEW.id)
+      ON CONFLICT (rec) WHERE started_at IS NULL DO NOTHING;
+  END IF;
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE TRIGGER memories__enqueue_insert AFTER INSERT ON memories
+  FOR EACH ROW WHEN (COALESCE(NEW.content, '') <> ''
+                     OR NEW.content__blob IS NOT NULL)
+  EXECUTE FUNCTION enqueue_embedding();
+CREATE TRIGGER memories__enqueue_update AFTER UPDATE OF content ON memories
+  FOR EACH ROW WHEN ((COALESCE(NEW.content, '') <> ''
+                      OR NEW.content__blob IS NOT NULL)
+                     AND (NEW.content, NEW.content__blob)
+                         IS DISTINCT FROM (OLD.content, OLD.content__blob))
+  EXECUTE FUNCTION enqueue_embedding();
+
+-- content dedup: with memoriesdb.blob_min set, e.g.
+--   ALTER DATABASE memories SET memoriesdb.blob_min = 1024;
+-- text of at least that many bytes is stored once in memory_blobs,
+-- reference counted, and memories.content__blob points at it.
+-- unset or 0 leaves content alone. api.row2dict reads either way
+CREATE FUNCTION release_blob(h BYTEA) RETURNS VOID AS $$
+BEGIN
+  UPDATE memory_blobs SET refcount = refcount - 1 WHERE hash = h;
+  DELETE FROM memory_blobs WHERE hash = h AND refcount <= 0;
+END $$ LANGUAGE plpgsql;
+
+CREATE FUNCTION memories_content() RETURNS TRIGGER AS $$
+DECLARE
+  blob_min INT := COALESCE(NULLIF(current_setting('memoriesdb.blob_min', true),
+                                  ''), '0')::INT;
+  old_blob BYTEA;
+BEGIN
+  IF TG_OP = 'UPDATE' THEN
+    IF NEW.content IS NOT DISTINCT FROM OLD.content THEN
+      RETURN NEW;
+    END IF;
+    old_blob := OLD.content__blob;
+    NEW.content__blob := NULL;
+  END IF;
+  NEW.content__tsv := to_tsvector('english', COALESCE(NEW.content, ''));
+  IF blob_min > 0 AND octet_length(NEW.content) >= blob_min THEN
+    NEW.content__blob := sha256(convert_to(NEW.content, 'UTF8'));
+    -- rewriting the same text keeps the reference it has
+    IF NEW.content__blob IS DISTINCT FROM old_blob THEN
+      INSERT INTO memory_blobs (hash, content)
+        VALUES (NEW.content__blob, NEW.content)
+        ON CONFLICT (hash) DO UPDATE SET refcount = memory_blobs.refcount + 1;
+    END IF;
+    NEW.content := NULL;
+  END IF;
+  -- the old reference is dropped by memories__release_old_blob, once
+  -- the update has really happened
+  RETURN NEW;
+END $$ LANGUAGE plpgsql;
+
+CREATE FUNCTION memories_release_blob() RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM release_blob(OLD.content__blob);
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE TRIGGER memories__content BEFORE INSERT OR UPDATE OF content ON memories
+  FOR EACH ROW EXECUTE FUNCTION memories_content();
+CREATE TRIGGER memories__release_blob AFTER DELETE ON memories
+  FOR EACH ROW WHEN (OLD.content__blob IS NOT NULL)
+  EXECUTE FUNCTION memories_release_blob();
+CREATE TRIGGER memories__release_old_blob AFTER UPDATE OF content ON memories
+  FOR EACH ROW WHEN (OLD.content__blob IS NOT NULL
+                     AND OLD.content__blob IS DISTINCT FROM NEW.content__blob)
+  EXECUTE FUNCTION memories_release_blob();
+
+-- hub cluster payloads too big for NOTIFY, see memoriesdb.cluster
+CREATE UNLOGGED TABLE hub_spill (
+  id BIGSERIAL PRIMARY KEY,
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  payload TEXT NOT NULL
+);
+
+-- answers memoriesdb.convo can hand out again, CONVO_CACHE=db, see
+-- memoriesdb.response_cache. embedding has no fixed size, whatever the
+-- embed model returns; lookups compare within one fingerprint only
+CREATE TABLE response_cache (
+  id BIGSERIAL PRIMARY KEY,
+  fingerprint TEXT NOT NULL, -- sha256 hex of model, tools, prior messages
+  embedding VECTOR NOT NULL, -- of the user turn
+  content TEXT NOT NULL,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
+CREATE INDEX response_cache__fingerprint ON response_cache (fingerprint);
@@ -1,41 +1,168 @@
-import os, json, psycopg2
-from pgvector.psycopg2 import register_vector
+import os, re, json, time, uuid, base64, hashlib, weakref
+from collections import namedtuple, OrderedDict
+# psycopg2/pgvector are imported on first connect, importing this
+# module (e.g. for the REST routes) stays cheap
 
 class NotYetImplemented(Exception): pass
 
 _dbconn, _cursor = None, None
 
+def connect():
+    '''a new connection of its own, for work off the shared one'''
+    import psycopg2
+    from pgvector.psycopg2 import register_vector
+    conn = psycopg2.connect(
+        host    =os.getenv('POSTGRES_HOST','localhost'),
+        dbname  =os.getenv('POSTGRES_DB',  'memories'),
+        user    =os.getenv('POSTGRES_USER','postgres'),
+        password=os.getenv('POSTGRES_PASSWORD'),
+    )
+    register_vector(conn)
+    return conn
+
 def get_dbconn():
-    global _dbconn
+    global _dbconn, _cursor
+    if _dbconn and _dbconn.closed:
+        _dbconn, _cursor = None, None # reconnect, statements get re-prepared
+        pass
     if not _dbconn:
-        conn = psycopg2.connect(
-            host    =os.getenv('POSTGRES_HOST','localhost'),
-            dbname  =os.getenv('POSTGRES_DB',  'memories'),
-            user    =os.getenv('POSTGRES_USER','postgres'),
-            password=os.getenv('POSTGRES_PASSWORD'),
-        )
-        register_vector(conn)
-        _dbconn = conn
+        _dbconn = connect()
         pass
     return _dbconn
 
+def reset():
+    '''forgets the connection and everything cached from the database,
+    for a freshly forked worker (memoriesdb.serve). the parent must not
+    have connected: closing an inherited connection closes it for both'''
+    global _dbconn, _cursor, _memory_db_fields, _lookup_role
+    global CategoryId, EntityId, RoleId
+    _dbconn, _cursor = None, None
+    _memory_db_fields, _lookup_role = None, None
+    CategoryId, EntityId, RoleId = None, None, None
+    _blobs.clear()
+    pass
+
 def get_cursor(_dbconn=None):
     global _cursor 
+    if _cursor and _cursor.connection.closed:
+        _cursor = None # get_dbconn() reconnects
+        pass
     if not _cursor:
         dbconn = _dbconn or get_dbconn()
         _cursor = dbconn.cursor()
         pass
     return _cursor
     
+# hot queries run as server-side prepared statements: parsed and planned
+# once per connection instead of on every call. MEMORIESDB_PREPARE=0
+# sends plain SQL again
+PREPARE = os.getenv('MEMORIESDB_PREPARE', '1') != '0'
+
+class Statement:
+    __slots__ = ('name', 'sql', 'prepare', 'execute', 'calls', 'seconds')
+
+    def __init__(_, sql):
+        n = iter(range(1, 1000))
+        body = re.sub(r'%s', lambda m: f'${next(n)}', sql).replace('%%', '%')
+        nargs = next(n) - 1
+        _.name = 'mdb_' + hashlib.sha1(sql.encode()).hexdigest()[:16]
+        _.sql, _.calls, _.seconds = sql, 0, 0.0
+        _.prepare = f"PREPARE {_.name} AS {body}"
+        _.execute = (f"EXECUTE {_.name}" +
+                     (f"({', '.join(['%s'] * nargs)})" if nargs else ""))
+        pass
+    pass
+
+_statements = dict()                    # sql -> Statement
+_prepared = weakref.WeakKeyDictionary() # connection -> prepared names
+_savepoint = weakref.WeakSet()          # connections holding mdb_stmt
+
+def execute(cursor, sql, args=()):
+    '''cursor.execute(sql, args) through the statement registry, one
+    round trip: PREPARE (when needed) and EXECUTE go out together.
+    a statement missing on the server (new connection, DISCARD) or with
+    a stale plan (the table changed shape) is prepared again and
+    retried. inside a transaction a failed PREPARE would abort it, so
+    there a statement not yet prepared is preceded by a SAVEPOINT
+    (releasing the previous one) to roll back to instead; one already
+    prepared goes out alone, and if the server lost it after all the
+    error is the caller's, the next call prepares it again'''
+    if not PREPARE:
+        cursor.execute(sql, args)
+        return cursor
+    if not (stmt:= _statements.get(sql)):
+        stmt = _statements[sql] = Statement(sql)
+        pass
+    from psycopg2 import errors
+    from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+    conn = cursor.connection
+    names = _prepared.setdefault(conn, set())
+    idle = conn.info.transaction_status == TRANSACTION_STATUS_IDLE
+    # the text goes through psycopg2's %s formatting along with args
+    prepare = stmt.prepare.replace('%', '%%') + "; "
+    known = stmt.name in names
+    query = stmt.execute if known else prepare + stmt.execute
+    guarded = not idle and not known
+    if idle:
+        _savepoint.discard(conn) # went with the last transaction
+    elif guarded:
+        query = (("RELEASE SAVEPOINT mdb_stmt; " if conn in _savepoint
+                  else "") + "SAVEPOINT mdb_stmt; " + query)
+        _savepoint.add(conn)
+        pass
+
+    def recover():
+        if idle:
+            conn.rollback()
+        else:
+            cursor.execute("ROLLBACK TO SAVEPOINT mdb_stmt")
+            pass
+        pass
+
+    t0 = time.perf_counter()
+    try:
+        try:
+            cursor.execute(query, args)
+        except errors.DuplicatePreparedStatement:
+            # an earlier PREPARE went through but the EXECUTE sent with
+            # it failed: prepared statements outlive the rollback
+            names.add(stmt.name)
+            recover()
+            cursor.execute(stmt.execute, args)
+            pass
+    except (errors.InvalidSqlStatementName, errors.FeatureNotSupported) as e:
+        names.discard(stmt.name)
+        if not (idle or guarded):
+            raise
+        recover()
+        if isinstance(e, errors.FeatureNotSupported):
+            # "cached plan must not change result type"
+            cursor.execute(f"DEALLOCATE {stmt.name}")
+            pass
+        cursor.execute(prepare + stmt.execute, args)
+        pass
+    names.add(stmt.name)
+    stmt.calls += 1
+    stmt.seconds += time.perf_counter() - t0
+    return cursor
+
+def statement_stats():
+    '''per-statement call counts and time spent, busiest first'''
+    return sorted((dict(name=s.name, sql=s.sql, calls=s.calls,
+                        seconds=round(s.seconds, 6),
+                        mean_ms=round(1000 * s.seconds / s.calls, 3)
+                        if s.calls else None)
+                   for s in _statements.values()),
+                  key=lambda s: -s['seconds'])
+
 def generate_uuid(_cursor=None):
     cursor = _cursor or get_cursor()
-    cursor.execute("SELECT uuid_generate_v1mc()")
+    execute(cursor, "SELECT uuid_generate_v1mc()")
     return cursor.fetchone()[0]
 
 def get_by_id(_id, _cursor=None):
     cursor = _cursor or get_cursor()
-    cursor.execute("SELECT * FROM memories WHERE id=%s", (_id,))
-    return cursor
+    return execute(cursor, "SELECT * FROM memories WHERE id=%s", (_id,))
 
 def get_type_by_parent(args,
                        suffix='',
@@ -44,18 +171,17 @@ def get_type_by_parent(args,
     cursor = _cursor or get_cursor()
     where = "WHERE _type=%s AND _parent=%s"
     sql = f"SELECT {parms} FROM memories {where} {suffix}"
-    cursor.execute(sql, args)
-    return cursor
+    return execute(cursor, sql, args)
 
 def get_types_by_parent(args,
                         suffix='',
                         parms='*',
                         _cursor=None):
+    '''args[0] is a sequence of types, sent as one array parameter'''
     cursor = _cursor or get_cursor()
-    where = "WHERE _type IN %s AND _parent=%s"
+    where = "WHERE _type = ANY(%s) AND _parent=%s"
     sql = f"SELECT {parms} FROM memories {where} {suffix}"
-    cursor.execute(sql, args)
-    return cursor
+    return execute(cursor, sql, (list(args[0]),) + tuple(args[1:]))
 
 _memory_db_fields, _lookup_role = None, None
 
@@ -97,16 +223,18 @@ def _get_lookup_role(_cursor=None):
 
 def lookup_role(role):
     if _lookup_role:
+        if role not in _lookup_role and METADATA_CACHE:
+            init(refresh=True) # a role added since the cache was written
+            pass
         return _lookup_role[role]
     _get_lookup_role()
     return lookup_role(role)
     
 def insert_new_(_type, _parent, content=None, _json={}, _cursor=None):
     cursor = _cursor or get_cursor()
-    _src = old_session_id
-    cursor.execute("INSERT INTO memories(_type, _parent, content, _json)"
-                   " VALUES (%s, %s, %s, %s) RETURNING id",
-                   (_type, _parent, content, json.dumps(_json)))
+    execute(cursor, "INSERT INTO memories(_type, _parent, content, _json)"
+                    " VALUES (%s, %s, %s, %s) RETURNING id",
+            (_type, _parent, content, json.dumps(_json)))
     return cursor.fetchone()[0]
 
 def _get_category_id(name, _cursor=None):
@@ -151,23 +279,25 @@ def insert_new_model(model, session_id, _cursor=None, **kw):
     return insert_new_('model', session_id, model, kw, _cursor)
 
 def insert_fresh_session(user_id, _json={}, _cursor=None):
+    '''the NULL session is its own _src'''
     cursor = _cursor or get_cursor()
-    previous = generate_uuid(cursor)
-    cursor.execute("INSERT INTO memories(_type, _parent, _src, _json, id)"
-                   " VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                   ('session', user_id, previous, json.dumps(_json), _src))
+    execute(cursor, "INSERT INTO memories(_type, _parent, _src, _json, id)"
+                    " SELECT 'session', %s, u.id, %s, u.id"
+                    " FROM (SELECT uuid_generate_v1mc() AS id) u"
+                    " RETURNING id",
+            (user_id, json.dumps(_json)))
     return cursor.fetchone()[0]
 
 def insert_forkd_session(user_id, previous, _json={}, _cursor=None):
     cursor = _cursor or get_cursor()
-    cursor.execute("INSERT INTO memories(_type, _parent, _src, _json)"
-                   " VALUES (%s, %s, %s, %s    ) RETURNING id",
-                   ('session', user_id, previous, json.dumps(_json)))
+    execute(cursor, "INSERT INTO memories(_type, _parent, _src, _json)"
+                    " VALUES (%s, %s, %s, %s    ) RETURNING id",
+            ('session', user_id, previous, json.dumps(_json)))
     return cursor.fetchone()[0]
 
 def insert_new_session(user_id, previous=None, _json={}, _cursor=None):
     return insert_forkd_session(user_id, previous, _json, _cursor) \
-        if old_session_id else \
+        if previous else \
            insert_fresh_session(user_id,           _json, _cursor)
 
 def insert_new_history(session_id, content, role='user',
@@ -176,10 +306,24 @@ def insert_new_history(session_id, content, role='user',
     jd.update(_json)
     jd.update(kw)
     cursor = _cursor or get_cursor()
-    role = lookup_role(role)
-    cursor.execute("INSERT INTO memories(_type, _parent, role, content, _json)"
-                   " VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                   ('history', session_id, role, content, json.dumps(jd)))
+    from psycopg2 import errors
+    from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+    idle = cursor.connection.info.transaction_status == TRANSACTION_STATUS_IDLE
+    sql = ("INSERT INTO memories(_type, _parent, role, content, _json)"
+           " VALUES (%s, %s, %s, %s, %s) RETURNING id")
+    try:
+        execute(cursor, sql, ('history', session_id, lookup_role(role),
+                              content, json.dumps(jd)))
+    except errors.ForeignKeyViolation:
+        # a cached role id from before a re-seed? only retry what we
+        # can roll back without losing the caller's work
+        if not METADATA_CACHE or not idle:
+            raise
+        cursor.connection.rollback()
+        init(refresh=True)
+        execute(cursor, sql, ('history', session_id, lookup_role(role),
+                              content, json.dumps(jd)))
+        pass
     ret = cursor.fetchone()[0]
     if _commit:
         cursor.connection.commit()
@@ -202,45 +346,337 @@ def get_user_id(_cursor=None):
     assert(1==cursor.rowcount)
     return cursor.fetchone()[0]
 
+# v1 uuids don't sort by time (they start with the low bits of the
+# clock), so "newest" and "after" go by the time in them, id breaks ties.
+# both are seeks on memories__parent_time
+_NEWEST = " ORDER BY uuid_v1_time(id) DESC, id DESC"
+_AFTER  = " AND (uuid_v1_time(id), id) > (uuid_v1_time(%s::uuid), %s::uuid)"
+_BEFORE = " AND (uuid_v1_time(id), id) < (uuid_v1_time(%s::uuid), %s::uuid)"
+
 def get_latest_session(user_id, _cursor=None):
     cursor = get_type_by_parent(('session', user_id),
-                                suffix=" ORDER BY id DESC LIMIT 1",
+                                suffix=_NEWEST + " LIMIT 1",
                                 parms='id,_src', _cursor=_cursor)
     return cursor.fetchone()[0]
 
-def load_partial_session(session_id, _cursor=None):
+def get_recent_models(limit=2, scan=100, _cursor=None):
+    '''the `limit` most recently used models, newest first, from the
+    last `scan` model rows'''
+    cursor = _cursor or get_cursor()
+    execute(cursor, "SELECT content FROM memories WHERE _type='model'"
+                    + _NEWEST + " LIMIT %s", (scan,))
+    models = [row[0] for row in cursor if row[0]]
+    return list(dict.fromkeys(models))[:limit]
+
+def load_partial_session(session_id, after=None, _cursor=None):
     #for row in get_types_by_parent((['history','model'], session_id),
     print(">>>", session_id)
-    for row in get_types_by_parent((('history','model'), session_id),
-                                   suffix=" ORDER BY id DESC",
-                                   _cursor=_cursor):
+    args, suffix = (('history','model'), session_id), ""
+    if after:
+        args, suffix = args + (after, after), _AFTER
+        pass
+    rows = [list(row) for row in
+            get_types_by_parent(args, suffix=suffix + _NEWEST,
+                                _cursor=_cursor)]
+    for row in resolve_content(rows):
         print("...", row)
-        yield list(row)
+        yield row
         pass
     print("!!!")
     return
 
-def load_full_session(user_id, session_id, _cursor=None):
+def load_full_session(user_id, session_id, after=None, _cursor=None):
+    '''walks the fork chain newest-first.
+    with `after`, only rows newer than that id are returned (delta mode)'''
     print("LOAD FULL SESSION")
     while session_id:
         print("1 - SESSION", session_id)
-        for row in load_partial_session(session_id):
+        for row in load_partial_session(session_id, after):
             #print("     4", row)
             yield list(row)
             pass
+        if after and uuid_time(session_id) <= uuid_time(after):
+            # the fork happened before `after`, older sessions are all older
+            break
         #ZZZZ
         session_id = get_previous_session(user_id, session_id)
         print("2 - SESSION", session_id)
         pass
     print("END SESSION")
 
+def load_session_page(user_id, session_id, before=None, limit=50,
+                      _cursor=None):
+    '''one page of the fork chain, newest-first, strictly older than `before`.
+    each session is an index seek on memories__parent_time, never an OFFSET.
+    returns (rows, next) where next is the (session_id, before) to resume
+    from, or None on the last page'''
+    rows = []
+    while session_id:
+        args, suffix = (('history','model'), session_id), ""
+        if before:
+            args, suffix = args + (before, before), _BEFORE
+            pass
+        cursor = get_types_by_parent(args + (limit - len(rows),),
+                                     suffix=suffix + _NEWEST + " LIMIT %s",
+                                     _cursor=_cursor)
+        rows.extend(list(row) for row in cursor)
+        if len(rows) >= limit:
+            return resolve_content(rows), (session_id, rows[-1][0])
+        session_id, before = get_previous_session(user_id, session_id,
+                                                  _cursor), None
+        pass
+    return resolve_content(rows), None
+
+def session_chain(user_id, session_id, _cursor=None):
+    '''the fork chain, newest first, in one query'''
+    cursor = _cursor or get_cursor()
+    execute(cursor, "WITH RECURSIVE chain(id, src, n) AS ("
+                    " SELECT id, _src, 0 FROM memories"
+                    "  WHERE _type='session' AND _parent=%s AND id=%s"
+                    " UNION ALL"
+                    " SELECT m.id, m._src, c.n + 1"
+                    "  FROM chain c JOIN memories m ON m.id = c.src"
+                    "  WHERE c.src <> c.id AND m._type='session'"
+                    "  AND m._parent=%s)"
+                    " SELECT id FROM chain ORDER BY n",
+            (user_id, session_id, user_id))
+    return [row[0] for row in cursor]
+
+def get_parent_id(_id, _cursor=None):
+    cursor = _cursor or get_cursor()
+    execute(cursor, "SELECT _parent FROM memories WHERE id=%s", (_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def encode_page_token(next):
+    '''opaque continuation token for load_session_page'''
+    raw = json.dumps(next, separators=(',',':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_page_token(token):
+    '''(session_id, before), ValueError for anything else'''
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        next = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'bad page token: {e}')
+    if not isinstance(next, list) or len(next) != 2:
+        raise ValueError('bad page token')
+    for _id in next:
+        uuid.UUID(str(_id))
+        pass
+    return tuple(next)
+
+def get_newest_id(user_id, session_id, _cursor=None):
+    '''newest history/model id in the fork chain, without touching row data'''
+    while session_id:
+        cursor = get_types_by_parent((('history','model'), session_id),
+                                     suffix=_NEWEST + " LIMIT 1",
+                                     parms='id', _cursor=_cursor)
+        if row:= cursor.fetchone():
+            return row[0]
+        session_id = get_previous_session(user_id, session_id, _cursor)
+        pass
+    return None
+
+_UUID_EPOCH = 0x01b21dd213814000 # 1582-10-15 in 100ns ticks before 1970
+
+def uuid_time(_id):
+    '''unix timestamp embedded in a v1 uuid (our ids are uuid_generate_v1mc)'''
+    return (uuid.UUID(str(_id)).time - _UUID_EPOCH) / 1e7
+
+EMBED_DIM = int(os.getenv('EMBED_DIM', 384)) # the VECTOR(n) column size
+
+# candidate expression (must match the index in sql/001_schema.sql)
+# and the distance operator used against it
+_SEARCH_MODES = {
+    'full':    ("content__embeddings", "%s::vector", "<=>"),
+    'halfvec': (f"content__embeddings::halfvec({EMBED_DIM})",
+                f"%s::halfvec({EMBED_DIM})", "<=>"),
+    'binary':  (f"binary_quantize(content__embeddings)::bit({EMBED_DIM})",
+                f"binary_quantize(%s::vector)::bit({EMBED_DIM})", "<~>"),
+}
+
+def search_similar(embedding, limit=10, mode='halfvec', overfetch=4,
+                   _cursor=None):
+    '''nearest memories by cosine distance, as full rows.
+    `halfvec`/`binary` pull limit*overfetch candidates off the compact
+    index, then rerank those at full precision'''
+    cursor = _cursor or get_cursor()
+    expr, param, op = _SEARCH_MODES[mode]
+    cursor.execute("SELECT * FROM ("
+                   " SELECT * FROM memories"
+                   " WHERE content__embeddings IS NOT NULL"
+                   f" ORDER BY {expr} {op} {param} LIMIT %s) candidates"
+                   " ORDER BY content__embeddings <=> %s::vector LIMIT %s",
+                   (embedding, limit * overfetch, embedding, limit))
+    return cursor
+
+def hybrid_search(query, embedding=None, limit=10, types=None,
+                  session_id=None, k=60, candidates=None, _cursor=None):
+    '''keyword (full text) and vector search merged by reciprocal rank
+    fusion: score = sum(1 / (k + rank)) over the lists a row shows up in.
+    each side only ranks its own top `candidates`, rows come back best
+    first. `types` limits _type, `session_id` limits to that _parent'''
+    cursor = _cursor or get_cursor()
+    candidates = candidates or max(limit * 4, 40)
+    filters, parms = "", dict(query=query, embedding=embedding, k=k,
+                              limit=limit, candidates=candidates,
+                              types=list(types or []), session=session_id)
+    if types:
+        filters += " AND _type = ANY(%(types)s)"
+        pass
+    if session_id:
+        filters += " AND _parent = %(session)s"
+        pass
+    previous = None
+    if filters and embedding is not None:
+        # keep walking the HNSW graph until enough rows pass the filters,
+        # for this query only: the connection is shared
+        cursor.execute("SELECT COALESCE(current_setting('hnsw.iterative_scan',"
+                       " true), 'off'), set_config('hnsw.iterative_scan',"
+                       " 'relaxed_order', true)")
+        previous = cursor.fetchone()[0]
+        pass
+    keyword = semantic = "SELECT NULL::uuid AS id, 0::bigint AS rank WHERE false"
+    if query:
+        keyword = ("SELECT id, row_number() OVER (ORDER BY score DESC) AS rank"
+                   " FROM (SELECT id, ts_rank_cd(content__tsv, q) AS score"
+                   "  FROM memories, websearch_to_tsquery('english', %(query)s) q"
+                   f"  WHERE content__tsv @@ q{filters}"
+                   "  ORDER BY score DESC LIMIT %(candidates)s) hits")
+        pass
+    if embedding is not None:
+        expr, param, op = _SEARCH_MODES['halfvec']
+        param = param.replace('%s', '%(embedding)s')
+        semantic = ("SELECT id, row_number() OVER (ORDER BY distance) AS rank"
+                    f" FROM (SELECT id, {expr} {op} {param} AS distance"
+                    "  FROM memories WHERE content__embeddings IS NOT NULL"
+                    f"  {filters} ORDER BY distance LIMIT %(candidates)s) hits")
+        pass
+    cursor.execute(f"WITH keyword AS ({keyword}), semantic AS ({semantic}),"
+                   " fused AS (SELECT id, SUM(1.0 / (%(k)s + rank)) AS score"
+                   "  FROM (SELECT * FROM keyword"
+                   "        UNION ALL SELECT * FROM semantic) ranks"
+                   "  GROUP BY id ORDER BY score DESC LIMIT %(limit)s)"
+                   " SELECT m.* FROM fused JOIN memories m USING (id)"
+                   " ORDER BY fused.score DESC, m.id DESC", parms)
+    if previous is not None:
+        # the rows are already client side, a second cursor is safe
+        cursor.connection.cursor().execute(
+            "SELECT set_config('hnsw.iterative_scan', %s, true)", (previous,))
+        pass
+    return cursor
+
+def json_path(dotted, value):
+    '''"a.b", v -> {"a": {"b": v}}, the containment form of a key path'''
+    for key in reversed(dotted.split('.')):
+        value = {key: value}
+        pass
+    return value
+
+def find_by_json(contains=None, types=None, parent=None, exists=(),
+                 match=None, since=None, until=None, limit=100,
+                 _cursor=None):
+    '''newest memories whose _json matches, all conditions ANDed:
+      contains  dict, _json @> contains (see json_path)
+      exists    key paths ("a.b") that must be present
+      match     a jsonpath predicate, e.g. '$.attempts > 2'
+      types, parent, since/until (datetimes or ISO strings, by uuid time)
+    the _json conditions are lookups on the jsonb_path_ops GIN index'''
+    cursor = _cursor or get_cursor()
+    where, parms = [], []
+    if contains:
+        where.append("_json @> %s::jsonb")
+        parms.append(json.dumps(contains))
+        pass
+    for dotted in exists:
+        where.append("_json @? %s::jsonpath")
+        parms.append('$.' + '.'.join(json.dumps(k) for k in dotted.split('.')))
+        pass
+    if match:
+        where.append("_json @@ %s::jsonpath")
+        parms.append(match)
+        pass
+    if types:
+        where.append("_type = ANY(%s)")
+        parms.append(list(types))
+        pass
+    if parent:
+        where.append("_parent = %s")
+        parms.append(parent)
+        pass
+    if since:
+        where.append("uuid_v1_time(id) >= %s::timestamptz")
+        parms.append(since)
+        pass
+    if until:
+        where.append("uuid_v1_time(id) < %s::timestamptz")
+        parms.append(until)
+        pass
+    cursor.execute("SELECT * FROM memories"
+                   f" WHERE {' AND '.join(where) or 'true'}" + _NEWEST +
+                   " LIMIT %s", parms + [limit])
+    return cursor
+
+BLOB_CACHE = int(os.getenv('MEMORIESDB_BLOB_CACHE', 4096))
+_blobs = OrderedDict() # hash -> text, least recently used first
+
+def blob_contents(hashes):
+    '''text of deduplicated content (content__blob hashes) by hash,
+    through an LRU; all the misses are fetched in one query, on a
+    cursor of their own so callers can be iterating theirs'''
+    hashes = [bytes(h) for h in hashes]
+    if missing:= list({h for h in hashes if h not in _blobs}):
+        with get_dbconn().cursor() as cursor:
+            execute(cursor, "SELECT hash, content FROM memory_blobs"
+                            " WHERE hash = ANY(%s)", (missing,))
+            for h, content in cursor:
+                _blobs[bytes(h)] = content
+                pass
+            pass
+        pass
+    return _cached_blobs(hashes)
+
+def _cached_blobs(hashes):
+    '''the hashes found in the LRU, marked as just used'''
+    found = dict()
+    for h in hashes:
+        if h in _blobs:
+            _blobs.move_to_end(h)
+            found[h] = _blobs[h]
+            pass
+        pass
+    while len(_blobs) > BLOB_CACHE:
+        _blobs.popitem(last=False)
+        pass
+    return found
+
+def resolve_content(rows):
+    '''fills in `content` of rows whose text lives in memory_blobs'''
+    content = memory_db_fields('content')[1]
+    blob = memory_db_fields('content__blob')[1]
+    if pending:= [row for row in rows
+                  if row[content] is None and row[blob] is not None]:
+        found = blob_contents(row[blob] for row in pending)
+        for row in pending:
+            row[content] = found.get(bytes(row[blob]))
+            pass
+        pass
+    return rows
+
 def row2dict(row):
     j = row[-1]
     for n,v in enumerate(row):
         if v is None:
             continue
         k = memory_db_fields(n)
-        if k == '_json':
+        if k in ('_json', 'content__tsv', 'content__embeddings'):
+            continue
+        if k == 'content__blob':
+            if 'content' not in j:
+                j['content'] = blob_contents([v]).get(bytes(v))
+                pass
             continue
         if k == 'role':
             j['_' + k] = lookup_role(v)
@@ -249,21 +685,138 @@ def row2dict(row):
         pass
     return j
 
-def init():
+SCHEMA_VERSION = 9 # keep in step with the COMMENT in sql/001_schema.sql
+METADATA_CACHE = os.getenv('MEMORIESDB_METADATA_CACHE', '') # a path, or off
+
+Column = namedtuple('Column', 'name type_code')
+
+_BOOTSTRAP_SQL = ("SELECT m.*, obj_description('memories'::regclass),"
+                  " (SELECT format_type(atttypid, atttypmod) FROM pg_attribute"
+                  "   WHERE attrelid = 'memories'::regclass"
+                  "   AND attname = 'content__embeddings')"
+                  " FROM memories m WHERE m._type='role'"
+                  " OR (m._type='category'"
+                  "     AND m.content IN ('category','entity','role'))")
+
+def bootstrap(_cursor=None):
+    '''all the metadata init() needs in one round trip: the column
+    layout, the roles, the built-in categories, the schema version and
+    the embedding column type'''
+    cursor = _cursor or get_cursor()
+    cursor.execute(_BOOTSTRAP_SQL)
+    return _bootstrap_meta(cursor.description, cursor)
+
+def _bootstrap_meta(description, rows):
+    desc = [Column(c.name, c.type_code) for c in description[:-2]]
+    ndx = {c.name: n for n,c in enumerate(desc)}
+    roles, categories, comment, vector = [], {}, None, None
+    for row in rows:
+        comment, vector = row[-2], row[-1]
+        if row[ndx['_type']] == 'role':
+            roles.append((row[ndx['id']], row[ndx['content']]))
+        else:
+            categories[row[ndx['content']]] = row[ndx['id']]
+            pass
+        pass
+    if comment != f'memoriesdb schema {SCHEMA_VERSION}':
+        print(f">> WARNING: database schema is {comment!r},"
+              f" expected version {SCHEMA_VERSION}")
+        pass
+    if vector and vector != f'vector({EMBED_DIM})':
+        # the casts in _SEARCH_MODES would no longer match the ANN
+        # indexes (and every embedding write would fail)
+        raise RuntimeError(f"content__embeddings is {vector},"
+                           f" EMBED_DIM is {EMBED_DIM}")
+    return dict(version=SCHEMA_VERSION, db=_metadata_db(), embed_dim=EMBED_DIM,
+                fields=[list(c) for c in desc],
+                roles=roles, categories=categories)
+
+def _metadata_db():
+    return (f"{os.getenv('POSTGRES_HOST','localhost')}"
+            f"/{os.getenv('POSTGRES_DB','memories')}")
+
+def _load_metadata_cache():
+    try:
+        with open(METADATA_CACHE) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (meta.get('version') != SCHEMA_VERSION or meta.get('db') != _metadata_db()
+        or meta.get('embed_dim') != EMBED_DIM):
+        return None
+    return meta
+
+def _save_metadata_cache(meta):
+    tmp = f'{METADATA_CACHE}.{os.getpid()}'
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, METADATA_CACHE)
+    except OSError as e:
+        print(">> metadata cache not written:", e)
+        pass
+    pass
+
+def _apply_metadata(meta):
+    global _memory_db_fields, _lookup_role, CategoryId, EntityId, RoleId
+    desc = [Column(*c) for c in meta['fields']]
+    ndx = dict()
+    for n,column in enumerate(desc):
+        ndx[column.name] = column,n
+        ndx[n] = column.name
+        pass
+    ndx['_public' ] = [(_.name,n) for n,_ in enumerate(desc)
+                       if not _.name.startswith('_')]
+    ndx['_private'] = [(_.name,n) for n,_ in enumerate(desc)
+                       if     _.name.startswith('_')]
+    _memory_db_fields = ndx
+    assert(meta['roles'])
+    lookup_role = dict()
+    for _id, name in meta['roles']:
+        lookup_role[_id] = name
+        lookup_role[name] = _id
+        pass
+    _lookup_role = lookup_role
+    categories = meta['categories']
+    CategoryId = categories['category']
+    EntityId   = categories['entity']
+    RoleId     = categories['role']
+    pass
+
+def _metadata_current(meta, _cursor=None):
+    '''whether the cached roles and categories are still these very rows.
+    a re-seed or a restore of another database makes new ids, and
+    handing out the old ones fails every insert on its foreign keys'''
+    cursor = _cursor or get_cursor()
+    rows = meta['roles'] + [(_id, name) for name, _id
+                            in meta['categories'].items()]
+    cursor.execute("SELECT count(*) FROM memories WHERE (id, content) IN"
+                   " (SELECT * FROM unnest(%s::uuid[], %s::text[]))",
+                   ([_id for _id, name in rows], [name for _id, name in rows]))
+    ok = cursor.fetchone()[0] == len(rows)
+    cursor.connection.rollback() # don't leave a read transaction open
+    return ok
+
+def init(refresh=False):
     print(">> Initializing API...")
-    _get_memory_db_fields()
-    _get_lookup_role()
-    get_category_id()
-    get_entity_id()
-    get_role_id()
-    if 0:
-        category_category_id()
-        entity_category_id()
-        role_category_id()
+    meta = None if refresh or not METADATA_CACHE else _load_metadata_cache()
+    if meta and not _metadata_current(meta):
+        print(">> metadata cache is from another database, reloading")
+        meta = None
+        pass
+    if not meta:
+        meta = bootstrap()
+        if METADATA_CACHE:
+            _save_metadata_cache(meta)
+            pass
+        pass
+    _apply_metadata(meta)
     pass
 
 #_init = init
 
+from .graph import *
+
 
 if __name__=='__main__':
     init()
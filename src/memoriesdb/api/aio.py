@@ -0,0 +1,323 @@
+'''asyncio counterpart of memoriesdb.api on psycopg 3.
+
+a subset of it -- the session/history reads and writes,
+resolve_content and search_similar; no hybrid_search, find_by_json or graph yet -- with the
+same arguments, awaited; the ones that hand back a cursor in
+memoriesdb.api return the fetched rows here.
+statements that depend on each other share one round trip, either as
+a single statement (insert_fresh_session) or a pipeline (the INSERT
+and COMMIT of insert_new_history, all the partial sessions of a fork
+chain in load_full_session).
+
+connections come from one AsyncConnectionPool, so thousands of
+sessions on an event loop share AIO_POOL_MAX connections. uuids load
+as str like psycopg2's do, and init() fills the same role/column
+tables, so api.row2dict and api.lookup_role work on these rows too.
+
+    pip install 'memoriesdb[aio]'
+'''
+import os, json
+from contextlib import asynccontextmanager
+import psycopg
+from psycopg.types.string import TextLoader
+from psycopg.types.uuid import UUIDBinaryLoader
+from psycopg_pool import AsyncConnectionPool
+from . import (_BOOTSTRAP_SQL, _bootstrap_meta, _apply_metadata,
+               _SEARCH_MODES, _NEWEST, _AFTER, _BEFORE, uuid_time,
+               _blobs, _cached_blobs, memory_db_fields, lookup_role,
+               get_entity_id)
+
+POOL_MIN = int(os.getenv('AIO_POOL_MIN', 1))
+POOL_MAX = int(os.getenv('AIO_POOL_MAX', 10))
+
+_pool = None
+
+def conninfo():
+    return psycopg.conninfo.make_conninfo(
+        host    =os.getenv('POSTGRES_HOST','localhost'),
+        dbname  =os.getenv('POSTGRES_DB',  'memories'),
+        user    =os.getenv('POSTGRES_USER','postgres'),
+        password=os.getenv('POSTGRES_PASSWORD'),
+    )
+
+class StrUUIDBinaryLoader(UUIDBinaryLoader):
+    '''binary uuids are 16 raw bytes, not text: decode, then str'''
+    def load(_, data):
+        return str(super().load(data))
+    pass
+
+async def _configure(conn):
+    from pgvector.psycopg import register_vector_async
+    conn.adapters.register_loader('uuid', TextLoader)
+    conn.adapters.register_loader('uuid', StrUUIDBinaryLoader)
+    await register_vector_async(conn)
+    pass
+
+async def get_pool():
+    global _pool
+    if not _pool:
+        _pool = AsyncConnectionPool(conninfo(), min_size=POOL_MIN,
+                                    max_size=POOL_MAX, configure=_configure,
+                                    open=False)
+        await _pool.open()
+        pass
+    return _pool
+
+async def close():
+    global _pool
+    if _pool:
+        await _pool.close()
+        _pool = None
+        pass
+    pass
+
+@asynccontextmanager
+async def connection(_conn=None):
+    '''the caller's connection, or a pooled one that commits (or rolls
+    back) when the block ends'''
+    if _conn:
+        yield _conn
+        return
+    async with (await get_pool()).connection() as conn:
+        yield conn
+        pass
+    pass
+
+async def _fetchall(sql, args=(), _conn=None):
+    async with connection(_conn) as conn:
+        cursor = await conn.execute(sql, args)
+        return await cursor.fetchall()
+
+async def _fetchone(sql, args=(), _conn=None):
+    async with connection(_conn) as conn:
+        cursor = await conn.execute(sql, args)
+        return await cursor.fetchone()
+
+async def init(_conn=None):
+    async with connection(_conn) as conn:
+        cursor = await conn.execute(_BOOTSTRAP_SQL)
+        _apply_metadata(_bootstrap_meta(cursor.description,
+                                        await cursor.fetchall()))
+        pass
+    pass
+
+async def generate_uuid(_conn=None):
+    return (await _fetchone("SELECT uuid_generate_v1mc()", (), _conn))[0]
+
+async def get_by_id(_id, _conn=None):
+    return await _fetchall("SELECT * FROM memories WHERE id=%s", (_id,), _conn)
+
+async def get_type_by_parent(args, suffix='', parms='*', _conn=None):
+    return await _fetchall(f"SELECT {parms} FROM memories"
+                           f" WHERE _type=%s AND _parent=%s {suffix}",
+                           args, _conn)
+
+async def get_types_by_parent(args, suffix='', parms='*', _conn=None):
+    types, *rest = args
+    return await _fetchall(f"SELECT {parms} FROM memories"
+                           f" WHERE _type = ANY(%s) AND _parent=%s {suffix}",
+                           (list(types), *rest), _conn)
+
+async def insert_new_(_type, _parent, content=None, _json={}, _conn=None):
+    return (await _fetchone("INSERT INTO memories(_type, _parent, content, _json)"
+                            " VALUES (%s, %s, %s, %s) RETURNING id",
+                            (_type, _parent, content, json.dumps(_json)),
+                            _conn))[0]
+
+async def insert_new_model(model, session_id, _conn=None, **kw):
+    return await insert_new_('model', session_id, model, kw, _conn)
+
+async def insert_fresh_session(user_id, _json={}, _conn=None):
+    '''the NULL session is its own _src: one statement, not two'''
+    return (await _fetchone("INSERT INTO memories(_type, _parent, _src, _json, id)"
+                            " SELECT 'session', %s, u.id, %s, u.id"
+                            " FROM (SELECT uuid_generate_v1mc() AS id) u"
+                            " RETURNING id",
+                            (user_id, json.dumps(_json)), _conn))[0]
+
+async def insert_forkd_session(user_id, previous, _json={}, _conn=None):
+    return (await _fetchone("INSERT INTO memories(_type, _parent, _src, _json)"
+                            " VALUES (%s, %s, %s, %s) RETURNING id",
+                            ('session', user_id, previous, json.dumps(_json)),
+                            _conn))[0]
+
+async def insert_new_session(user_id, previous=None, _json={}, _conn=None):
+    if previous:
+        return await insert_forkd_session(user_id, previous, _json, _conn)
+    return await insert_fresh_session(user_id, _json, _conn)
+
+async def insert_new_history(session_id, content, role='user',
+                             _json={}, _conn=None, _commit=True, **kw):
+    '''_commit=False leaves the transaction to the caller's _conn; a
+    pooled connection always commits when it goes back'''
+    if not _commit and not _conn:
+        raise ValueError('_commit=False needs a _conn')
+    jd = {}
+    jd.update(_json)
+    jd.update(kw)
+    role = lookup_role(role)
+    async with connection(_conn) as conn:
+        async with conn.pipeline():
+            cursor = await conn.execute(
+                "INSERT INTO memories(_type, _parent, role, content, _json)"
+                " VALUES (%s, %s, %s, %s, %s) RETURNING id",
+                ('history', session_id, role, content, json.dumps(jd)))
+            if _commit:
+                await conn.commit()
+                pass
+            pass
+        return (await cursor.fetchone())[0]
+
+async def get_previous_session(user_id, session_id, _conn=None):
+    row = await _fetchone("SELECT id, _src FROM memories"
+                          " WHERE _type='session' AND _parent=%s AND id=%s",
+                          (user_id, session_id), _conn)
+    if not row:
+        return None
+    return row[1] if row[0] != row[1] else None
+
+async def session_chain(user_id, session_id, _conn=None):
+    '''the fork chain, newest first, in one query instead of one
+    get_previous_session per hop'''
+    rows = await _fetchall("WITH RECURSIVE chain(id, src, n) AS ("
+                           " SELECT id, _src, 0 FROM memories"
+                           "  WHERE _type='session' AND _parent=%(user)s"
+                           "  AND id=%(session)s"
+                           " UNION ALL"
+                           " SELECT m.id, m._src, c.n + 1"
+                           "  FROM chain c JOIN memories m ON m.id = c.src"
+                           "  WHERE c.src <> c.id AND m._type='session'"
+                           "  AND m._parent=%(user)s)"
+                           " SELECT id FROM chain ORDER BY n",
+                           dict(user=user_id, session=session_id), _conn)
+    return [row[0] for row in rows]
+
+async def get_user_id(_conn=None):
+    if user_id:= os.getenv('USER_ID',''):
+        return user_id
+    rows = await get_type_by_parent(('user', get_entity_id()),
+                                    suffix=" ORDER BY id DESC LIMIT 2",
+                                    _conn=_conn)
+    assert(1==len(rows))
+    return rows[0][0]
+
+async def get_latest_session(user_id, _conn=None):
+    rows = await get_type_by_parent(('session', user_id),
+                                    suffix=_NEWEST + " LIMIT 1",
+                                    parms='id,_src', _conn=_conn)
+    return rows[0][0]
+
+_PARTIAL_SQL = ("SELECT * FROM memories WHERE _type = ANY(%s) AND _parent=%s"
+                " {}" + _NEWEST)
+
+async def load_partial_session(session_id, after=None, _conn=None):
+    args, suffix = [['history','model'], session_id], ""
+    if after:
+        args, suffix = args + [after, after], _AFTER
+        pass
+    for row in await _fetchall(_PARTIAL_SQL.format(suffix), args, _conn):
+        yield list(row)
+        pass
+    pass
+
+async def load_full_session(user_id, session_id, after=None, _conn=None):
+    '''walks the fork chain newest-first, all of it in two round trips:
+    the chain, then every session's rows pipelined.
+    with `after`, only rows newer than that id are returned (delta mode)'''
+    chain = await session_chain(user_id, session_id, _conn)
+    if after:
+        # the fork happened before `after`, older sessions are all older
+        older = [n for n, s in enumerate(chain)
+                 if uuid_time(s) <= uuid_time(after)]
+        chain = chain[:older[0] + 1] if older else chain
+        pass
+    async with connection(_conn) as conn:
+        cursors = []
+        async with conn.pipeline():
+            for sess in chain:
+                args, suffix = [['history','model'], sess], ""
+                if after:
+                    args, suffix = args + [after, after], _AFTER
+                    pass
+                cursors.append(await conn.execute(_PARTIAL_SQL.format(suffix),
+                                                  args))
+                pass
+            pass
+        for cursor in cursors:
+            rows = [list(row) for row in await cursor.fetchall()]
+            for row in await resolve_content(rows, conn):
+                yield row
+                pass
+            pass
+        pass
+    pass
+
+async def load_session_page(user_id, session_id, before=None, limit=50,
+                            _conn=None):
+    '''see api.load_session_page, returns (rows, next)'''
+    rows = []
+    chain = await session_chain(user_id, session_id, _conn)
+    for sess in chain:
+        args, suffix = [['history','model'], sess], ""
+        if before:
+            args, suffix = args + [before, before], _BEFORE
+            pass
+        rows.extend(list(row) for row in await _fetchall(
+            _PARTIAL_SQL.format(suffix) + " LIMIT %s",
+            args + [limit - len(rows)], _conn))
+        if len(rows) >= limit:
+            return await resolve_content(rows, _conn), (sess, rows[-1][0])
+        before = None
+        pass
+    return await resolve_content(rows, _conn), None
+
+async def get_newest_id(user_id, session_id, _conn=None):
+    '''newest history/model id in the fork chain: the newest row of each
+    session (an index seek on memories__parent_time apiece), then the
+    newest of those'''
+    row = await _fetchone("SELECT id FROM unnest(%s::uuid[]) s(sess),"
+                          " LATERAL (SELECT id FROM memories"
+                          "  WHERE _type = ANY(%s) AND _parent = s.sess"
+                          + _NEWEST + " LIMIT 1) n" + _NEWEST + " LIMIT 1",
+                          (await session_chain(user_id, session_id, _conn),
+                           ['history','model']),
+                          _conn)
+    return row[0] if row else None
+
+async def blob_contents(hashes, _conn=None):
+    '''see api.blob_contents, sharing its LRU'''
+    hashes = [bytes(h) for h in hashes]
+    if missing:= list({h for h in hashes if h not in _blobs}):
+        for h, content in await _fetchall("SELECT hash, content FROM memory_blobs"
+                                          " WHERE hash = ANY(%s)", (missing,),
+                                          _conn):
+            _blobs[bytes(h)] = content
+            pass
+        pass
+    return _cached_blobs(hashes)
+
+async def resolve_content(rows, _conn=None):
+    '''see api.resolve_content: fills in `content` of rows whose text
+    lives in memory_blobs, so api.row2dict never fetches one itself'''
+    content = memory_db_fields('content')[1]
+    blob = memory_db_fields('content__blob')[1]
+    if pending:= [row for row in rows
+                  if row[content] is None and row[blob] is not None]:
+        found = await blob_contents((row[blob] for row in pending), _conn)
+        for row in pending:
+            row[content] = found.get(bytes(row[blob]))
+            pass
+        pass
+    return rows
+
+async def search_similar(embedding, limit=10, mode='halfvec', overfetch=4,
+                         _conn=None):
+    '''see api.search_similar'''
+    expr, param, op = _SEARCH_MODES[mode]
+    return await _fetchall("SELECT * FROM ("
+                           " SELECT * FROM memories"
+                           " WHERE content__embeddings IS NOT NULL"
+                           f" ORDER BY {expr} {op} {param} LIMIT %s) candidates"
+                           " ORDER BY content__embeddings <=> %s::vector LIMIT %s",
+                           (embedding, limit * overfetch, embedding, limit),
+                           _conn)
@@ -0,0 +1,215 @@
+'''graph traversal over the edges every memory carries:
+_parent, _src and _dst (a row points *out* along them, the rows
+pointing at it are its *in* edges).
+
+every traversal is one recursive CTE; each hop is an index lookup
+(the primary key going out, memories__parent_time/__src/__dst coming
+in). traversals go a whole level per step, carrying the set of ids
+seen so far, so every node is expanded once -- and cycles, like the
+NULL session being its own _src, end there. AdjacencyCache keeps a hot
+subgraph in process.'''
+from collections import deque
+from . import get_cursor, resolve_content
+
+__all__ = ['EDGES', 'DIRECTIONS', 'neighbours', 'traverse', 'ancestors',
+           'descendants', 'shortest_path', 'AdjacencyCache']
+
+EDGES = ('_parent', '_src', '_dst')
+DIRECTIONS = ('out', 'in', 'both')
+MAX_ROWS = 1000
+
+
+def _steps(at, edges=EDGES, direction='both', many=False):
+    '''SQL for the (next, prev, edge, dir) one hop away from the node
+    `at`, or from any of the uuid[] `at` when `many`; prev is the node
+    the hop starts from'''
+    if direction not in DIRECTIONS:
+        raise ValueError(f'direction must be one of {DIRECTIONS}')
+    match = f"= ANY({at})" if many else f"= {at}"
+    steps = []
+    for e in edges:
+        if e not in EDGES:
+            raise ValueError(f'unknown edge {e!r}')
+        if direction in ('out', 'both'):
+            steps.append(f"SELECT {e} AS next, id AS prev,"
+                         f" '{e}' AS edge, 'out' AS dir"
+                         f" FROM memories WHERE id {match} AND {e} <> id")
+            pass
+        if direction in ('in', 'both'):
+            steps.append(f"SELECT id AS next, {e} AS prev,"
+                         f" '{e}' AS edge, 'in' AS dir"
+                         f" FROM memories WHERE {e} {match} AND id <> {e}")
+            pass
+        pass
+    return " UNION ALL ".join(steps)
+
+
+def _levels(direction, edges, limit=True, start='%(id)s::uuid', until=None):
+    '''breadth first, a level per row: (depth, frontier, via, seen). a
+    level is the not yet seen ids one hop from the previous one, via[n]
+    the node frontier[n] was reached from; with `limit` each level and
+    the walk stop at %(limit)s ids, with `until` the level that reaches
+    that id is the last'''
+    cap = " LIMIT %(limit)s" if limit else ""
+    stop = " AND cardinality(w.seen) <= %(limit)s" if limit else ""
+    stop += f" AND NOT {until} = ANY(w.seen)" if until else ""
+    return ("WITH RECURSIVE walk(depth, frontier, via, seen) AS ("
+            f" SELECT 0, ARRAY[{start}], ARRAY[NULL::uuid], ARRAY[{start}]"
+            " UNION ALL"
+            " SELECT w.depth + 1, n.next, n.via, w.seen || n.next FROM walk w,"
+            " LATERAL (SELECT array_agg(next) AS next, array_agg(prev) AS via"
+            "  FROM (SELECT DISTINCT ON (e.next) e.next, e.prev"
+            f"   FROM ({_steps('w.frontier', edges, direction, True)}) e"
+            f"   WHERE NOT e.next = ANY(w.seen){cap}) s) n"
+            f" WHERE w.depth < %(depth)s{stop} AND n.next IS NOT NULL)")
+
+
+def neighbours(_id, edges=EDGES, direction='both', limit=MAX_ROWS,
+               _cursor=None):
+    '''[(edge, 'out'|'in', row)] one hop from _id, the first `limit`'''
+    cursor = _cursor or get_cursor()
+    cursor.execute("SELECT e.edge, e.dir, m.*"
+                   f" FROM ({_steps('%(id)s::uuid', edges, direction)}) e"
+                   " JOIN memories m ON m.id = e.next ORDER BY e.edge, m.id"
+                   " LIMIT %(limit)s",
+                   dict(id=_id, limit=limit))
+    rows = [(row[0], row[1], list(row[2:])) for row in cursor]
+    resolve_content([row for _e, _d, row in rows])
+    return rows
+
+
+def traverse(_id, depth=1, edges=EDGES, direction='both', limit=MAX_ROWS,
+             _cursor=None):
+    '''[(depth, row)] for every memory within `depth` hops of _id,
+    each at the depth it is first reached, nearest first'''
+    cursor = _cursor or get_cursor()
+    cursor.execute(_levels(direction, edges) +
+                   " SELECT w.depth, m.* FROM walk w"
+                   " CROSS JOIN LATERAL unnest(w.frontier) f(id)"
+                   " JOIN memories m ON m.id = f.id"
+                   " WHERE w.depth > 0 ORDER BY w.depth, m.id LIMIT %(limit)s",
+                   dict(id=_id, depth=depth, limit=limit))
+    rows = [(row[0], list(row[1:])) for row in cursor]
+    resolve_content([row for _d, row in rows])
+    return rows
+
+
+def ancestors(_id, depth=1, edges=('_parent',), **kw):
+    '''what _id points to, and what those point to, up to `depth` hops'''
+    return traverse(_id, depth, edges, 'out', **kw)
+
+
+def descendants(_id, depth=1, edges=('_parent',), **kw):
+    '''what points at _id, and at those, up to `depth` hops'''
+    return traverse(_id, depth, edges, 'in', **kw)
+
+
+def shortest_path(src, dst, edges=EDGES, direction='both', max_depth=6,
+                  limit=MAX_ROWS, _cursor=None):
+    '''the ids along a shortest path from src to dst, or None. the walk
+    goes level by level until one reaches dst, then the path is read
+    back through each level's predecessors. past `limit` ids it gives
+    up, a path through the ids cut off there isn't seen'''
+    if src == dst:
+        return [src]
+    cursor = _cursor or get_cursor()
+    cursor.execute(_levels(direction, edges, until='%(dst)s::uuid') +
+                   " SELECT frontier::text[], via::text[] FROM walk",
+                   dict(id=src, dst=dst, depth=max_depth, limit=limit))
+    prev = {}
+    for frontier, via in cursor:
+        prev.update(zip(frontier, via))
+        pass
+    if dst not in prev:
+        return None
+    path = [dst]
+    while (node:= prev[path[-1]]) is not None:
+        path.append(node)
+        pass
+    return path[::-1]
+
+
+class AdjacencyCache:
+    '''a hot subgraph in memory: everything within `depth` hops of
+    `root`, loaded with a single query. traversals inside it return ids
+    and never touch the database; refresh() after writes'''
+
+    def __init__(_, root, depth=2, edges=EDGES, _cursor=None):
+        _.root, _.depth, _.edges = root, depth, edges
+        _.out, _.inn = {}, {}
+        _.refresh(_cursor)
+        pass
+
+    def refresh(_, _cursor=None):
+        cursor = _cursor or get_cursor()
+        cols = ", ".join(f"m.{e}" for e in _.edges)
+        cursor.execute(_levels('both', _.edges, limit=False) +
+                       f" SELECT m.id, {cols} FROM walk w"
+                       " CROSS JOIN LATERAL unnest(w.frontier) f(id)"
+                       " JOIN memories m ON m.id = f.id",
+                       dict(id=_.root, depth=_.depth))
+        out, inn = {}, {}
+        for row in cursor:
+            _id = row[0]
+            out.setdefault(_id, [])
+            for e, other in zip(_.edges, row[1:]):
+                if other and other != _id:
+                    out[_id].append((e, other))
+                    inn.setdefault(other, []).append((e, _id))
+                    pass
+                pass
+            pass
+        _.out, _.inn = out, inn
+        pass
+
+    def __contains__(_, _id):
+        return _id in _.out
+
+    def neighbours(_, _id, direction='both'):
+        '''[(edge, 'out'|'in', id)]'''
+        result = []
+        if direction in ('out', 'both'):
+            result += [(e, 'out', n) for e, n in _.out.get(_id, ())]
+            pass
+        if direction in ('in', 'both'):
+            result += [(e, 'in', n) for e, n in _.inn.get(_id, ())]
+            pass
+        return result
+
+    def _bfs(_, src, direction, max_depth):
+        seen, queue = {src: None}, deque([(src, 0)])
+        while queue:
+            node, depth = queue.popleft()
+            yield node, depth, seen
+            if depth < max_depth:
+                for _e, _d, n in _.neighbours(node, direction):
+                    if n not in seen:
+                        seen[n] = node
+                        queue.append((n, depth + 1))
+                        pass
+                    pass
+                pass
+            pass
+        pass
+
+    def traverse(_, _id, depth=1, direction='both'):
+        '''[(depth, id)], nearest first'''
+        return [(d, n) for n, d, _seen in _._bfs(_id, direction, depth) if d]
+
+    def ancestors(_, _id, depth=1):
+        return _.traverse(_id, depth, 'out')
+
+    def descendants(_, _id, depth=1):
+        return _.traverse(_id, depth, 'in')
+
+    def shortest_path(_, src, dst, direction='both', max_depth=6):
+        for node, depth, seen in _._bfs(src, direction, max_depth):
+            if node == dst:
+                path = [node]
+                while (node:= seen[node]) is not None:
+                    path.append(node)
+                    pass
+                return path[::-1]
+            pass
+        return None
+    pass
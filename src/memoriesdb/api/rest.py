@@ -32,35 +32,256 @@ def _(session_id):
     return dict(result=result)
 
 
-@app.get ('/api/history/<session_id>')
-def _(session_id):
+def not_modified(session_id, newest_id):
+    '''sets ETag/Last-Modified from the newest id in the chain,
+    returns True when the client copy is still current (send a 304)'''
+    etag = f'"{session_id}.{newest_id}"'
+    B.response.set_header('ETag', etag)
+    B.response.set_header('Cache-Control', 'no-cache')
+    if newest_id:
+        B.response.set_header('Last-Modified',
+                              B.http_date(uuid_time(newest_id)))
+        pass
+    if inm:= B.request.get_header('If-None-Match'):
+        return etag in [_.strip() for _ in inm.split(',')] or inm == '*'
+    if ims:= B.request.get_header('If-Modified-Since'):
+        since = B.parse_date(ims.split(';')[0].strip())
+        return bool(newest_id and since and
+                    since >= int(uuid_time(newest_id)))
+    return False
+
+
+def render_history(rows, header, footer):
+    # deduplicated content in one query, not one per row2dict
+    rows = resolve_content([list(row) for row in rows])
     result = []
-    for row in load_full_session(session_id):
-        j = row2dict(row)
-        result.append(j)
-        print(f"J{j};")
+    result.append    (f'[{json.dumps( header        )},\n')
+    for row in rows:
+        result.append(f' {json.dumps( row2dict(row) )},\n')
         pass
-    return dict(result=result)
+    result.append    (f' {json.dumps( footer        )}]\n')
+    return result
 
 
-@app.get ('/api/history/')
-def _():
-    user_id = get_user_id()
-    sess_id = get_latest_session(user_id)
-    header = {'_type':'__head'}
-    if B.request.query.get('full'):
+PAGE_SIZE, MAX_PAGE_SIZE = 50, 1000
+
+
+def query_int(name, default, top):
+    '''?name= as an int clamped to 1..top, 400 when it isn't one'''
+    try:
+        return max(1, min(int(B.request.query.get(name) or default), top))
+    except ValueError:
+        raise B.HTTPError(400, f'bad {name}')
+
+
+def uuid_arg(value, name):
+    '''value when it is a uuid, 400 when it isn't one'''
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        raise B.HTTPError(400, f'bad {name}')
+    return value
+
+
+def history_page(user_id, sess_id):
+    '''keyset pagination: `?limit=N` for the newest page, then
+    `?cursor=<token>` (or a raw `?before=<id>`) to scroll back'''
+    q = B.request.query
+    limit = query_int('limit', PAGE_SIZE, MAX_PAGE_SIZE)
+    before = None
+    if token:= q.get('cursor'):
+        try:
+            start, before = decode_page_token(token)
+        except ValueError:
+            raise B.HTTPError(400, 'bad cursor')
+    elif before:= q.get('before'):
+        uuid_arg(before, 'before')
+        # the row may live in an older fork, start the walk from there
+        start = get_parent_id(before)
+    else:
+        start = sess_id
+        pass
+    # a cursor only pages through the session it was handed out for
+    if start != sess_id and start not in session_chain(user_id, sess_id):
+        raise B.HTTPError(400, 'cursor is not from this session')
+    sess_id = start
+    rows, next = load_session_page(user_id, sess_id, before, limit)
+    header = {'_type':'__head', 'limit':limit}
+    footer = {'_type':'__foot',
+              'next': encode_page_token(next) if next else None}
+    B.response.content_type = 'application/json'
+    return render_history(rows, header, footer)
+
+
+def history(user_id, sess_id, full=False):
+    '''conditional GET + `?after=<id>` delta mode over the session chain'''
+    if {'limit','before','cursor'} & set(B.request.query.keys()):
+        return history_page(user_id, sess_id)
+    if after:= B.request.query.get('after'):
+        uuid_arg(after, 'after')
+        pass
+    newest_id = get_newest_id(user_id, sess_id)
+    if not_modified(sess_id, newest_id):
+        B.response.status = 304
+        return ''
+    header = {'_type':'__head', 'newest':newest_id}
+    if full:
         header.update({
             'user':    row2dict( get_by_id(user_id).fetchone() ),
             'session': row2dict( get_by_id(sess_id).fetchone() ),
         })
+    if after:
+        header.update(after=after)
+        pass
     footer = {'_type':'__foot'}
-    result = []
-    result.append    (f'[{json.dumps( header        )},\n')
-    for row in load_full_session(user_id, sess_id):
-        result.append(f' {json.dumps( row2dict(row) )},\n')
+    B.response.content_type = 'application/json'
+    return render_history(load_full_session(user_id, sess_id, after or None),
+                          header, footer)
+
+
+@app.get ('/api/history/<session_id>')
+def _(session_id):
+    return history(get_user_id(), uuid_arg(session_id, 'session id'))
+
+
+@app.get ('/api/history/')
+def _():
+    user_id = get_user_id()
+    sess_id = get_latest_session(user_id)
+    return history(user_id, sess_id, B.request.query.get('full'))
+
+
+SEARCH_LIMIT, MAX_SEARCH_LIMIT = 10, 100
+
+
+@app.get ('/api/search')
+def _():
+    '''hybrid search: `?q=` words, `?type=` (repeatable), `?session=`,
+    `?limit=`, `?vector=0` for keywords only'''
+    q = B.request.query
+    if not (query:= q.get('q', '').strip()):
+        raise B.HTTPError(400, 'missing q')
+    limit = query_int('limit', SEARCH_LIMIT, MAX_SEARCH_LIMIT)
+    if session:= q.get('session'):
+        uuid_arg(session, 'session')
         pass
-    result.append    (f' {json.dumps( footer        )}]\n')
-    return result
+    embedding = None
+    if q.get('vector', '1') != '0':
+        from ..get_embeddings import get_truncated_embeddings
+        # without Ollama we still have the keyword half
+        embedding = (get_truncated_embeddings([query]) or [None])[0]
+        pass
+    import psycopg2
+    try:
+        rows = hybrid_search(query, embedding, limit, q.getall('type'),
+                             session or None)
+    except psycopg2.Error:
+        # the connection never commits, don't leave it aborted
+        get_dbconn().rollback()
+        raise
+    header = {'_type':'__head', 'q':query, 'limit':limit,
+              'vector': embedding is not None}
+    B.response.content_type = 'application/json'
+    return render_history(rows, header, {'_type':'__foot'})
+
+
+def json_value(text):
+    '''json.n=5 filters on the number, json.s="5" on the string'''
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+@app.get ('/api/memories')
+def _():
+    '''`?json.a.b=v` (repeatable, v is parsed as JSON when it can be),
+    `?has=a.b`, `?match=<jsonpath predicate>`, `?type=`, `?parent=`,
+    `?since=`/`?until=` (ISO times), `?limit=`'''
+    q = B.request.query
+    contains = {}
+    for key in q.keys():
+        if key.startswith('json.'):
+            for value in q.getall(key):
+                merge(contains, json_path(key[5:], json_value(value)))
+                pass
+            pass
+        pass
+    limit = query_int('limit', PAGE_SIZE, MAX_PAGE_SIZE)
+    import psycopg2
+    try:
+        rows = find_by_json(contains, q.getall('type'), q.get('parent'),
+                            q.getall('has'), q.get('match'),
+                            q.get('since'), q.get('until'), limit)
+    except psycopg2.Error as e:
+        # a malformed jsonpath or timestamp
+        get_dbconn().rollback()
+        raise B.HTTPError(400, f'bad filter: {e}')
+    rows = resolve_content([list(row) for row in rows])
+    return dict(result=[row2dict(row) for row in rows])
+
+
+def merge(into, other):
+    for k, v in other.items():
+        if isinstance(v, dict) and isinstance(into.get(k), dict):
+            merge(into[k], v)
+        elif k in into and into[k] != v:
+            # json.tag=a&json.tag=b: the array must hold both
+            old = into[k] if isinstance(into[k], list) else [into[k]]
+            into[k] = old + [v]
+        else:
+            into[k] = v
+            pass
+        pass
+    return into
+
+
+MAX_DEPTH = 6
+
+
+def graph_args(default_depth=1):
+    q = B.request.query
+    edges = tuple(q.getall('edge')) or None
+    depth = query_int('depth', default_depth, MAX_DEPTH)
+    if edges and not set(edges) <= set(EDGES):
+        raise B.HTTPError(400, f'edges are {EDGES}')
+    return edges, depth
+
+
+@app.get ('/api/graph/<_id>/<op:re:neighbours|ancestors|descendants>')
+def _(_id, op):
+    '''`?depth=N` hops (neighbours is always 1), `?edge=` (repeatable)'''
+    uuid_arg(_id, 'id')
+    edges, depth = graph_args()
+    import psycopg2
+    try:
+        if op == 'neighbours':
+            result = [dict(row2dict(row), _edge=edge, _dir=dir)
+                      for edge, dir, row in neighbours(_id, edges or EDGES)]
+        else:
+            walk = ancestors if op == 'ancestors' else descendants
+            kw = dict(edges=edges) if edges else {}
+            result = [dict(row2dict(row), _depth=d)
+                      for d, row in walk(_id, depth, **kw)]
+            pass
+    except psycopg2.Error:
+        get_dbconn().rollback()
+        raise
+    return dict(result=result)
+
+
+@app.get ('/api/graph/<src>/path/<dst>')
+def _(src, dst):
+    '''ids along a shortest path, `?depth=` caps its length'''
+    uuid_arg(src, 'src'), uuid_arg(dst, 'dst')
+    edges, depth = graph_args(MAX_DEPTH)
+    import psycopg2
+    try:
+        return dict(result=shortest_path(src, dst, edges or EDGES,
+                                         max_depth=depth))
+    except psycopg2.Error:
+        get_dbconn().rollback()
+        raise
 
 
 @app.get ('/')
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+'''reproducible benchmarks for the data layer and the hub.
+
+builds a throwaway database (BENCH_DB, default memories_bench) from
+sql/001_schema.sql, fills it with synthetic data and prints one JSON
+document of timings, so runs can be diffed across commits:
+
+    python -m memoriesdb.bench --out before.json
+    python -m memoriesdb.bench --out after.json
+    python -m memoriesdb.bench compare before.json after.json
+'''
+import os, sys, json, time, random, argparse, platform, contextlib
+import subprocess, threading
+from pathlib import Path
+
+SQL_DIR = Path(__file__).resolve().parents[2] / 'sql'
+BENCH_DB = os.getenv('BENCH_DB', 'memories_bench')
+from .api import EMBED_DIM # the column size, one source for everyone
+
+
+def quiet():
+    '''the data layer prints per row, keep that off the terminal
+    (the cost of the prints themselves is still measured)'''
+    return contextlib.redirect_stdout(open(os.devnull, 'w'))
+
+
+def timed(results, name, fn, n=None):
+    '''runs fn once, records wall time and (if it counts things) the rate'''
+    t0 = time.perf_counter()
+    with quiet():
+        count = fn()
+        pass
+    seconds = time.perf_counter() - t0
+    n = n or count
+    results[name] = dict(seconds=round(seconds, 6), n=n,
+                         per_sec=round(n / seconds, 2) if n else None)
+    print(f"{name:32} {seconds:10.4f}s  {n or '':>8}", file=sys.stderr)
+    return results[name]
+
+
+def percentiles(samples, ps=(50, 95, 99)):
+    samples = sorted(samples)
+    return {f'p{p}': samples[min(len(samples) - 1, len(samples) * p // 100)]
+            for p in ps} if samples else {}
+
+
+def create_database():
+    import psycopg2
+    kw = dict(host    =os.getenv('POSTGRES_HOST','localhost'),
+              user    =os.getenv('POSTGRES_USER','postgres'),
+              password=os.getenv('POSTGRES_PASSWORD'))
+    conn = psycopg2.connect(dbname='postgres', **kw)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS {BENCH_DB}')
+        cursor.execute(f'CREATE DATABASE {BENCH_DB}')
+        pass
+    conn.close()
+    conn = psycopg2.connect(dbname=BENCH_DB, **kw)
+    with conn.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS "vector"')
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS "uuid-ossp"')
+        cursor.execute((SQL_DIR / '001_schema.sql').read_text())
+        pass
+    conn.commit()
+    return conn
+
+
+def seed(conn, depth, messages, embedded):
+    '''categories/roles/user like 002_load-data.sql, then a fork chain
+    `depth` sessions deep holding `messages` history rows, then
+    `embedded` rows that already carry random embeddings'''
+    cursor = conn.cursor()
+
+    def insert(_type, _parent, content=None, **kw):
+        cols = ['_type', '_parent', 'content'] + list(kw)
+        cursor.execute(f"INSERT INTO memories ({','.join(cols)})"
+                       f" VALUES ({','.join(['%s'] * len(cols))}) RETURNING id",
+                       [_type, _parent, content] + list(kw.values()))
+        return cursor.fetchone()[0]
+
+    cursor.execute("SELECT uuid_generate_v1mc()")
+    category_id = cursor.fetchone()[0]
+    insert('category', category_id, 'category', id=category_id)
+    entity_id = insert('category', category_id, 'entity')
+    role_id = insert('category', category_id, 'role')
+    roles = [insert('role', role_id, name)
+             for name in ('system', 'assistant', 'user', 'tool', 'toolcall')]
+    user_id = insert('user', entity_id, _json='{"name":"bench"}')
+
+    cursor.execute("SELECT uuid_generate_v1mc()")
+    session_id = cursor.fetchone()[0]
+    insert('session', user_id, _src=session_id, id=session_id)
+    per_session = max(1, messages // depth)
+    for n in range(depth):
+        if n:
+            session_id = insert('session', user_id, _src=session_id)
+            pass
+        insert('model', session_id, 'llama3.1')
+        cursor.execute("INSERT INTO memories (_type, _parent, role, content)"
+                       " SELECT 'history', %s, (%s::UUID[])[1 + g %% 2],"
+                       "        'synthetic message ' || g || ' '"
+                       "        || repeat('lorem ipsum ', 1 + g %% 20)"
+                       "   FROM generate_series(1, %s) g",
+                       (session_id, roles[1:3], per_session))
+        pass
+    conn.commit()
+
+    if embedded:
+        # bulk load without the enqueue trigger, these are already embedded
+        cursor.execute("SET session_replication_role = replica")
+        for start in range(0, embedded, 100_000):
+            # triggers are off, so content__tsv is filled in here
+            cursor.execute("INSERT INTO memories"
+                           " (_type, _parent, content, content__embeddings,"
+                           "  content__tsv)"
+                           " SELECT 'note', %s, 'note ' || g,"
+                           "  (SELECT array_agg(random() + g * 0)"
+                           "     FROM generate_series(1, %s))::VECTOR,"
+                           "  to_tsvector('english', 'note ' || g)"
+                           " FROM generate_series(%s, %s) g",
+                           (user_id, EMBED_DIM, start,
+                            min(embedded, start + 100_000) - 1))
+            conn.commit()
+            pass
+        cursor.execute("SET session_replication_role = DEFAULT")
+        pass
+    cursor.execute("ANALYZE memories")
+    conn.commit()
+    return user_id, session_id
+
+
+class StubEmbedder(threading.Thread):
+    '''a local stand-in for Ollama's /api/embed'''
+
+    def __init__(_, dim=1024):
+        super().__init__(daemon=True)
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(
+                    int(self.headers['Content-Length'])))
+                inputs = body['input']
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                out = json.dumps(dict(embeddings=[
+                    [random.random() for _ in range(dim)]
+                    for _ in inputs])).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+                pass
+
+            def log_message(self, *a):
+                pass
+            pass
+
+        _.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        _.url = f'http://127.0.0.1:{_.server.server_port}'
+        pass
+
+    def run(_):
+        _.server.serve_forever()
+    pass
+
+
+def bench_data(args, results):
+    conn = create_database()
+    t0 = time.perf_counter()
+    user_id, session_id = seed(conn, args.depth, args.messages, args.embedded)
+    results['seed'] = dict(seconds=round(time.perf_counter() - t0, 3),
+                           depth=args.depth, messages=args.messages,
+                           embedded=args.embedded)
+    conn.close()
+
+    stub = StubEmbedder()
+    stub.start()
+    os.environ.update(POSTGRES_DB=BENCH_DB, OLLAMA_HOST=stub.url,
+                      USER_ID=str(user_id))
+    from . import api
+    from .api import rest
+    with quiet():
+        api.init()
+        pass
+
+    rows = []
+
+    def load_full_session():
+        rows.extend(api.load_full_session(user_id, session_id))
+        return len(rows)
+    timed(results, 'load_full_session', load_full_session)
+
+    def load_session_page():
+        return len(api.load_session_page(user_id, session_id)[0])
+    timed(results, 'load_session_page', load_session_page)
+
+    def row2dict():
+        return len([api.row2dict(list(row)) for row in rows])
+    timed(results, 'row2dict', row2dict)
+
+    def history_serialize():
+        ''.join(rest.render_history(rows, {'_type':'__head'},
+                                    {'_type':'__foot'}))
+        return len(rows)
+    timed(results, 'history_serialize', history_serialize)
+
+    def insert_new_history():
+        for n in range(args.inserts):
+            api.insert_new_history(session_id, f'bench insert {n}')
+            pass
+        return args.inserts
+    timed(results, 'insert_new_history', insert_new_history)
+
+    from . import embedding_loop
+    embedding_loop.PG_URI = (f"postgres://{os.getenv('POSTGRES_USER','postgres')}"
+                             f":{os.getenv('POSTGRES_PASSWORD','')}"
+                             f"@{os.getenv('POSTGRES_HOST','localhost')}/{BENCH_DB}")
+
+    def embed_jobs():
+        embedding_loop.connect()
+        done = 0
+        while done < args.embed_jobs and (jobs:= embedding_loop.poll()):
+            embedding_loop.process(jobs)
+            done += len(jobs)
+            pass
+        return done
+    timed(results, 'embedding_loop', embed_jobs)
+
+    if args.embedded:
+        query = [random.random() for _ in range(EMBED_DIM)]
+        for mode in ('full', 'halfvec', 'binary'):
+            samples = []
+            for _ in range(args.searches):
+                t0 = time.perf_counter()
+                api.search_similar(query, 10, mode).fetchall()
+                samples.append(time.perf_counter() - t0)
+                pass
+            results[f'search_similar_{mode}'] = dict(
+                n=len(samples), seconds=round(sum(samples), 6),
+                **{k: round(v, 6) for k, v in percentiles(samples).items()})
+            pass
+        samples = []
+        for n in range(args.searches):
+            t0 = time.perf_counter()
+            api.hybrid_search(f'note {n}', query, 10).fetchall()
+            samples.append(time.perf_counter() - t0)
+            pass
+        api.get_dbconn().rollback()
+        results['hybrid_search'] = dict(
+            n=len(samples), seconds=round(sum(samples), 6),
+            **{k: round(v, 6) for k, v in percentiles(samples).items()})
+        pass
+    # no 'seconds', compare leaves it alone
+    results['statements'] = dict(prepared=api.PREPARE,
+                                 stats=api.statement_stats())
+    pass
+
+
+def bench_hub(args):
+    '''runs in its own process, the hub wants gevent patched first'''
+    from . import hub
+
+    class FakeWS:
+        nbytes = 0
+
+        def send(_, raw):
+            FakeWS.nbytes += len(raw)
+        pass
+
+    app = hub.Application()
+    subscribers = [FakeWS() for _ in range(args.subscribers)]
+    for ws in subscribers:
+        app.subscribe(ws, ['bench'])
+        pass
+    msg = dict(method='pub', params=dict(channel='bench',
+                                         content='x' * args.message_size))
+    raw = json.dumps(msg)
+    samples = []
+    with quiet():
+        t0 = time.perf_counter()
+        for _ in range(args.publishes):
+            t1 = time.perf_counter()
+            app.pub_raw(None, 'bench', raw, msg)
+            samples.append(time.perf_counter() - t1)
+            pass
+        seconds = time.perf_counter() - t0
+        pass
+    return dict(subscribers=args.subscribers, publishes=args.publishes,
+                seconds=round(seconds, 6),
+                per_sec=round(args.publishes / seconds, 2),
+                deliveries_per_sec=round(
+                    args.publishes * args.subscribers / seconds, 2),
+                bytes_out=FakeWS.nbytes,
+                **{k: round(v, 6) for k, v in percentiles(samples).items()})
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=SQL_DIR.parent, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def compare(old, new):
+    old, new = json.load(open(old)), json.load(open(new))
+    print(f"{'benchmark':32} {'old':>10} {'new':>10} {'ratio':>7}")
+    for name, r in new['results'].items():
+        if name in old['results'] and 'seconds' in r:
+            a, b = old['results'][name]['seconds'], r['seconds']
+            print(f"{name:32} {a:10.4f} {b:10.4f} {b / a if a else 0:7.2f}")
+            pass
+        pass
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('what', nargs='?', default='all',
+                        choices=['all', 'data', 'hub', 'compare'])
+    parser.add_argument('files', nargs='*', help='for compare: old new')
+    parser.add_argument('--depth', type=int, default=50,
+                        help='sessions in the fork chain')
+    parser.add_argument('--messages', type=int, default=100_000,
+                        help='history rows spread over the chain')
+    parser.add_argument('--embedded', type=int, default=100_000,
+                        help='rows with embeddings (try 1000000)')
+    parser.add_argument('--inserts', type=int, default=2_000)
+    parser.add_argument('--embed-jobs', type=int, default=2_000)
+    parser.add_argument('--searches', type=int, default=50)
+    parser.add_argument('--subscribers', type=int, default=1_000)
+    parser.add_argument('--publishes', type=int, default=1_000)
+    parser.add_argument('--message-size', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='write the JSON here too')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    if args.what == 'compare':
+        return compare(*args.files)
+    if args.what == 'hub':
+        return print(json.dumps(bench_hub(args)))
+
+    results = {}
+    if args.what in ('all', 'data'):
+        bench_data(args, results)
+        pass
+    if args.what == 'all':
+        out = subprocess.check_output(
+            [sys.executable, '-m', 'memoriesdb.bench', 'hub',
+             '--subscribers', str(args.subscribers),
+             '--publishes', str(args.publishes),
+             '--message-size', str(args.message_size)], text=True)
+        results['hub_fanout'] = json.loads(out.strip().splitlines()[-1])
+        pass
+    doc = json.dumps(dict(
+        meta=dict(commit=git_commit(), time=time.time(),
+                  python=platform.python_version(),
+                  machine=platform.machine(), args=vars(args)),
+        results=results), indent=1)
+    if args.out:
+        Path(args.out).write_text(doc + '\n')
+        pass
+    print(doc)
+    pass
+
+
+if __name__ == '__main__':
+    main()
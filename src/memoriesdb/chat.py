@@ -2,6 +2,7 @@
 from gevent import monkey as _;_.patch_all()
 import os, sys, time, json, websocket, gevent
 from gevent.fileobject import FileObject
+from . import framing
 
 # This makes stdin's FD non-blocking and replaces sys.stdin with
 # a wrapper that is integrated into the event loop
@@ -9,13 +10,10 @@ stdin = FileObject(sys.stdin)
 
 
 def recv(ws):
-    raw = ws.recv()
-    if not raw:
-        raise EOFError
-    return json.loads(raw)
+    return framing.recv(ws)
 
 def send(ws, msg):
-    return ws.send( json.dumps(msg) )
+    return framing.send(ws, msg)
 
 def mesg(method, **params):
     return dict(method=method, params=params)
@@ -34,7 +32,7 @@ CH_OUT = os.getenv('CH_OUT',CH+'-out')
 CHANNELS = [CH_OUT]
 
 WS_BASE = f"ws://localhost:5002/ws"
-WS_ARGS = '?c='+'&c='.join(CHANNELS)
+WS_ARGS = '?c='+'&c='.join(CHANNELS)+'&f='+framing.FORMAT
 
 
 def main():
@@ -47,16 +45,42 @@ def main():
             pass
         return content
 
-    ws = websocket.WebSocket()
-    ws.connect(WS_BASE + WS_ARGS)
+    # last seq seen, so a reconnect only replays what we missed
+    hub = dict(ws=None, seq=None, epoch=None)
+
+    def connect():
+        args = WS_ARGS
+        if hub['seq'] is not None:
+            args += f"&since={hub['seq']}&epoch={hub['epoch']}"
+            pass
+        ws = websocket.WebSocket()
+        ws.connect(WS_BASE + args)
+        hub['ws'] = ws
+        pass
+
+    connect()
 
     def ws_once():
-        msg = recv(ws)
+        msg = recv(hub['ws'])
         method = msg.get('method')
         params = msg.get('params',{})
+        seq = msg.get('seq')
         if   method=='initialize':
             print("INIT", params)
+            if params.get('gap'):
+                print("MISSED SOME OUTPUT, SEE /api/history/")
+                pass
+            if params.get('gap') or params.get('epoch') != hub['epoch']:
+                # a new hub numbers from scratch, our old seq would hide
+                # everything it sends. after a gap, whatever gets
+                # replayed is news to us
+                hub['seq'] = 0 if params.get('replayed') else params.get('seq')
+                pass
+            hub['epoch'] = params.get('epoch')
         elif method=='pub':
+            if seq and hub['seq'] is not None and seq <= hub['seq']:
+                return # already seen, replay overlapped
+            hub['seq'] = seq or hub['seq']
             print("PUB", params)                    
         else:
             print("*"*80)
@@ -65,14 +89,26 @@ def main():
             pass
         pass
     
+    def reconnect(tries=5):
+        for n in range(tries):
+            time.sleep(2 ** n * 0.2)
+            try:
+                return connect()
+            except Exception as e:
+                print("RECONNECT FAILED", e)
+                pass
+            pass
+        print("SERVER EOF, EXIT OUT ALL THE WAY")
+        raise sys.exit(2)
+
     def ws_loop():
         while 1:
             try:
                 ws_once()
                 time.sleep(0.2)
-            except:
-                print("SERVER EOF, EXIT OUT ALL THE WAY")
-                raise sys.exit(2)
+            except Exception:
+                print("SERVER EOF, RECONNECTING")
+                reconnect()
             pass
         pass
     
@@ -83,7 +119,7 @@ def main():
                 role = 'system'
                 content = content[len('system: '):]
                 pass
-            pub(ws, CH_IN, content, role=role)
+            pub(hub['ws'], CH_IN, content, role=role)
             pass
         return print("EOF")
 
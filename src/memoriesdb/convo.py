@@ -1,17 +1,17 @@
 #!/usr/bin/env python3
 from gevent import monkey as _;_.patch_all()
-import os, time, json, websocket, ollama, memoriesdb.funcs2 as funcs
+import os, time, json, websocket
+# ollama and the tool module are imported when first needed,
+# see Convo.__init__ and Convo.chat
 from .api import *
+from . import framing, response_cache, model_manager
 
 
 def recv(ws):
-    raw = ws.recv()
-    if not raw:
-        raise EOFError
-    return json.loads(raw)
+    return framing.recv(ws)
 
 def send(ws, msg):
-    return ws.send( json.dumps(msg) )
+    return framing.send(ws, msg)
 
 def mesg(method, **params):
     return dict(method=method, params=params)
@@ -30,14 +30,23 @@ WS_BASE = "ws://localhost:5002/ws"
 
 class Convo:
     
-    def __init__(_,tools=funcs.Tools, model='llama3.1'):
-        _.tools, _.model, _.messages, _.ws = tools, model, [], None
+    def __init__(_,tools=None, model='llama3.1'):
+        import memoriesdb.funcs2 as funcs
+        _.funcs = funcs
+        _.tools = funcs.Tools if tools is None else tools
+        _.model, _.messages, _.ws = model, [], None
+        _.session_models, _.routed = [], False
+        _.cache = response_cache.get_cache() # shared by every Convo
+        _.models = None
+        if model_manager.ENABLED:
+            _.models = model_manager.get_manager()
+            pass
         pass
 
     def connect_ws(_):
         '''we do it this way so error don't leave garbage in _.ws'''
         ws = websocket.WebSocket()
-        ws.connect(f'{WS_BASE}?c={IN_CHANNEL}')
+        ws.connect(f'{WS_BASE}?c={IN_CHANNEL}&f={framing.FORMAT}')
         _.ws = ws
         pass
 
@@ -58,22 +67,49 @@ class Convo:
         content =  json.dumps( tool_calls )
         _id = insert_new_history( session_id,
                                   content  =  json.dumps( tool_calls ),
-                                  role='tool', action="toolcall" )
+                                  role='tool', action="toolcall",
+                                  tool=name )
         _.messages.append(  dict( role='tool', tool_calls=tool_calls )  )
         content = str(output)
-        _id = insert_new_history(session_id, content, role='tool', action="toolreturn")
+        _id = insert_new_history(session_id, content, role='tool',
+                                 action="toolreturn", tool=name)
         _.messages.append(dict(role='tool',
                                content=content,
                                name=name))
         pass
 
-    def chat(_) -> ollama.ChatResponse:
-        return ollama.chat(_.model,
-                           messages=_.messages,
-                           tools=_.tools,
-                           #stream=True,
-                           #format='json',
-                           )
+    def route_model(_):
+        '''the session's own models are as good, take one that is loaded.
+        once per session, on its first chat, so it never flips mid-way;
+        a switch is recorded as a model row'''
+        if _.routed or not _.models:
+            return
+        _.routed = True
+        model = _.models.route([_.model] + _.session_models)
+        if model and model != (_.session_models or [None])[0]:
+            insert_new_model(model, _.session_id)
+            pass
+        _.model = model or _.model
+        pass
+
+    def chat(_) -> 'ollama.ChatResponse':
+        import ollama
+        _.route_model()
+        key = _.cache and _.cache.key(_.model, _.tools, _.messages)
+        if hit:= _.cache and _.cache.get(key):
+            print("CACHED RESPONSE", hit.cached)
+            return hit
+        response = ollama.chat(_.model,
+                               messages=_.messages,
+                               tools=_.tools,
+                               keep_alive=_.models and _.models.keep_alive,
+                               #stream=True,
+                               #format='json',
+                               )
+        if key:
+            _.cache.put(key, response.message)
+            pass
+        return response
 
     def process_tool_response_message(_, message):
         if not message:
@@ -97,7 +133,7 @@ class Convo:
             content = arguments['message']
             print(">> RESPOND TO USER (VIA TOOL) <<", content)
             _.send_output(content, role)
-        elif function_to_call := getattr(funcs, name, ''):
+        elif function_to_call := getattr(_.funcs, name, ''):
             print(">> EVAL FUNC TOOL CALL <<")
             print('Calling function:', name)
             print('Arguments:', arguments)
@@ -179,11 +215,12 @@ class Convo:
 
     def load_session(_, user_id, session_id):
         _.history = load_full_session(user_id, session_id)
-        messages = []
+        messages, models = [], []
         for message in _.history:
             d1 = row2dict(message)
             if d1['_type'] == 'model':
                 print("RESET THE MODEL", d1)
+                models.append(d1['content'])
                 if not _.model:
                     _.model = d1['content']
                     print("SET THE MODEL", _.model)
@@ -196,6 +233,8 @@ class Convo:
             messages.insert(0, d2)
             pass
         _.messages = messages
+        # newest first, see route_model
+        _.session_models, _.routed = models, False
         print("MODEL", _.model)
         pass
 
@@ -219,6 +258,10 @@ class Convo:
 
 if __name__=='__main__':
     init()
+    if port:= int(os.getenv('CONVO_METRICS_PORT', 0)):
+        from . import metrics
+        metrics.serve(port)
+        pass
 
     user_id = get_user_id()
     print("user_id", user_id)
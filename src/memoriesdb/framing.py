@@ -0,0 +1,87 @@
+'''wire framing for hub messages, negotiated per connection with ?f=
+
+text frames are JSON, which is all browsers ever send or get.
+binary frames start with a one byte tag:
+  b'M' msgpack
+  b'Z' zlib compressed msgpack (bodies of COMPRESS_MIN bytes or more)
+msgpack is optional, without it everybody speaks JSON.
+
+clients ask for FORMAT but send JSON until the hub's initialize says
+which format it agreed to, a hub without msgpack answers json'''
+import os, json, zlib, weakref
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+    pass
+
+FORMATS = ('json', 'msgpack') if msgpack else ('json',)
+
+# what our own python clients ask the hub for
+FORMAT = os.getenv('WS_FORMAT', FORMATS[-1])
+COMPRESS_MIN = int(os.getenv('WS_COMPRESS_MIN', 1024))
+
+
+def negotiate(fmt):
+    return fmt if fmt in FORMATS else 'json'
+
+
+_negotiated = weakref.WeakKeyDictionary() # client ws -> agreed format
+
+
+def track(ws, msg):
+    '''remembers the format the hub answered with in initialize'''
+    if isinstance(msg, dict) and msg.get('method') == 'initialize':
+        _negotiated[ws] = negotiate(msg.get('params', {}).get('format'))
+        pass
+    return msg
+
+
+def format_of(raw):
+    if isinstance(raw, str):
+        return 'json'
+    return 'msgpack' if raw[:1] in (b'M', b'Z') else 'json'
+
+
+def encode(msg, fmt='json', compress_min=COMPRESS_MIN):
+    if fmt != 'msgpack' or not msgpack:
+        return json.dumps(msg)
+    body = msgpack.packb(msg, use_bin_type=True)
+    if compress_min and len(body) >= compress_min:
+        return b'Z' + zlib.compress(body, 1)
+    return b'M' + body
+
+
+def decode(raw):
+    '''ValueError for anything that doesn't decode'''
+    if isinstance(raw, str):
+        return json.loads(raw)
+    tag, body = raw[:1], bytes(raw[1:])
+    if tag in (b'M', b'Z') and not msgpack:
+        raise ValueError('msgpack frame, but msgpack is not installed')
+    try:
+        if tag == b'Z':
+            return msgpack.unpackb(zlib.decompress(body), raw=False)
+        if tag == b'M':
+            return msgpack.unpackb(body, raw=False)
+    except zlib.error as e:
+        raise ValueError(f'bad compressed frame: {e}')
+    return json.loads(raw)
+
+
+def send(ws, msg, fmt=None):
+    '''in the format negotiated for `ws` (see track), unless given'''
+    frame = encode(msg, fmt or _negotiated.get(ws, 'json'))
+    if isinstance(frame, bytes) and hasattr(ws, 'send_binary'):
+        # websocket-client wants binary frames asked for explicitly,
+        # geventwebsocket picks the opcode from the type
+        return ws.send_binary(frame)
+    return ws.send(frame)
+
+
+def recv(ws):
+    raw = ws.recv()
+    if not raw:
+        raise EOFError
+    return track(ws, decode(raw))
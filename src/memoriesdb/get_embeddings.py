@@ -1,60 +1,218 @@
 #!/usr/bin/env python
+import os
+import math
+import time
+import random
 import requests
+import requests.adapters
 import json
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .api import EMBED_DIM
 
-def get_truncated_embeddings(text, model="snowflake-arctic-embed2:568m", output_dim=384):
+DEFAULT_MODEL = os.getenv('EMBED_MODEL', "snowflake-arctic-embed2:568m")
+
+# Matryoshka (MRL) models keep most of their quality in the leading
+# dimensions, so we can cut them down client-side and renormalize.
+# Their native sizes; any other model has to return exactly EMBED_DIM values.
+MODEL_DIMS = {
+    "snowflake-arctic-embed2:568m": 1024,
+}
+
+def embedding_dim(model=DEFAULT_MODEL):
+    """
+    The output dimension for a model: api.EMBED_DIM, the size of the VECTOR(n) column.
+    """
+    return EMBED_DIM
+
+def check_dim(model, vector, output_dim):
+    """
+    Raises ValueError when the model's vectors can't become output_dim ones: too short,
+    or of another size from a model that isn't known to be MRL (cutting would ruin them).
+    """
+    if output_dim and (len(vector) < output_dim or
+                       (len(vector) != output_dim and model not in MODEL_DIMS)):
+        raise ValueError(f"{model} returns {len(vector)} dimensions,"
+                         f" the column has {output_dim} (EMBED_DIM)")
+
+def truncate_embedding(vector, output_dim):
+    """
+    Truncates an MRL embedding to its first output_dim values and rescales it back to unit length.
+
+    Args:
+        vector (list): The full-size embedding.
+        output_dim (int): The number of leading dimensions to keep (None keeps them all).
+
+    Returns:
+        list: The truncated, L2-normalized embedding.
+    """
+    vector = vector[:output_dim] if output_dim else vector
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+OLLAMA_URL = os.getenv('OLLAMA_HOST', "http://localhost:11434")
+
+class OllamaBackend:
+    """
+    Posts batches to Ollama's /api/embed over one keep-alive, pooled HTTP session.
+
+    Any callable with the same (model, inputs) -> list-of-vectors signature can
+    stand in for it, e.g. to run against a local stub server or in-process fake.
+    """
+
+    def __init__(self, url=OLLAMA_URL, pool_size=16, timeout=(3.05, 60)):
+        self.url = url.rstrip('/') + "/api/embed"
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __call__(self, model, inputs):
+        response = self.session.post(self.url, timeout=self.timeout,
+                                     json={"model": model, "input": inputs})
+        response.raise_for_status()  # Raise an exception for bad status codes
+        return response.json()["embeddings"]
+
+class EmbeddingClient:
+    """
+    A reusable embedding client: micro-batches inputs, keeps up to `concurrency`
+    batches in flight and retries transient failures with exponential backoff.
+
+    Args:
+        model (str): The Ollama model with MRL support.
+        output_dim (int): Truncation size (default: embedding_dim(model)).
+        backend (callable): (model, inputs) -> vectors (default: OllamaBackend()).
+        batch_size (int): Inputs per request.
+        concurrency (int): Requests in flight at once.
+        retries (int): Extra attempts for connection errors, timeouts, 429 and 5xx.
+        backoff (float): First retry delay in seconds, doubled on every attempt.
+    """
+
+    def __init__(self, model=DEFAULT_MODEL, output_dim=None, backend=None,
+                 batch_size=32, concurrency=4, retries=3, backoff=0.5):
+        self.model = model
+        self.output_dim = output_dim or embedding_dim(model)
+        self.backend = backend or OllamaBackend(pool_size=concurrency)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+
+    def _retryable(self, e):
+        if isinstance(e, requests.exceptions.HTTPError):
+            status = e.response.status_code if e.response is not None else 0
+            return status == 429 or status >= 500
+        return isinstance(e, (requests.exceptions.ConnectionError,
+                              requests.exceptions.Timeout))
+
+    def embed(self, texts):
+        """
+        Embeds one batch (a str or a list of str) with retries.
+
+        Returns:
+            list: One truncated, normalized vector per input.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                vectors = self.backend(self.model, texts)
+                for v in vectors:
+                    check_dim(self.model, v, self.output_dim)
+                return [truncate_embedding(v, self.output_dim) for v in vectors]
+            except requests.exceptions.RequestException as e:
+                if attempt == self.retries or not self._retryable(e):
+                    raise
+                delay = self.backoff * 2 ** attempt
+                time.sleep(delay + random.uniform(0, delay / 2))
+
+    def check(self):
+        """
+        Embeds a probe, so a model/EMBED_DIM mismatch fails at startup (ValueError).
+        """
+        self.embed(["dimension check"])
+
+    def embed_iter(self, texts):
+        """
+        Streams embeddings for an iterable of texts in input order, never holding more
+        than `concurrency` batches in flight, so huge inputs run in constant memory.
+        """
+        batches = _batched(texts, self.batch_size)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            pending = deque()
+            for batch in batches:
+                pending.append(pool.submit(self.embed, batch))
+                if len(pending) >= self.concurrency:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def embed_many(self, texts):
+        return list(self.embed_iter(texts))
+
+def _batched(iterable, n):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+_clients = {}
+
+def get_client(model=DEFAULT_MODEL, output_dim=None):
+    """
+    The shared EmbeddingClient for a model, so callers reuse its connection pool.
+    """
+    key = (model, output_dim or embedding_dim(model))
+    if key not in _clients:
+        _clients[key] = EmbeddingClient(model, output_dim)
+    return _clients[key]
+
+def get_truncated_embeddings(text, model=DEFAULT_MODEL, output_dim=None):
     """
     Gets truncated embeddings for a given text using the Ollama API with MRL.
 
+    The embed endpoint always returns the model's native size, so the truncation
+    and renormalization happen here.
+
     Args:
-        text (str): The text to embed.
+        text (str): The text (or list of texts) to embed.
         model (str): The Ollama model with MRL support (default: snowflake-arctic-embed2:568m).
-        output_dim (int): The desired output dimensionality for the truncated embedding (default: 384).
+        output_dim (int): The desired output dimensionality for the truncated embedding (default: embedding_dim(model)).
 
     Returns:
-        list: A list of floats representing the truncated embedding vector.
-    """
-    url = "http://localhost:11434/api/embed"
-    payload = {
-        "model": model,
-        "input": text,
-        "options": {
-            "num_predict": output_dim # Specify the truncation dimension
-        }
-    }
+        list: A list of truncated embedding vectors, one per input.
+    """
+    texts = [text] if isinstance(text, str) else text
     try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        result = response.json()
-        return result["embeddings"]
+        # micro-batched, a few requests in flight
+        return get_client(model, output_dim).embed_many(texts)
     except requests.exceptions.RequestException as e:
         print(f"Error getting embeddings from Ollama: {e}")
         return None
 
-def process_file_and_get_truncated_embeddings(filename, output_dim=384, ollama_model="snowflake-arctic-embed2:568m"):
+def process_file_and_get_truncated_embeddings(filename, output_dim=None, ollama_model=DEFAULT_MODEL):
     """
     Reads a file, gets truncated embeddings from Ollama for each line, and returns a list of embeddings.
 
+    Lines are sent in concurrent micro-batches through the shared EmbeddingClient.
+
     Args:
         filename (str): The path to the text file to encode.
-        output_dim (int): The desired output dimensionality for the truncated embeddings (default: 384).
+        output_dim (int): The desired output dimensionality for the truncated embeddings (default: embedding_dim(ollama_model)).
         ollama_model (str): The Ollama model with MRL support (default: snowflake-arctic-embed2:568m).
 
     Returns:
-        list: A list of truncated embeddings (or None if an error occurred).
+        list: A list of truncated embeddings, one per line (or None if an error occurred).
     """
-    truncated_embeddings = []
+    client = get_client(ollama_model, output_dim)
     try:
         with open(filename, 'r', encoding='utf-8') as f:
-            for line in f:
-                # Get truncated embeddings for each line
-                print("X")
-                embedding = get_truncated_embeddings(line.strip(), model=ollama_model, output_dim=output_dim)
-                if embedding:
-                    truncated_embeddings.append(embedding)
-                else:
-                    print(f"Warning: Could not get embedding for line: '{line.strip()}'")
+            truncated_embeddings = client.embed_many(line.strip() for line in f)
 
     except FileNotFoundError:
         print(f"Error: File '{filename}' not found.")
@@ -72,8 +230,8 @@ def process_file_and_get_truncated_embeddings(filename, output_dim=384, ollama_m
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Encode a file using Ollama with MRL and get truncated embeddings.")
     parser.add_argument("filename", type=str, help="The path to the text file to encode.")
-    parser.add_argument("--output_dim", type=int, default=384, help="The desired output dimensionality for the truncated embeddings (default: 384).")
-    parser.add_argument("--ollama_model", type=str, default="snowflake-arctic-embed2:568m", help="The Ollama model with MRL support (default: snowflake-arctic-embed2:568m).")
+    parser.add_argument("--output_dim", type=int, default=None, help="The desired output dimensionality for the truncated embeddings (default: per model, 384 for snowflake-arctic-embed2).")
+    parser.add_argument("--ollama_model", type=str, default=DEFAULT_MODEL, help="The Ollama model with MRL support (default: snowflake-arctic-embed2:568m).")
     args = parser.parse_args()
 
     truncated_embeddings = process_file_and_get_truncated_embeddings(args.filename, args.output_dim, args.ollama_model)
@@ -5,32 +5,30 @@ import os
 import sys
 import time
 import json
+import uuid
 import gevent
-from gevent.fileobject import FileObject
+from collections import deque
 from bottle import Bottle, request, response, redirect, static_file, app
 #from websocket import WebSocket
 from geventwebsocket import WebSocketServer, WebSocketError
 from geventwebsocket.websocket import (
     MSG_CLOSED, MSG_ALREADY_CLOSED, MSG_SOCKET_DEAD)
-
-# This makes stdin's FD non-blocking and replaces sys.stdin with
-# a wrapper that is integrated into the event loop
-stdin = FileObject(sys.stdin)
+from . import metrics, framing, uploads, static
 
 def recv(ws):
     raw = ws.recv()
     if not raw:
         raise EOFError
-    return json.loads(raw)
+    return framing.decode(raw)
 
 def recv2(ws):
     raw = ws.recv()
     if not raw:
         raise EOFError
-    return json.loads(raw), raw
+    return framing.decode(raw), raw
 
-def send(ws, msg):
-    return ws.send( json.dumps(msg) )
+def send(ws, msg, fmt='json'):
+    return ws.send( framing.encode(msg, fmt) )
 
 def mesg(method, **params):
     return dict(method=method, params=params)
@@ -66,57 +64,253 @@ def add_cors_headers(headers, origin=''):
 #    return ws
 
 
+SOCKETS   = metrics.Gauge('hub_sockets', 'connected websockets')
+PUBLISHED = metrics.Counter('hub_published_total',
+                            'messages published', ('channel',))
+BYTES_IN  = metrics.Counter('hub_bytes_in_total', 'bytes received')
+BYTES_OUT = metrics.Counter('hub_bytes_out_total', 'bytes sent')
+SEND_SECONDS = metrics.Histogram('hub_send_seconds',
+                                 'latency of one ws.send to a subscriber',
+                                 buckets=(.0001, .0005, .001, .005, .01,
+                                          .05, .1, .5, 1))
+STARTED = time.time()
+EPOCH = uuid.uuid4().hex # seqs are only meaningful within one hub run
+
+REPLAY_MESSAGES = int(os.getenv('HUB_REPLAY', 256))  # per channel
+REPLAY_BYTES = int(os.getenv('HUB_REPLAY_BYTES', 1<<20))
+REPLAY_TOTAL = int(os.getenv('HUB_REPLAY_TOTAL', 64<<20)) # all rings
+REPLAY_IDLE  = float(os.getenv('HUB_REPLAY_IDLE', 300))  # seconds
+
+
+class Ring:
+    '''the last few messages of a channel, capped by count and bytes'''
+
+    def __init__(_, maxlen=REPLAY_MESSAGES, maxbytes=REPLAY_BYTES):
+        _.items, _.nbytes, _.maxlen, _.maxbytes = deque(), 0, maxlen, maxbytes
+        _.dropped = 0 # newest seq that fell off, replays from before it have gaps
+        _.touched = time.time()
+        pass
+
+    def append(_, seq, msg, size):
+        _.items.append((seq, msg, size))
+        _.nbytes += size
+        _.touched = time.time()
+        while _.items and (len(_.items) > _.maxlen or _.nbytes > _.maxbytes):
+            _.dropped, _msg, dropped_size = _.items.popleft()
+            _.nbytes -= dropped_size
+            pass
+        pass
+
+    def since(_, seq):
+        return [item for item in _.items if item[0] > seq]
+    pass
+
+
 class Application(Bottle):
 
     Channel = dict()
+    Format  = dict() # ws -> negotiated framing, json unless asked
+    cluster = None   # see memoriesdb.cluster, set up by run()
+    Replay  = dict() # channel -> Ring
+    Seq     = 0
+    Evicted = 0      # newest seq in a ring evict() threw away
+    Held    = dict() # ws -> live frames held back until its replay is out
 
     def subscribe(_, ws, channels):
         rec = (hex(id(ws)), ws)
+        fresh = False
         for name in channels:
             try:
                 _.Channel[name].append(rec)
             except:
                 _.Channel[name] = [rec]
+                fresh = True
+        if fresh and _.cluster:
+            _.cluster.announce()
     
     def unsubscribe(_, ws, channels):
         rec = (hex(id(ws)), ws)
+        gone = False
         for name in channels:
             ch = _.Channel[name]
             ch.remove(rec)
             if not ch:
                 del _.Channel[name]
-
-    def pub_raw(_, ws, channel, raw):
+                gone = True
+        if gone and _.cluster:
+            _.cluster.announce()
+
+    def pub_raw(_, ws, channel, raw, msg=None, remote=False):
+        '''fans out one message. each subscriber gets its own framing,
+        encoded at most once per format; `raw` is passed through as is
+        to subscribers that speak its format.
+        local publishes are also handed to the cluster, if any'''
+        if _.cluster and not remote and channel in _.cluster.remote:
+            if msg is None:
+                msg = framing.decode(raw)
+                pass
+            _.cluster.forward(channel, msg)
+            pass
+        PUBLISHED.inc(channel=channel)
+        if REPLAY_MESSAGES:
+            # stamp a sequence number so reconnects can ask for ?since=
+            if msg is None:
+                msg = framing.decode(raw)
+                pass
+            # on the class: Bottle won't let an instance set an attribute twice
+            type(_).Seq += 1
+            msg, raw = dict(msg, seq=_.Seq), None
+            pass
+        frames = {framing.format_of(raw): raw} if raw else {}
         for wsid2, ws2 in _.Channel.get(channel,[]):
             if ws == ws2:
                 print("ITS THE SAME")
             else:
-                print("SEND RAW", ws2, raw)
-                ws2.send(raw)
+                fmt = _.Format.get(ws2, 'json')
+                if (out:= frames.get(fmt)) is None:
+                    if msg is None:
+                        msg = framing.decode(raw)
+                        pass
+                    out = frames[fmt] = framing.encode(msg, fmt)
+                    pass
+                if (held:= _.Held.get(ws2)) is not None:
+                    held.append(out)
+                    continue
+                print("SEND RAW", ws2, out)
+                t0 = time.perf_counter()
+                ws2.send(out)
+                SEND_SECONDS.observe(time.perf_counter() - t0)
+                BYTES_OUT.inc(len(out))
+        if REPLAY_MESSAGES:
+            size = len(next(iter(frames.values()), None) or
+                       framing.encode(msg))
+            if not (ring:= _.Replay.get(channel)):
+                ring = _.Replay[channel] = Ring()
+                pass
+            ring.append(msg['seq'], msg, size)
+            pass
+
+    def backlog(_, channels, since):
+        '''what `channels` got after seq `since`, in order, and whether
+        some of it was already dropped from the rings'''
+        items, gap = [], False
+        for name in channels:
+            if ring:= _.Replay.get(name):
+                items.extend(ring.since(since))
+                gap = gap or ring.dropped > since
+            elif since < _.Evicted:
+                gap = True # it may have had a ring, and it's gone
+                pass
+            pass
+        return sorted(items, key=lambda item: item[0]), gap
+
+    def evict(_, now=None):
+        '''drops the rings of channels nobody subscribes to that have been
+        idle for REPLAY_IDLE, then, while all rings together hold more
+        than REPLAY_TOTAL bytes, the least recently published to
+        (unsubscribed first)'''
+        now = now or time.time()
+        for name, ring in list(_.Replay.items()):
+            if name not in _.Channel and ring.touched + REPLAY_IDLE < now:
+                _.drop_ring(name)
+                pass
+            pass
+        total = sum(ring.nbytes for ring in _.Replay.values())
+        for name, ring in sorted(_.Replay.items(),
+                                 key=lambda kv: (kv[0] in _.Channel,
+                                                 kv[1].touched)):
+            if total <= REPLAY_TOTAL:
+                break
+            total -= ring.nbytes
+            _.drop_ring(name)
+            pass
+        pass
+
+    def drop_ring(_, name):
+        ring = _.Replay.pop(name)
+        if ring.items:
+            type(_).Evicted = max(_.Evicted, ring.items[-1][0])
+            pass
+        pass
+
+    def sweep(_, every=10):
+        while 1:
+            gevent.sleep(every)
+            _.evict()
+            pass
+        pass
 
     def pub(_, ws, msg, ch = None):
         channel = ch or  msg['params']['channel']
-        raw = json.dumps(msg)
-        _.pub_raw(ws, channel, raw)
+        _.pub_raw(ws, channel, None, msg)
+
+    def greet(_, ws, channels, fmt, since=None, epoch=None):
+        '''subscribes ws, then sends it initialize and what its channels
+        got after `since`. live publishes in the meantime are held back
+        and follow the backlog, so the client sees seqs in order'''
+        held = _.Held[ws] = []
+        try:
+            _.subscribe(ws, channels)
+            backlog, gap = [], False
+            if since is not None:
+                if (epoch and epoch != EPOCH) or since < 0:
+                    gap = True # a different hub (or a restart), reload
+                else:
+                    backlog, gap = _.backlog(channels, since)
+                    pass
+                pass
+            send(ws, mesg('initialize',
+                          wsid = hex(id(ws)),
+                          channels = channels,
+                          format = fmt,
+                          seq = _.Seq,
+                          epoch = EPOCH,
+                          replayed = len(backlog),
+                          gap = gap), fmt)
+            frames = [framing.encode(msg, fmt) for seq, msg, size in backlog]
+            # a send can block and let publishers run, they append to held
+            while frames or held:
+                out = frames.pop(0) if frames else held.pop(0)
+                ws.send(out)
+                BYTES_OUT.inc(len(out))
+                pass
+        finally:
+            _.Held.pop(ws, None)
+            pass
+        pass
 
     def process(_, ws):
-        wsid = hex(id(ws))
         channels = request.query.getall('c')
+        fmt = _.Format[ws] = framing.negotiate(request.query.get('f'))
+        since = request.query.get('since')
+        epoch = request.query.get('epoch')
+        try:
+            since = None if since is None else int(since)
+        except ValueError:
+            since, epoch = -1, None # nonsense, have the client reload
+            pass
 
+        SOCKETS.inc()
         try:
-            _.subscribe(ws, channels)
-            call(ws, 'initialize',
-                 wsid = wsid,
-                 channels = channels)
+            _.greet(ws, channels, fmt, since, epoch)
         
             print("Waiting...")
             while raw:= ws.receive():
                 print("Got", (raw,), "!")
-                data = json.loads(raw)
+                BYTES_IN.inc(len(raw))
+                try:
+                    data = framing.decode(raw)
+                except ValueError as e:
+                    # e.g. msgpack from a client that ignored initialize
+                    print("BAD FRAME:", e)
+                    continue
+                if not isinstance(data, dict):
+                    print("BAD PACKET:", data)
+                    continue
                 method = data.get('method')
                 params = data.get('params',{})
                 if method=='pub':
-                    _.pub_raw(ws, params['channel'], raw)
+                    _.pub_raw(ws, params['channel'], raw, data)
                 else:
                     print("BAD PACKET:", data)
                     pass
@@ -129,16 +323,62 @@ class Application(Bottle):
             
         finally:
             _.unsubscribe(ws, channels)
+            _.Format.pop(ws, None)
+            SOCKETS.dec()
             pass
         
         print("BYE TO SOCKET")
         pass
 
-    def run(_, host='', port=5002):
+    def subscribers(_):
+        return {(name,): len(subs) for name, subs in _.Channel.items()}
+
+    def stats(_):
+        published = {k[0]: v for k, v in PUBLISHED.values.items()}
+        return dict(
+            uptime    = time.time() - STARTED,
+            sockets   = SOCKETS.values.get((), 0),
+            bytes_in  = BYTES_IN.values.get((), 0),
+            bytes_out = BYTES_OUT.values.get((), 0),
+            channels  = {name: dict(subscribers=len(subs),
+                                    published=published.get(name, 0))
+                         for name, subs in _.Channel.items()},
+            sends     = sum(sum(h[:-1])
+                            for h in SEND_SECONDS.values.values()),
+        )
+
+    def run(_, host='', port=int(os.getenv('HUB_PORT', 5002))):
         _.config['dns_lookups'] = False
-        svr = WebSocketServer((host, port), _)
+        listener = (host, port)
+        if os.getenv('HUB_REUSEPORT'):
+            # one hub per core on the same port, the kernel balances
+            # connections and the cluster bridges their channels
+            import socket
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            listener.bind((host, port))
+            listener.listen(1024)
+            pass
+        if os.getenv('HUB_CLUSTER'):
+            from .cluster import Cluster
+            _.cluster = Cluster(_).start()
+            pass
+        if REPLAY_MESSAGES:
+            gevent.spawn(_.sweep)
+            pass
+        svr = WebSocketServer(listener, _)
+        import signal
+        gevent.signal_handler(signal.SIGTERM, gevent.spawn, svr.stop)
         print(f"Starting server with gevent on http://{host}:{port}")
-        svr.serve_forever()
+        try:
+            svr.serve_forever()
+        finally:
+            if _.cluster:
+                # the others drop us now, not after three missed heartbeats
+                _.cluster.stop()
+                pass
+            pass
         return
 
     pass
@@ -146,6 +386,10 @@ class Application(Bottle):
 
 app = app.push(Application())
 
+SUBSCRIBERS = metrics.Gauge('hub_channel_subscribers',
+                            'subscribers per channel', ('channel',),
+                            fn=app.subscribers)
+
 
 @app.route('/ws', method=['GET'])
 def _():
@@ -153,32 +397,45 @@ def _():
         return request.app.process(ws)
     raise Exception('no websocket')
 
+@app.get('/metrics')
+def _():
+    response.content_type = metrics.CONTENT_TYPE
+    return metrics.render()
+
+@app.get('/stats')
+def _():
+    return request.app.stats()
+
 @app.post('/uploads')
 def upload_file():
     add_cors_headers(response.headers,
                      request.headers.get('Origin'))
-    try:
-        os.mkdir('uploads')
-    except FileExistsError:
-        pass
-    # TODO: if there are more than MAXIMUM_FILES files, delete the oldest
+    # refuse before bottle spools an oversized body to disk
+    if (request.content_length or 0) > uploads.MAXIMUM_UPLOAD + uploads.CHUNK:
+        response.status = 413
+        return {'error': 'Upload too large'}
     timestamp = request.forms.get('timestamp')
     if not timestamp:
-        import uuid
         timestamp = str(uuid.uuid1())
         pass
     if 'image' not in request.files:
-        return {'error': 'No file part'}, 400
+        response.status = 400
+        return {'error': 'No file part'}
     image_file = request.files['image']
     if not image_file.filename:
-        return {'error': 'No selected file'}, 400
-    filename = f"image_{timestamp}.jpg"
-    #print("QPRINT1", filename)
-    #print("QPRINT2", os.path.join('uploads', filename))
-    image_file.save(os.path.join('uploads', filename))
-    #print("QPRINT3", filename)
-    assert 0==os.system('touch "' + os.path.join('uploads', filename+'.DUN"'))
-    return {'message': f'File {filename} uploaded successfully'}
+        response.status = 400
+        return {'error': 'No selected file'}
+    try:
+        info = uploads.store(image_file.file,
+                             uploads.extension(image_file.raw_filename))
+    except uploads.TooLarge as e:
+        response.status = 413
+        return {'error': str(e)}
+    info.update(timestamp=timestamp, name=image_file.raw_filename)
+    uploads.completed(app, info)
+    filename = info['filename']
+    return dict({k: v for k, v in info.items() if k != 'path'},
+                message=f'File {filename} uploaded successfully')
 
 @app.get('/')
 @app.get('<path:path>/')
@@ -187,10 +444,7 @@ def _(path=''):
 
 @app.get('<path:path>')
 def serve_file(path, root=os.getenv('ROOT','./public/')):
-    response.headers['cache-control'] = 'no-store, must-revalidate'
-    if os.path.isdir('./' + path):
-        return redirect(path + '/')
-    return static_file(path, root)
+    return static.serve(path, root)
 
 from .api import rest
 
@@ -2,16 +2,14 @@ from IPython.core.magic import Magics, cell_magic, magics_class
 from IPython.display import Markdown, display, display_markdown
 
 import os, sys, time, json, websocket
+from . import framing
 
 
 def recv(ws):
-    raw = ws.recv()
-    if not raw:
-        raise EOFError
-    return json.loads(raw)
+    return framing.recv(ws)
 
 def send(ws, msg):
-    return ws.send( json.dumps(msg) )
+    return framing.send(ws, msg)
 
 def mesg(method, **params):
     return dict(method=method, params=params)
@@ -30,7 +28,7 @@ CH_OUT = os.getenv('CH_OUT',CH+'-out')
 CHANNELS = [CH_OUT]
 
 WS_BASE = f"ws://localhost:5002/ws"
-WS_ARGS = '?c='+'&c='.join(CHANNELS)
+WS_ARGS = '?c='+'&c='.join(CHANNELS)+'&f='+framing.FORMAT
 
 
 @magics_class
@@ -41,13 +39,35 @@ class LLMMagics(Magics):
         __init__ = Magics.__init__
         __init__(self, *a, **kw)
 
+        self.seq, self.epoch = None, None
+        self.connect()
+        pass
+
+    def connect(self):
+        args = WS_ARGS
+        if self.seq is not None:
+            # only what we missed gets replayed
+            args += f'&since={self.seq}&epoch={self.epoch}'
         self.ws = websocket.WebSocket()
-        self.ws.connect(WS_BASE + WS_ARGS)
+        self.ws.connect(WS_BASE + args)
 
         msg = recv(self.ws)
         print("INIT RECV", msg)
-
+        params = msg.get('params', {})
+        if params.get('gap') or params.get('epoch') != self.epoch:
+            # a new hub numbers from scratch (see chat.py)
+            self.seq = 0 if params.get('replayed') else params.get('seq')
+        self.epoch = params.get('epoch')
         pass
+
+    def recv(self):
+        try:
+            msg = recv(self.ws)
+        except Exception:
+            self.connect()
+            msg = recv(self.ws)
+        self.seq = msg.get('seq', self.seq)
+        return msg
     
     @cell_magic
     def llm(self, line, cell):
@@ -61,7 +81,7 @@ class LLMMagics(Magics):
         pub(self.ws, CH_IN, content, role=role)       
         display(Markdown("***Waiting...***"))
 
-        msg = recv(self.ws)
+        msg = self.recv()
         #print("RECV", msg)
 
         params = msg['params']
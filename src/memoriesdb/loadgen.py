@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+'''websocket load generator for the hub (and the Convo pipeline).
+
+  pubsub  publishers and subscribers spread over --channels channels
+  chat    closed-loop clients publish on llm-in and wait for their answer
+          on llm-out; --fake-llm answers them instead of a real Convo
+
+prints one JSON document with p50/p95/p99 end-to-end latency,
+throughput and error counts, e.g.
+
+    python -m memoriesdb.loadgen pubsub --publishers 100 --subscribers 2000
+    python -m memoriesdb.loadgen chat --clients 500 --fake-llm
+'''
+from .wsutil import ws_connect, recv, pub # monkey patches, keep first
+import os, json, time, argparse, itertools, random
+import gevent
+from websocket import WebSocketTimeoutException
+from . import wsutil
+
+_ids = itertools.count()
+CH_IN, CH_OUT = 'llm-in', 'llm-out'
+
+
+class Stats:
+
+    def __init__(_):
+        _.latencies, _.sent, _.received, _.errors = [], 0, 0, {}
+        pass
+
+    def error(_, e):
+        name = type(e).__name__
+        _.errors[name] = _.errors.get(name, 0) + 1
+        pass
+
+    def report(_, seconds):
+        samples = sorted(_.latencies)
+        pick = lambda p: (round(samples[min(len(samples) - 1,
+                                            len(samples) * p // 100)] * 1000, 3)
+                          if samples else None)
+        return dict(seconds=round(seconds, 3),
+                    sent=_.sent, received=_.received,
+                    sent_per_sec=round(_.sent / seconds, 2),
+                    received_per_sec=round(_.received / seconds, 2),
+                    p50_ms=pick(50), p95_ms=pick(95), p99_ms=pick(99),
+                    errors=_.errors)
+    pass
+
+
+def connect(stats, channels, timeout=1):
+    try:
+        ws = ws_connect(channels)
+        ws.settimeout(timeout)
+        recv(ws) # initialize
+        return ws
+    except Exception as e:
+        stats.error(e)
+        return None
+
+
+def receive(ws, stats, deadline, on_msg):
+    while time.time() < deadline:
+        try:
+            msg = recv(ws)
+        except WebSocketTimeoutException:
+            continue
+        except Exception as e:
+            stats.error(e)
+            return
+        if msg.get('method') == 'pub':
+            on_msg(msg['params'])
+            pass
+        pass
+    pass
+
+
+def publisher(stats, channel, rate, size, deadline):
+    # publishers never read, so they listen on a channel of their own:
+    # on `channel` the other publishers' messages would pile up in the
+    # socket until the hub blocks sending to it
+    if not (ws:= connect(stats, f'loadgen-pub-{next(_ids)}')):
+        return
+    payload = 'x' * size
+    while time.time() < deadline:
+        try:
+            pub(ws, channel, payload, msgid=next(_ids), sent=time.time())
+            stats.sent += 1
+        except Exception as e:
+            stats.error(e)
+            return
+        gevent.sleep(random.expovariate(rate))
+        pass
+    pass
+
+
+def subscriber(stats, channel, deadline):
+    if not (ws:= connect(stats, channel)):
+        return
+
+    def on_msg(params):
+        stats.received += 1
+        if sent:= params.get('sent'):
+            stats.latencies.append(time.time() - sent)
+            pass
+        pass
+    receive(ws, stats, deadline, on_msg)
+    pass
+
+
+def fake_llm(stats, size, deadline, delay=0.0):
+    '''stands in for Convo: answers every llm-in message on llm-out'''
+    if not (ws:= connect(stats, CH_IN)):
+        return
+    answer = 'y' * size
+
+    def on_msg(params):
+        if delay:
+            gevent.sleep(delay)
+            pass
+        pub(ws, CH_OUT, answer, role='assistant', done=True,
+            msgid=params.get('msgid'), sent=params.get('sent'))
+        pass
+    receive(ws, stats, deadline, on_msg)
+    pass
+
+
+def chat_client(stats, size, deadline, timeout):
+    if not (ws:= connect(stats, CH_OUT)):
+        return
+    question = 'z' * size
+    while time.time() < deadline:
+        msgid, sent = next(_ids), time.time()
+        try:
+            pub(ws, CH_IN, question, role='user', msgid=msgid, sent=sent)
+            stats.sent += 1
+        except Exception as e:
+            stats.error(e)
+            return
+        # a real Convo doesn't echo msgid, take the next answer then
+        while time.time() < sent + timeout:
+            try:
+                msg = recv(ws)
+            except WebSocketTimeoutException:
+                continue
+            except Exception as e:
+                stats.error(e)
+                return
+            params = msg.get('params', {})
+            if msg.get('method') == 'pub' and params.get('msgid') in (msgid, None):
+                stats.received += 1
+                stats.latencies.append(time.time() - sent)
+                break
+            pass
+        else:
+            stats.error(TimeoutError())
+            pass
+        pass
+    pass
+
+
+def main():
+    global CH_IN, CH_OUT
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('mode', choices=['pubsub', 'chat'])
+    parser.add_argument('--uri', default=os.getenv('WS_URI', wsutil.WS_URI))
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--size', type=int, default=256,
+                        help='message content bytes')
+    parser.add_argument('--publishers', type=int, default=10)
+    parser.add_argument('--subscribers', type=int, default=100)
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--rate', type=float, default=1,
+                        help='messages/s per publisher (poisson)')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--fake-llm', type=int, nargs='?', const=1, default=0,
+                        help='how many fake responders to run')
+    parser.add_argument('--llm-delay', type=float, default=0,
+                        help='fake think time per answer, seconds')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--channel', default='llm',
+                        help='chat mode uses <channel>-in/-out')
+    args = parser.parse_args()
+
+    wsutil.WS_URI = args.uri
+    CH_IN, CH_OUT = args.channel + '-in', args.channel + '-out'
+    stats = Stats()
+    t0 = time.time()
+    deadline = t0 + args.duration
+    jobs = []
+    if args.mode == 'pubsub':
+        names = [f'load-{n}' for n in range(args.channels)]
+        jobs += [gevent.spawn(subscriber, stats, names[n % len(names)],
+                              deadline + 1)
+                 for n in range(args.subscribers)]
+        gevent.sleep(1) # let subscribers settle before publishing
+        jobs += [gevent.spawn(publisher, stats, names[n % len(names)],
+                              args.rate, args.size, deadline)
+                 for n in range(args.publishers)]
+    else:
+        jobs += [gevent.spawn(fake_llm, stats, args.size, deadline + 1,
+                              args.llm_delay)
+                 for n in range(args.fake_llm)]
+        gevent.sleep(0.5)
+        jobs += [gevent.spawn(chat_client, stats, args.size, deadline,
+                              args.timeout)
+                 for n in range(args.clients)]
+        pass
+    gevent.joinall(jobs)
+    report = stats.report(time.time() - t0)
+    report.update(mode=args.mode, args=vars(args))
+    print(json.dumps(report, indent=1))
+    pass
+
+
+if __name__ == '__main__':
+    main()
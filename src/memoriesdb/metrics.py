@@ -0,0 +1,186 @@
+'''tiny in-process metrics rendered in the Prometheus text format.
+no client library, just counters/gauges/histograms and a /metrics page'''
+import time, threading
+from contextlib import contextmanager
+
+_registry = []
+_lock = threading.Lock()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(v):
+    return str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+        pass
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(_, name, help='', labels=(), registry=_registry):
+        _.name, _.help, _.labelnames = name, help, tuple(labels)
+        _.values = {}
+        registry.append(_)
+        pass
+
+    def _key(_, labels):
+        return tuple(str(labels.get(k, '')) for k in _.labelnames)
+
+    def samples(_):
+        for key, v in list(_.values.items()):
+            yield _.name + _labels(_.labelnames, key), v
+            pass
+        pass
+
+    def render(_):
+        yield f'# HELP {_.name} {_.help}'
+        yield f'# TYPE {_.name} {_.kind}'
+        for name, v in _.samples():
+            yield f'{name} {v}'
+            pass
+        pass
+    pass
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(_, n=1, **labels):
+        key = _._key(labels)
+        with _lock:
+            _.values[key] = _.values.get(key, 0) + n
+            pass
+        pass
+    pass
+
+
+class Gauge(Metric):
+    '''set() it, or pass fn= to compute the value(s) at scrape time;
+    fn returns a number, or a dict of {label-tuple: number}'''
+    kind = 'gauge'
+
+    def __init__(_, name, help='', labels=(), fn=None, **kw):
+        super().__init__(name, help, labels, **kw)
+        _.fn = fn
+        pass
+
+    def set(_, v, **labels):
+        _.values[_._key(labels)] = v
+        pass
+
+    def inc(_, n=1, **labels):
+        key = _._key(labels)
+        with _lock:
+            _.values[key] = _.values.get(key, 0) + n
+            pass
+        pass
+
+    def dec(_, n=1, **labels):
+        return _.inc(-n, **labels)
+
+    def samples(_):
+        if _.fn:
+            try:
+                v = _.fn()
+            except Exception as e:
+                print("METRICS:", _.name, e)
+                return
+            _.values = v if isinstance(v, dict) else {(): v}
+            pass
+        yield from super().samples()
+        pass
+    pass
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(_, name, help='', labels=(), buckets=BUCKETS, **kw):
+        super().__init__(name, help, labels, **kw)
+        _.buckets = tuple(buckets)
+        pass
+
+    def observe(_, v, **labels):
+        key = _._key(labels)
+        with _lock:
+            if not (h:= _.values.get(key)):
+                # per-bucket counts, then +Inf, sum
+                h = _.values[key] = [0] * (len(_.buckets) + 1) + [0.0]
+                pass
+            for n, le in enumerate(_.buckets):
+                if v <= le:
+                    h[n] += 1
+                    break
+            else:
+                h[-2] += 1
+                pass
+            h[-1] += v
+            pass
+        pass
+
+    @contextmanager
+    def time(_, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            _.observe(time.perf_counter() - t0, **labels)
+            pass
+        pass
+
+    def samples(_):
+        for key, h in list(_.values.items()):
+            total = 0
+            for le, n in zip(_.buckets + ('+Inf',), h):
+                total += n
+                yield (_.name + '_bucket' +
+                       _labels(_.labelnames, key, f'le="{le}"'), total)
+                pass
+            yield _.name + '_sum'   + _labels(_.labelnames, key), h[-1]
+            yield _.name + '_count' + _labels(_.labelnames, key), total
+            pass
+        pass
+    pass
+
+
+def render(registry=_registry):
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+        pass
+    return '\n'.join(lines) + '\n'
+
+
+def serve(port, host='', registry=_registry):
+    '''serves GET /metrics from a daemon thread, for processes without
+    a web app of their own'''
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                return self.send_error(404)
+            body = render(registry).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            pass
+
+        def log_message(self, *a):
+            pass
+        pass
+
+    svr = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=svr.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host or 'localhost'}:{port}/metrics")
+    return svr
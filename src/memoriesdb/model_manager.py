@@ -0,0 +1,129 @@
+'''keeps the models Convo talks to loaded in Ollama.
+
+at startup the configured models (CONVO_PRELOAD=a,b) and the most
+recently used ones from `model` rows (CONVO_WARM_RECENT=n), at most
+CONVO_WARM_MAX of them, are loaded with an empty generate and kept
+resident for CONVO_KEEP_ALIVE. ollama.ps() is polled to know which
+models are warm and route() hands a session the first of its candidate
+models that already is, so it doesn't pay for a cold load. Convo routes
+once per session, at its first turn, and sticks with the answer.'''
+import os, gevent
+from . import metrics
+
+PRELOAD    = [m for m in os.getenv('CONVO_PRELOAD', '').split(',') if m]
+RECENT     = int(os.getenv('CONVO_WARM_RECENT', 0))
+MAX_WARM   = int(os.getenv('CONVO_WARM_MAX', 2))
+KEEP_ALIVE = os.getenv('CONVO_KEEP_ALIVE', '30m')
+POLL       = float(os.getenv('CONVO_WARM_POLL', 30))
+ENABLED    = bool(PRELOAD or RECENT)
+
+ROUTED = metrics.Counter('convo_model_routes_total',
+                         'sessions routed to a warm or a cold model',
+                         ('state',))
+LOADS  = metrics.Histogram('convo_model_load_seconds',
+                           'preload time per model', ('model',))
+WARM   = metrics.Gauge('convo_models_warm', 'models loaded in ollama',
+                       ('model',),
+                       fn=lambda: {(m,): 1 for m in _manager.warm}
+                                  if _manager else {})
+
+
+def normalize(model):
+    '''ollama reports llama3.1 as llama3.1:latest'''
+    return model if ':' in model else model + ':latest'
+
+
+class ModelManager:
+
+    def __init__(_, models=PRELOAD, recent=RECENT, max_warm=MAX_WARM,
+                 keep_alive=KEEP_ALIVE, client=None):
+        import ollama
+        _.client = client or ollama.Client()
+        _.models, _.recent, _.max_warm = list(models), recent, max_warm
+        _.keep_alive = keep_alive
+        _.warm = dict()    # normalized name -> expires_at
+        _.loading = dict() # model -> greenlet
+        pass
+
+    def start(_):
+        try:
+            # know what is loaded before anyone routes or preloads
+            _.refresh()
+        except Exception as e:
+            print("MODELS: ps failed,", e)
+            pass
+        models = _.models
+        if _.recent:
+            from .api import get_recent_models
+            models = models + get_recent_models(_.recent)
+            pass
+        for model in list(dict.fromkeys(models))[:_.max_warm]:
+            _.preload(model)
+            pass
+        gevent.spawn(_.poll)
+        return _
+
+    def refresh(_):
+        _.warm = {normalize(m.model): m.expires_at
+                  for m in _.client.ps().models}
+        pass
+
+    def poll(_):
+        while 1:
+            try:
+                _.refresh()
+            except Exception as e:
+                print("MODELS: ps failed,", e)
+                pass
+            gevent.sleep(POLL)
+            pass
+        pass
+
+    def is_warm(_, model):
+        return normalize(model) in _.warm
+
+    def preload(_, model):
+        if model not in _.loading and not _.is_warm(model):
+            _.loading[model] = gevent.spawn(_.load, model)
+            pass
+        pass
+
+    def load(_, model):
+        try:
+            with LOADS.time(model=model):
+                # an empty prompt only loads the model
+                _.client.generate(model=model, prompt='',
+                                  keep_alive=_.keep_alive)
+                pass
+            _.warm[normalize(model)] = None
+            print("MODELS: warm", model)
+        except Exception as e:
+            print("MODELS: preload of", model, "failed,", e)
+        finally:
+            _.loading.pop(model, None)
+            pass
+        pass
+
+    def route(_, candidates):
+        '''the first warm model among candidates (in order of preference),
+        else the first candidate'''
+        candidates = [m for m in dict.fromkeys(candidates) if m]
+        for model in candidates:
+            if _.is_warm(model):
+                ROUTED.inc(state='warm')
+                return model
+            pass
+        ROUTED.inc(state='cold')
+        return candidates[0] if candidates else None
+    pass
+
+
+_manager = None
+
+def get_manager():
+    '''the process-wide manager, started on first use'''
+    global _manager
+    if not _manager:
+        _manager = ModelManager().start()
+        pass
+    return _manager
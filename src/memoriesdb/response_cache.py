@@ -0,0 +1,202 @@
+'''semantic response cache for Convo, opt in with CONVO_CACHE=1
+(in process) or CONVO_CACHE=db (the response_cache table, shared by
+every Convo process).
+
+an answer is stored under the prompt it was generated for -- model,
+tools and every message before the user turn, hashed into a
+fingerprint -- together with an embedding of the user turn. a later
+turn, in any session, with the same fingerprint whose embedding is at
+least CONVO_CACHE_THRESHOLD cosine-similar gets the stored answer back
+instead of a generation. so the first question of a conversation is
+shared by every session with the same system prompt, while a follow-up
+like "and the other one?" only matches after the very same history:
+another conversation's (or user's) answer to it would be wrong.
+entries expire after CONVO_CACHE_TTL seconds and the oldest go past
+CONVO_CACHE_SIZE (least recently used, in process).
+
+only plain answers are cached; tool calls have side effects and
+always go to the model.'''
+import os, json, time, hashlib
+from collections import OrderedDict, namedtuple
+from . import metrics
+
+CACHE     = os.getenv('CONVO_CACHE', '') # '', 1 or db
+THRESHOLD = float(os.getenv('CONVO_CACHE_THRESHOLD', 0.95))
+TTL       = float(os.getenv('CONVO_CACHE_TTL', 3600))
+SIZE      = int(os.getenv('CONVO_CACHE_SIZE', 1000))
+
+REQUESTS = metrics.Counter('convo_cache_requests_total',
+                           'response cache lookups', ('result',))
+SIMILARITY = metrics.Histogram('convo_cache_similarity',
+                               'best similarity found per lookup',
+                               buckets=(.5, .7, .8, .85, .9, .95, .98, 1))
+ENTRIES = metrics.Gauge('convo_cache_entries', 'cached answers')
+
+Entry = namedtuple('Entry', 'fingerprint embedding message created')
+
+# what process_message reads off an ollama message
+CachedMessage = namedtuple('CachedMessage', 'role content tool_calls')
+CachedResponse = namedtuple('CachedResponse', 'message cached')
+
+
+def fingerprint(model, tools, messages):
+    '''hash of the model, the tool names and the messages: their roles
+    and contents, system prompts and earlier turns alike'''
+    names = [getattr(t, '__name__', None) or t for t in tools or ()]
+    turns = [(m.get('role'), m.get('content')) for m in messages]
+    raw = json.dumps([model, names, turns], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResponseCache:
+
+    def __init__(_, threshold=THRESHOLD, ttl=TTL, size=SIZE, embed=None):
+        _.threshold, _.ttl, _.size = threshold, ttl, size
+        _.entries = OrderedDict() # n -> Entry, least recently used first
+        _.index = dict()          # fingerprint -> {n}
+        _.n = 0
+        _.embed = embed or _.default_embed
+        pass
+
+    @staticmethod
+    def default_embed(text):
+        from .get_embeddings import get_client
+        return get_client().embed([text])[0]
+
+    def key(_, model, tools, messages):
+        '''(fingerprint, embedding) for a turn, None when it can't be
+        cached (not a user turn, or no embedding to be had)'''
+        if not messages or messages[-1].get('role') != 'user':
+            return None
+        try:
+            embedding = _.embed(messages[-1]['content'])
+        except Exception as e:
+            print("CACHE: no embedding,", e)
+            return None
+        return fingerprint(model, tools, messages[:-1]), embedding
+
+    def get(_, key):
+        if not key:
+            REQUESTS.inc(result='skip')
+            return None
+        fp, embedding = key
+        now, best, best_n = time.time(), -1.0, None
+        for n in list(_.index.get(fp, ())):
+            entry = _.entries[n]
+            if entry.created + _.ttl < now:
+                _.drop(n)
+                continue
+            # both sides are unit vectors (see truncate_embedding)
+            sim = sum(a * b for a, b in zip(entry.embedding, embedding))
+            if sim > best:
+                best, best_n = sim, n
+                pass
+            pass
+        if best_n is not None:
+            SIMILARITY.observe(best)
+            pass
+        if best_n is None or best < _.threshold:
+            REQUESTS.inc(result='miss')
+            return None
+        REQUESTS.inc(result='hit')
+        _.entries.move_to_end(best_n)
+        return CachedResponse(_.entries[best_n].message, best)
+
+    def put(_, key, message):
+        if not key or not message or message.tool_calls or not message.content:
+            return
+        fp, embedding = key
+        _.n += 1
+        _.entries[_.n] = Entry(fp, list(embedding),
+                               CachedMessage(message.role, message.content,
+                                             None),
+                               time.time())
+        _.index.setdefault(fp, set()).add(_.n)
+        while len(_.entries) > _.size:
+            _.drop(next(iter(_.entries)))
+            pass
+        ENTRIES.set(len(_.entries))
+        pass
+
+    def drop(_, n):
+        entry = _.entries.pop(n)
+        ns = _.index[entry.fingerprint]
+        ns.discard(n)
+        if not ns:
+            del _.index[entry.fingerprint]
+            pass
+        ENTRIES.set(len(_.entries))
+        pass
+    pass
+
+
+class DbResponseCache(ResponseCache):
+    '''the same, in the response_cache table: every Convo process
+    shares the answers, and they outlive a restart. candidates are the
+    rows of one fingerprint, ranked by exact cosine distance'''
+
+    def __init__(_, threshold=THRESHOLD, ttl=TTL, size=SIZE, embed=None):
+        super().__init__(threshold, ttl, size, embed)
+        _.puts = 0
+        pass
+
+    def get(_, key):
+        if not key:
+            REQUESTS.inc(result='skip')
+            return None
+        from .api import get_dbconn, execute
+        fp, embedding = key
+        embedding = list(embedding)
+        with get_dbconn().cursor() as cursor:
+            execute(cursor, "SELECT content, 1 - (embedding <=> %s::vector)"
+                            " FROM response_cache WHERE fingerprint = %s"
+                            " AND created_at > NOW() - %s * INTERVAL '1 second'"
+                            " AND vector_dims(embedding) = %s"
+                            " ORDER BY embedding <=> %s::vector LIMIT 1",
+                    (embedding, fp, _.ttl, len(embedding), embedding))
+            row = cursor.fetchone()
+            pass
+        if row:
+            SIMILARITY.observe(row[1])
+            pass
+        if not row or row[1] < _.threshold:
+            REQUESTS.inc(result='miss')
+            return None
+        REQUESTS.inc(result='hit')
+        return CachedResponse(CachedMessage('assistant', row[0], None), row[1])
+
+    def put(_, key, message):
+        if not key or not message or message.tool_calls or not message.content:
+            return
+        from .api import get_dbconn, execute
+        fp, embedding = key
+        conn = get_dbconn()
+        with conn.cursor() as cursor:
+            execute(cursor, "INSERT INTO response_cache"
+                            " (fingerprint, embedding, content)"
+                            " VALUES (%s, %s::vector, %s)",
+                    (fp, list(embedding), message.content))
+            _.puts += 1
+            if _.puts % 100 == 1:
+                # every so often: the expired, then the oldest past size
+                execute(cursor, "DELETE FROM response_cache WHERE created_at"
+                                " < NOW() - %s * INTERVAL '1 second'"
+                                " OR id <= (SELECT id FROM response_cache"
+                                "  ORDER BY id DESC OFFSET %s LIMIT 1)",
+                        (_.ttl, _.size))
+                pass
+            pass
+        conn.commit()
+        pass
+    pass
+
+
+_cache = None
+
+def get_cache():
+    '''the process wide cache CONVO_CACHE asks for, or None'''
+    global _cache
+    if not _cache and CACHE:
+        _cache = DbResponseCache() if CACHE == 'db' else ResponseCache()
+        pass
+    return _cache
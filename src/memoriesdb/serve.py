@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+'''prefork server for the REST API (memoriesdb.api.rest).
+
+the master binds the port once and forks --workers gevent WSGI
+servers that accept on it; with --reuseport each worker binds its own
+SO_REUSEPORT socket instead and the kernel spreads the connections.
+workers import the app after the fork, so each one has its own
+database connection, prepared statements and metadata (--preload
+imports in the master to share the code pages, at the price of SIGHUP
+not picking up code changes).
+
+  * a worker exits after --max-requests (+ jitter) and is replaced
+  * SIGHUP starts a new generation of workers, then lets the old one
+    finish its requests and exit
+  * SIGTERM/SIGINT drain every worker for up to --grace seconds
+
+    python -m memoriesdb.serve --workers 8 --port 8080
+'''
+import os, sys, time, random, signal, socket, argparse
+
+WORKERS      = int(os.getenv('SERVE_WORKERS', os.cpu_count() or 1))
+PORT         = int(os.getenv('SERVE_PORT', 8080))
+MAX_REQUESTS = int(os.getenv('SERVE_MAX_REQUESTS', 10_000))
+GRACE        = float(os.getenv('SERVE_GRACE', 30))
+RESPAWN_MIN  = 1.0 # a worker dying younger than this delays its respawn
+
+
+def bind(host, port, reuseport=False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuseport:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        pass
+    sock.bind((host, port))
+    sock.listen(1024)
+    return sock
+
+
+class Recycle:
+    '''WSGI middleware: stops the server once it has seen `limit` requests'''
+
+    def __init__(_, app, limit, stop):
+        _.app, _.limit, _.stop, _.count = app, limit, stop, 0
+        pass
+
+    def __call__(_, environ, start_response):
+        _.count += 1
+        if _.count == _.limit:
+            import gevent
+            gevent.spawn(_.stop)
+            pass
+        return _.app(environ, start_response)
+    pass
+
+
+def worker(sock, args):
+    from gevent import monkey; monkey.patch_all()
+    import gevent
+    from gevent import socket as gsocket
+    from gevent.pywsgi import WSGIServer
+    from . import api
+    from .api import rest
+    api.reset()
+    api.init()
+    if sock is None:
+        sock = bind(args.host, args.port, reuseport=True)
+        pass
+    listener = gsocket.socket(fileno=sock.detach())
+    limit = args.max_requests + random.randint(0, args.max_requests // 10)
+
+    def stop():
+        server.stop(timeout=args.grace)
+        pass
+    server = WSGIServer(listener, Recycle(rest.app, limit, stop),
+                        log=None if args.quiet else 'default')
+    # stop() waits on in-flight requests, that can't happen in the hub
+    gevent.signal_handler(signal.SIGTERM, gevent.spawn, stop)
+    gevent.signal_handler(signal.SIGINT, gevent.spawn, stop)
+    print(f"Worker {os.getpid()} serving, recycled after {limit} requests")
+    server.serve_forever()
+    pass
+
+
+class Master:
+
+    def __init__(_, args):
+        _.args = args
+        _.sock = None if args.reuseport else bind(args.host, args.port)
+        _.workers = dict() # pid -> (generation, started)
+        _.generation = 0
+        _.reload = _.stopping = False
+        _.backoff_until = 0
+        pass
+
+    def spawn(_):
+        pid = os.fork()
+        if pid == 0:
+            for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+                signal.signal(sig, signal.SIG_DFL)
+                pass
+            status = 0
+            try:
+                worker(_.sock, _.args)
+            except BaseException as e:
+                print(f"Worker {os.getpid()} died: {e!r}")
+                status = 1
+                pass
+            sys.stdout.flush()
+            os._exit(status)
+            pass
+        _.workers[pid] = (_.generation, time.time())
+        pass
+
+    def current(_):
+        return [pid for pid, (gen, _t) in _.workers.items()
+                if gen == _.generation]
+
+    def kill(_, pids, sig=signal.SIGTERM):
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+            pass
+        pass
+
+    def reap(_):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            gen, started = _.workers.pop(pid, (None, 0))
+            if time.time() - started < RESPAWN_MIN and not _.stopping:
+                # crashing on startup, don't fork in a tight loop
+                _.backoff_until = time.time() + RESPAWN_MIN
+                pass
+            pass
+        pass
+
+    def on_hup(_, *a):
+        _.reload = True
+
+    def on_term(_, *a):
+        _.stopping = True
+
+    def run(_):
+        signal.signal(signal.SIGHUP,  _.on_hup)
+        signal.signal(signal.SIGTERM, _.on_term)
+        signal.signal(signal.SIGINT,  _.on_term)
+        print(f"Master {os.getpid()} on {_.args.host}:{_.args.port},"
+              f" {_.args.workers} workers")
+        while not _.stopping:
+            _.reap()
+            if _.reload:
+                _.reload = False
+                old = list(_.workers)
+                _.generation += 1
+                print(f"Reloading, generation {_.generation}")
+                for n in range(_.args.workers):
+                    _.spawn()
+                    pass
+                _.kill(old)
+                pass
+            while (len(_.current()) < _.args.workers and not _.stopping
+                   and time.time() >= _.backoff_until):
+                _.spawn()
+                pass
+            time.sleep(0.5)
+            pass
+        _.shutdown()
+        pass
+
+    def shutdown(_):
+        print("Stopping workers")
+        _.kill(list(_.workers))
+        deadline = time.time() + _.args.grace
+        while _.workers and time.time() < deadline:
+            _.reap()
+            time.sleep(0.1)
+            pass
+        _.kill(list(_.workers), signal.SIGKILL)
+        _.reap()
+        pass
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default=os.getenv('SERVE_HOST', ''))
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--max-requests', type=int, default=MAX_REQUESTS)
+    parser.add_argument('--grace', type=float, default=GRACE)
+    parser.add_argument('--reuseport', action='store_true',
+                        default=bool(os.getenv('SERVE_REUSEPORT')))
+    parser.add_argument('--preload', action='store_true')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args()
+    if args.preload:
+        from .api import rest
+        pass
+    Master(args).run()
+    pass
+
+
+if __name__ == '__main__':
+    main()
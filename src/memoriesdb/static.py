@@ -0,0 +1,145 @@
+'''static files for the hub.
+
+STATIC_MODE=dev (the default) serves the root as is with no-store, so
+edits show up on the next reload. STATIC_MODE=prod fingerprints every
+file under the root once at startup:
+  * HTML pages get their src=/href= asset references rewritten to
+    name.<hash>.ext and are revalidated by ETag
+  * hashed URLs are cached by browsers as immutable
+  * name.br / name.gz siblings are served to clients that accept them'''
+import os, re, gzip, hashlib, mimetypes, functools
+from wsgiref.util import FileWrapper
+from bottle import request, response, redirect, static_file, HTTPResponse
+
+STATIC_MODE = os.getenv('STATIC_MODE', 'dev')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+FILE_CHUNK = 256 << 10
+REFERENCE = re.compile(r'''\b(src|href)=(["'])([^"'#?:]+)\2''')
+
+
+def file_wrapper(fileobj, blksize=FILE_CHUNK):
+    return FileWrapper(fileobj, blksize)
+
+
+class Assets:
+
+    def __init__(_, root):
+        _.root = os.path.abspath(root)
+        _.hashed   = dict() # 'u.js' -> 'u.1a2b3c4d5e6f.js'
+        _.real     = dict() # 'u.1a2b3c4d5e6f.js' -> 'u.js'
+        _.variants = dict() # 'u.js' -> {'br', 'gzip'}
+        _.pages    = dict() # 'index.html' -> (body, gzipped body, etag)
+        _.scan()
+        pass
+
+    def scan(_):
+        for dirpath, dirs, files in os.walk(_.root):
+            for name in files:
+                full = os.path.join(dirpath, name)
+                path = os.path.relpath(full, _.root).replace(os.sep, '/')
+                for encoding, suffix in ENCODINGS:
+                    if path.endswith(suffix):
+                        _.variants.setdefault(path[:-len(suffix)],
+                                              set()).add(encoding)
+                        break
+                else:
+                    with open(full, 'rb') as f:
+                        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+                        pass
+                    base, ext = os.path.splitext(path)
+                    _.hashed[path] = f'{base}.{digest}{ext}'
+                    _.real[_.hashed[path]] = path
+                    pass
+                pass
+            pass
+        for path in _.hashed:
+            if path.endswith('.html'):
+                _.pages[path] = _.rewrite(path)
+                pass
+            pass
+        print(f"Static: {len(_.hashed)} files fingerprinted in {_.root}")
+        pass
+
+    def rewrite(_, page):
+        with open(os.path.join(_.root, page), encoding='utf-8') as f:
+            html = f.read()
+            pass
+        here = os.path.dirname(page)
+
+        def fingerprint(m):
+            attr, quote, ref = m.groups()
+            path = os.path.normpath(ref.lstrip('/') if ref.startswith('/')
+                                    else os.path.join(here, ref))
+            if (hashed:= _.hashed.get(path.replace(os.sep, '/'))) is None:
+                return m.group(0)
+            ref = ref[:len(ref) - len(os.path.basename(ref))]
+            return f'{attr}={quote}{ref}{os.path.basename(hashed)}{quote}'
+        body = REFERENCE.sub(fingerprint, html).encode()
+        etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+        return body, gzip.compress(body, 9), etag
+
+    @functools.lru_cache(maxsize=4096)
+    def isdir(_, path):
+        return os.path.isdir(os.path.join(_.root, path))
+
+    def page(_, path, cache):
+        body, gzipped, etag = _.pages[path]
+        headers = {'Content-Type': 'text/html; charset=UTF-8',
+                   'Cache-Control': cache, 'ETag': etag,
+                   'Vary': 'Accept-Encoding'}
+        if request.headers.get('If-None-Match') == etag:
+            return HTTPResponse(status=304, **headers)
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            body, headers['Content-Encoding'] = gzipped, 'gzip'
+            pass
+        return HTTPResponse(body, **headers)
+
+    def file(_, path, cache):
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        accept = request.headers.get('Accept-Encoding', '')
+        for encoding, suffix in ENCODINGS:
+            if encoding in _.variants.get(path, ()) and encoding in accept:
+                res = static_file(path + suffix, _.root, mimetype=mimetype)
+                if res.status_code in (200, 206, 304):
+                    res.set_header('Content-Encoding', encoding)
+                    pass
+                break
+        else:
+            res = static_file(path, _.root, mimetype=mimetype)
+            pass
+        res.set_header('Vary', 'Accept-Encoding')
+        res.set_header('Cache-Control', cache)
+        return res
+
+    def serve(_, path):
+        name = path.lstrip('/')
+        if real:= _.real.get(name):
+            name, cache = real, IMMUTABLE
+        elif _.isdir(name):
+            return redirect(path + '/')
+        else:
+            cache = REVALIDATE
+            pass
+        if name in _.pages:
+            return _.page(name, cache)
+        # bottle hands open files to wsgi.file_wrapper: servers with
+        # sendfile keep theirs, everybody else streams in big chunks
+        request.environ.setdefault('wsgi.file_wrapper', file_wrapper)
+        return _.file(name, cache)
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def assets(root):
+    return Assets(root)
+
+
+def serve(path, root):
+    if STATIC_MODE != 'prod':
+        response.headers['cache-control'] = 'no-store, must-revalidate'
+        if os.path.isdir('./' + path):
+            return redirect(path + '/')
+        return static_file(path, root)
+    return assets(root).serve(path)
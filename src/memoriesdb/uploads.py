@@ -0,0 +1,173 @@
+'''content-addressed upload store for the hub.
+
+uploads are streamed to disk in chunks and land in UPLOAD_DIR as
+<sha256><ext>, so the same image uploaded twice is stored once.
+past MAXIMUM_FILES or MAXIMUM_BYTES the least recently uploaded files
+are evicted. completion is published on the UPLOAD_CHANNEL hub channel
+and post-processing hooks then run in their own greenlets.'''
+import os, hashlib, tempfile, gevent
+
+UPLOAD_DIR     = os.getenv('UPLOAD_DIR', 'uploads')
+UPLOAD_CHANNEL = os.getenv('UPLOAD_CHANNEL', 'uploads')
+MAXIMUM_FILES  = int(os.getenv('MAXIMUM_FILES', 1000))
+MAXIMUM_BYTES  = int(os.getenv('MAXIMUM_BYTES', 1 << 30))
+MAXIMUM_UPLOAD = int(os.getenv('MAXIMUM_UPLOAD', 20 << 20))
+CHUNK = 64 << 10
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+THUMB_DIR = os.path.join(UPLOAD_DIR, 'thumbs')
+
+hooks = [] # fn(info) run in a greenlet after every newly stored file
+
+
+class TooLarge(Exception): pass
+
+
+def hook(fn):
+    hooks.append(fn)
+    return fn
+
+
+def extension(filename):
+    ext = os.path.splitext(filename or '')[1].lower()
+    return ext if ext in EXTENSIONS else '.jpg'
+
+
+def store(fileobj, ext='.jpg', limit=MAXIMUM_UPLOAD):
+    '''copies fileobj into the store chunk by chunk, hashing as it goes.
+    a file we already have is only touched (that's what LRU goes by)'''
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    digest, size = hashlib.sha256(), 0
+    fd, tmp = tempfile.mkstemp(dir=UPLOAD_DIR, prefix='.part-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while chunk:= fileobj.read(CHUNK):
+                size += len(chunk)
+                if size > limit:
+                    raise TooLarge(f'upload is over {limit} bytes')
+                digest.update(chunk)
+                out.write(chunk)
+                pass
+            pass
+        sha256 = digest.hexdigest()
+        path = os.path.join(UPLOAD_DIR, sha256 + ext)
+        try:
+            # link() never replaces: of two identical uploads racing,
+            # exactly one is fresh
+            os.link(tmp, path)
+            fresh = True
+        except FileExistsError:
+            os.utime(path)
+            fresh = False
+            pass
+    finally:
+        os.unlink(tmp)
+        pass
+    return dict(sha256=sha256, size=size, filename=os.path.basename(path),
+                path=path, duplicate=not fresh)
+
+
+def evict(max_files=MAXIMUM_FILES, max_bytes=MAXIMUM_BYTES):
+    '''drops the least recently uploaded files until we're under quota'''
+    files = [(e.stat().st_mtime, e.stat().st_size, e.path)
+             for e in os.scandir(UPLOAD_DIR)
+             if e.is_file() and not e.name.startswith('.')]
+    files.sort()
+    count, total = len(files), sum(size for _, size, _ in files)
+    for mtime, size, path in files:
+        if count <= max_files and total <= max_bytes:
+            break
+        print("EVICT", path)
+        os.unlink(path)
+        thumb = os.path.join(THUMB_DIR, os.path.basename(path))
+        if os.path.exists(thumb):
+            os.unlink(thumb)
+            pass
+        count, total = count - 1, total - size
+        pass
+    pass
+
+
+def completed(app, info):
+    '''announces the upload on the hub and kicks off post-processing'''
+    public = {k: v for k, v in info.items() if k != 'path'}
+    app.pub(None, dict(method='pub',
+                       params=dict(public, channel=UPLOAD_CHANNEL,
+                                   content=info['filename'])))
+    if not info['duplicate']:
+        for fn in hooks:
+            gevent.spawn(run_hook, fn, info)
+            pass
+        gevent.spawn(evict)
+        pass
+    pass
+
+
+def run_hook(fn, info):
+    try:
+        fn(info)
+    except Exception as e:
+        print("UPLOAD HOOK", fn.__name__, "FAILED:", e)
+        pass
+    pass
+
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+    pass
+
+if Image:
+    @hook
+    def thumbnail(info, size=(256, 256)):
+        os.makedirs(THUMB_DIR, exist_ok=True)
+        with Image.open(info['path']) as im:
+            im.thumbnail(size)
+            im.convert('RGB').save(os.path.join(THUMB_DIR, info['filename']),
+                                   'JPEG')
+            pass
+        pass
+    pass
+
+CAPTION_MODEL = os.getenv('UPLOAD_CAPTION_MODEL', '') # e.g. llava
+CAPTION_PROMPT = 'Describe this image in two or three sentences.'
+
+
+def describe(info):
+    '''the text an upload is remembered (and embedded) by: a caption
+    from CAPTION_MODEL, if there is one, and the file's name'''
+    name = info.get('name') or info['filename']
+    if not CAPTION_MODEL:
+        return name
+    import ollama
+    response = ollama.generate(model=CAPTION_MODEL, prompt=CAPTION_PROMPT,
+                               images=[info['path']])
+    return f"{name}: {response.response.strip()}"
+
+
+def insert_memory(content, info):
+    '''on a connection of its own: psycopg2 blocks, so this runs in
+    the hub's threadpool, away from the loop and from the shared one'''
+    from . import api
+    conn = api.connect()
+    try:
+        with conn, conn.cursor() as cursor:
+            return api.insert_new_('upload', api.get_user_id(cursor), content,
+                                   {k: v for k, v in info.items()
+                                    if k != 'path'}, cursor)
+    finally:
+        conn.close()
+        pass
+    pass
+
+
+if os.getenv('UPLOAD_MEMORIES'):
+    @hook
+    def remember(info):
+        '''one memory row per upload, the enqueue trigger then schedules
+        the embedding of its description'''
+        content = describe(info)
+        _id = gevent.get_hub().threadpool.apply(insert_memory, (content, info))
+        print("UPLOAD MEMORY", _id)
+        pass
+    pass
@@ -11,25 +11,23 @@ from websocket import WebSocket
 from geventwebsocket import WebSocketServer, WebSocketError
 from geventwebsocket.websocket import (
     MSG_CLOSED, MSG_ALREADY_CLOSED, MSG_SOCKET_DEAD)
+from . import framing
 
 # This makes stdin's FD non-blocking and replaces sys.stdin with
 # a wrapper that is integrated into the event loop
 stdin = FileObject(sys.stdin)
 
 def recv(ws):
-    raw = ws.recv()
-    if not raw:
-        raise EOFError
-    return json.loads(raw)
+    return framing.recv(ws)
 
 def recv2(ws):
     raw = ws.recv()
     if not raw:
         raise EOFError
-    return json.loads(raw), raw
+    return framing.track(ws, framing.decode(raw)), raw
 
 def send(ws, msg):
-    return ws.send( json.dumps(msg) )
+    return framing.send(ws, msg)
 
 def mesg(method, **params):
     return dict(method=method, params=params)
@@ -57,7 +55,12 @@ def add_cors_headers(headers, origin=''):
 
 WS_URI = "ws://localhost:5002/ws"
 
-def ws_connect(channels=''):
+def ws_connect(channels='', fmt=framing.FORMAT, since=None, epoch=None):
+    '''pass the last seq (and epoch from initialize) seen to have the hub
+    replay whatever was published while we were gone'''
+    args = '?c='+'&c='.join(channels.split(','))+'&f='+fmt
+    if since is not None:
+        args += f'&since={since}&epoch={epoch or ""}'
     ws = WebSocket()
-    ws.connect(WS_URI+'?c='+'&c='.join(channels.split(',')))
+    ws.connect(WS_URI+args)
     return ws
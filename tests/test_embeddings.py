@@ -0,0 +1,99 @@
+import math, pytest
+
+requests = pytest.importorskip('requests')
+from memoriesdb import api
+from memoriesdb.get_embeddings import (truncate_embedding, embedding_dim,
+                                       EmbeddingClient)
+
+
+def norm(vector):
+    return math.sqrt(sum(x * x for x in vector))
+
+
+def test_truncates_and_renormalizes():
+    out = truncate_embedding([3.0, 4.0, 12.0], 2)
+    assert out == pytest.approx([0.6, 0.8])
+    assert norm(out) == pytest.approx(1.0)
+
+
+def test_none_keeps_every_dimension():
+    out = truncate_embedding([1.0, 2.0, 2.0], None)
+    assert out == pytest.approx([1/3, 2/3, 2/3])
+
+
+def test_zero_vector_stays_zero():
+    assert truncate_embedding([0.0, 0.0, 0.0], 2) == [0.0, 0.0]
+
+
+def test_embedding_dim_is_the_column_size():
+    assert embedding_dim('snowflake-arctic-embed2:568m') == api.EMBED_DIM
+    assert embedding_dim('some-other-model') == api.EMBED_DIM
+
+
+class FakeBackend:
+    '''(model, inputs) -> vectors, failing with `errors` first'''
+
+    def __init__(_, errors=(), dim=8):
+        _.errors, _.dim, _.calls = list(errors), dim, []
+        pass
+
+    def __call__(_, model, inputs):
+        _.calls.append(list(inputs))
+        if _.errors:
+            raise _.errors.pop(0)
+        return [[float(len(text))] + [1.0] * (_.dim - 1) for text in inputs]
+    pass
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.exceptions.HTTPError(response=response)
+
+
+def client(backend, **kw):
+    return EmbeddingClient('snowflake-arctic-embed2:568m', output_dim=4,
+                           backend=backend, backoff=0, **kw)
+
+
+def test_retries_transient_errors():
+    backend = FakeBackend([requests.exceptions.ConnectionError(),
+                           http_error(503), http_error(429)])
+    vectors = client(backend).embed(['ab'])
+    assert len(backend.calls) == 4
+    assert len(vectors) == 1 and norm(vectors[0]) == pytest.approx(1.0)
+
+
+def test_gives_up_after_retries():
+    backend = FakeBackend([requests.exceptions.Timeout()] * 3)
+    with pytest.raises(requests.exceptions.Timeout):
+        client(backend, retries=2).embed(['ab'])
+    assert len(backend.calls) == 3
+
+
+def test_client_errors_are_not_retried():
+    backend = FakeBackend([http_error(400)])
+    with pytest.raises(requests.exceptions.HTTPError):
+        client(backend).embed(['ab'])
+    assert len(backend.calls) == 1
+
+
+def test_batches_in_order():
+    backend = FakeBackend()
+    texts = ['a' * n for n in range(1, 8)]
+    vectors = client(backend, batch_size=3, concurrency=2).embed_many(texts)
+    assert sorted(len(batch) for batch in backend.calls) == [1, 3, 3]
+    # the first value is the text length, scaled by the same norm
+    firsts = [v[0] for v in vectors]
+    assert firsts == sorted(firsts) and len(vectors) == 7
+
+
+def test_wrong_dimension_fails_fast():
+    with pytest.raises(ValueError):
+        client(FakeBackend(dim=3)).check()
+    other = EmbeddingClient('some-other-model', output_dim=4,
+                            backend=FakeBackend(dim=8), backoff=0)
+    with pytest.raises(ValueError):
+        other.check()
+    EmbeddingClient('some-other-model', output_dim=4,
+                    backend=FakeBackend(dim=4)).check()
@@ -0,0 +1,122 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+from psycopg2 import errors
+from psycopg2.extensions import (TRANSACTION_STATUS_IDLE,
+                                 TRANSACTION_STATUS_INTRANS)
+from memoriesdb import api
+
+
+class FakeInfo:
+    transaction_status = TRANSACTION_STATUS_IDLE
+
+
+class FakeConn:
+    '''remembers what was sent, fails the queries in `fail` once each'''
+
+    def __init__(_, status=TRANSACTION_STATUS_IDLE):
+        _.info, _.sent, _.fail, _.rollbacks = FakeInfo(), [], [], 0
+        _.info.transaction_status = status
+        pass
+
+    def rollback(_):
+        _.rollbacks += 1
+        _.info.transaction_status = TRANSACTION_STATUS_IDLE
+        pass
+    pass
+
+
+class FakeCursor:
+
+    def __init__(_, conn):
+        _.connection = conn
+        pass
+
+    def execute(_, sql, args=()):
+        _.connection.sent.append(sql % tuple(repr(a) for a in args))
+        if _.connection.fail:
+            raise _.connection.fail.pop(0)
+        _.connection.info.transaction_status = TRANSACTION_STATUS_INTRANS
+        pass
+    pass
+
+
+SQL = "SELECT * FROM memories WHERE id=%s AND content LIKE 'a%%'"
+
+
+def test_prepare_and_execute_in_one_round_trip():
+    conn = FakeConn()
+    cursor = FakeCursor(conn)
+    api.execute(cursor, SQL, ('x',))
+    name = api._statements[SQL].name
+    assert conn.sent == [f"PREPARE {name} AS SELECT * FROM memories"
+                         " WHERE id=$1 AND content LIKE 'a%'; "
+                         f"EXECUTE {name}('x')"]
+    # now in a transaction: prepared already, no savepoint needed
+    api.execute(cursor, SQL, ('y',))
+    api.execute(cursor, SQL, ('z',))
+    assert conn.sent[1:] == [f"EXECUTE {name}('y')", f"EXECUTE {name}('z')"]
+
+
+def test_new_statement_in_a_transaction_behind_a_savepoint():
+    conn = FakeConn(TRANSACTION_STATUS_INTRANS)
+    cursor = FakeCursor(conn)
+    api.execute(cursor, SQL, ('x',))
+    api.execute(cursor, SQL + " LIMIT 1", ('y',))
+    assert conn.sent[0].startswith("SAVEPOINT mdb_stmt; PREPARE ")
+    assert conn.sent[1].startswith("RELEASE SAVEPOINT mdb_stmt;"
+                                   " SAVEPOINT mdb_stmt; PREPARE ")
+
+
+def test_lost_statement_in_a_transaction_is_prepared_next_time():
+    conn = FakeConn()
+    cursor = FakeCursor(conn)
+    api.execute(cursor, SQL, ('x',))
+    name = api._statements[SQL].name
+    conn.sent.clear()
+    conn.fail.append(errors.InvalidSqlStatementName())
+    with pytest.raises(errors.InvalidSqlStatementName):
+        api.execute(cursor, SQL, ('y',))
+    assert conn.rollbacks == 0 # the caller's transaction, the caller's call
+    api.execute(cursor, SQL, ('y',))
+    assert conn.sent[1].startswith(f"SAVEPOINT mdb_stmt; PREPARE {name} AS ")
+    assert conn.sent[1].endswith(f"EXECUTE {name}('y')")
+
+
+@pytest.mark.parametrize('status', [TRANSACTION_STATUS_IDLE,
+                                    TRANSACTION_STATUS_INTRANS])
+def test_prepare_outlives_a_failed_execute(status):
+    conn = FakeConn(status)
+    cursor = FakeCursor(conn)
+    conn.fail.append(errors.UniqueViolation()) # the EXECUTE, PREPARE went through
+    with pytest.raises(errors.UniqueViolation):
+        api.execute(cursor, SQL, ('x',))
+    name = api._statements[SQL].name
+    conn.info.transaction_status = status # the caller rolled back (to theirs)
+    conn.sent.clear()
+    conn.fail.append(errors.DuplicatePreparedStatement())
+    api.execute(cursor, SQL, ('y',))
+    if status == TRANSACTION_STATUS_INTRANS:
+        assert conn.sent[1:] == ["ROLLBACK TO SAVEPOINT mdb_stmt",
+                                 f"EXECUTE {name}('y')"]
+        assert conn.rollbacks == 0
+    else:
+        assert conn.sent[1:] == [f"EXECUTE {name}('y')"]
+        assert conn.rollbacks == 1
+        pass
+    api.execute(cursor, SQL, ('z',))
+    assert conn.sent[-1] == f"EXECUTE {name}('z')"
+
+
+def test_stale_plan_when_idle_rolls_back_and_reprepares():
+    conn = FakeConn()
+    cursor = FakeCursor(conn)
+    api.execute(cursor, SQL, ('x',))
+    name = api._statements[SQL].name
+    conn.rollback()
+    conn.sent.clear()
+    conn.fail.append(errors.FeatureNotSupported())
+    api.execute(cursor, SQL, ('y',))
+    assert conn.rollbacks == 2
+    assert conn.sent[1] == f"DEALLOCATE {name}"
+    assert conn.sent[2].startswith(f"PREPARE {name} AS ")
@@ -0,0 +1,94 @@
+import json, zlib, pytest
+from memoriesdb import framing
+
+MSG = dict(method='pub', params=dict(channel='llm-in', content='hi'))
+
+
+class FakeWS:
+    '''what framing needs of a websocket-client WebSocket'''
+
+    def __init__(_, incoming=()):
+        _.incoming, _.sent = list(incoming), []
+        pass
+
+    def recv(_):
+        return _.incoming.pop(0) if _.incoming else ''
+
+    def send(_, frame):
+        _.sent.append(frame)
+        pass
+
+    def send_binary(_, frame):
+        _.sent.append(frame)
+        pass
+    pass
+
+
+def test_json_round_trip():
+    frame = framing.encode(MSG)
+    assert isinstance(frame, str)
+    assert framing.format_of(frame) == 'json'
+    assert framing.decode(frame) == MSG
+
+
+def test_negotiate_falls_back_to_json():
+    assert framing.negotiate('json') == 'json'
+    assert framing.negotiate('cbor') == 'json'
+    assert framing.negotiate(None) == 'json'
+
+
+def test_msgpack_round_trip():
+    pytest.importorskip('msgpack')
+    frame = framing.encode(MSG, 'msgpack')
+    assert frame[:1] == b'M' and framing.format_of(frame) == 'msgpack'
+    assert framing.decode(frame) == MSG
+    big = dict(MSG, params=dict(content='x' * 4096))
+    frame = framing.encode(big, 'msgpack', compress_min=1024)
+    assert frame[:1] == b'Z' and len(frame) < 1024
+    assert framing.decode(frame) == big
+
+
+def test_binary_frame_without_msgpack(monkeypatch):
+    monkeypatch.setattr(framing, 'msgpack', None)
+    with pytest.raises(ValueError):
+        framing.decode(b'M\x81\xa1a\x01')
+    with pytest.raises(ValueError):
+        framing.decode(b'Z' + zlib.compress(b'\x81\xa1a\x01'))
+    # and nothing ever gets encoded as msgpack
+    assert framing.encode(MSG, 'msgpack') == json.dumps(MSG)
+
+
+def test_bad_compressed_frame_is_a_value_error():
+    pytest.importorskip('msgpack')
+    with pytest.raises(ValueError):
+        framing.decode(b'Zgarbage')
+
+
+def test_client_sends_json_until_initialize():
+    init = json.dumps(dict(method='initialize',
+                           params=dict(format='json', seq=0)))
+    ws = FakeWS([init])
+    framing.send(ws, MSG)
+    assert ws.sent[-1] == json.dumps(MSG)
+    assert framing.recv(ws)['method'] == 'initialize'
+    framing.send(ws, MSG)
+    assert ws.sent[-1] == json.dumps(MSG)
+
+
+def test_client_follows_the_hubs_answer(monkeypatch):
+    monkeypatch.setattr(framing, 'FORMATS', ('json', 'msgpack'))
+    init = json.dumps(dict(method='initialize', params=dict(format='msgpack')))
+    ws = FakeWS([init])
+    framing.recv(ws)
+    assert framing._negotiated[ws] == 'msgpack'
+    # a hub without msgpack answers json, and json it is
+    ws = FakeWS([json.dumps(dict(method='initialize',
+                                 params=dict(format='json')))])
+    framing.recv(ws)
+    framing.send(ws, MSG)
+    assert ws.sent == [json.dumps(MSG)]
+
+
+def test_recv_eof():
+    with pytest.raises(EOFError):
+        framing.recv(FakeWS())
@@ -0,0 +1,35 @@
+from memoriesdb.api import graph
+
+
+class FakeCursor:
+    '''hands back the levels of a walk'''
+
+    def __init__(_, levels):
+        _.levels, _.sent = levels, []
+        pass
+
+    def execute(_, sql, args):
+        _.sent.append((sql, args))
+        pass
+
+    def __iter__(_):
+        return iter(_.levels)
+    pass
+
+
+def test_shortest_path_reads_back_the_predecessors():
+    cursor = FakeCursor([(['a'], [None]),
+                         (['b', 'c'], ['a', 'a']),
+                         (['d', 'e'], ['c', 'b']),
+                         (['f'], ['e'])])
+    assert graph.shortest_path('a', 'f', _cursor=cursor) == ['a', 'b', 'e', 'f']
+    sql, args = cursor.sent[0]
+    assert "NOT %(dst)s::uuid = ANY(w.seen)" in sql # stops at dst's level
+    assert args == dict(id='a', dst='f', depth=6, limit=graph.MAX_ROWS)
+
+
+def test_shortest_path_unreachable():
+    cursor = FakeCursor([(['a'], [None]), (['b'], ['a'])])
+    assert graph.shortest_path('a', 'z', _cursor=cursor) is None
+    assert graph.shortest_path('a', 'a', _cursor=cursor) == ['a']
+    assert len(cursor.sent) == 1
@@ -0,0 +1,119 @@
+import pytest
+
+pytest.importorskip('gevent')
+pytest.importorskip('geventwebsocket')
+from memoriesdb import hub
+
+
+def test_ring_caps_by_count_and_bytes():
+    ring = hub.Ring(maxlen=3, maxbytes=100)
+    for seq in range(1, 6):
+        ring.append(seq, {'seq': seq}, 10)
+        pass
+    assert [item[0] for item in ring.items] == [3, 4, 5]
+    assert ring.dropped == 2 and ring.nbytes == 30
+    ring.append(6, {'seq': 6}, 95)
+    assert [item[0] for item in ring.items] == [6]
+    assert ring.dropped == 5 and ring.nbytes == 95
+
+
+def test_ring_since():
+    ring = hub.Ring()
+    for seq in (1, 2, 3):
+        ring.append(seq, {'seq': seq}, 1)
+        pass
+    assert [item[0] for item in ring.since(1)] == [2, 3]
+    assert ring.since(3) == []
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(hub.Application, 'Channel', {})
+    monkeypatch.setattr(hub.Application, 'Replay', {})
+    monkeypatch.setattr(hub.Application, 'Evicted', 0)
+    monkeypatch.setattr(hub.Application, 'Held', {})
+    monkeypatch.setattr(hub.Application, 'Seq', 0)
+    return hub.Application()
+
+
+def fill(app, name, seqs, size=10):
+    ring = app.Replay.setdefault(name, hub.Ring(maxlen=2))
+    for seq in seqs:
+        ring.append(seq, {'seq': seq}, size)
+        pass
+    return ring
+
+
+def test_backlog_merges_channels_in_seq_order(app):
+    fill(app, 'a', [1, 4])
+    fill(app, 'b', [2, 3])
+    items, gap = app.backlog(['a', 'b'], 1)
+    assert [item[0] for item in items] == [2, 3, 4]
+    assert not gap
+
+
+def test_backlog_reports_gaps(app):
+    fill(app, 'a', [1, 2, 3])   # 1 fell off
+    assert app.backlog(['a'], 0)[1]
+    assert not app.backlog(['a'], 1)[1]
+    assert not app.backlog(['nothing'], 0)[1]
+
+
+def test_evict_idle_unsubscribed_rings(app, monkeypatch):
+    monkeypatch.setattr(hub, 'REPLAY_IDLE', 60)
+    old = fill(app, 'old', [1, 2])
+    busy = fill(app, 'busy', [3])
+    fill(app, 'fresh', [4])
+    app.Channel['busy'] = [('ws', object())]
+    old.touched = busy.touched = 0
+    app.evict(now=1000)
+    assert set(app.Replay) == {'busy', 'fresh'}
+    # a reconnect that may have missed the evicted ring hears of it
+    assert app.backlog(['old'], 1)[1]
+    assert not app.backlog(['old'], 2)[1]
+
+
+def test_evict_to_the_global_byte_cap(app, monkeypatch):
+    monkeypatch.setattr(hub, 'REPLAY_TOTAL', 25)
+    for n, name in enumerate(['sub', 'a', 'b']):
+        fill(app, name, [n + 1]).touched = n
+        pass
+    app.Channel['sub'] = [('ws', object())]
+    app.evict(now=1)
+    # the unsubscribed, least recently used goes first
+    assert set(app.Replay) == {'sub', 'b'}
+
+
+class SlowWS:
+    '''a subscriber whose n-th send lets a publisher in, like a blocked
+    ws.send yielding to other greenlets'''
+
+    def __init__(_, during_send=None, at=1):
+        _.sent, _.during_send, _.at = [], during_send, at
+        pass
+
+    def send(_, raw):
+        _.sent.append(hub.framing.decode(raw))
+        if _.during_send and len(_.sent) == _.at:
+            _.during_send()
+            pass
+        pass
+    pass
+
+
+@pytest.mark.parametrize('at', [1, 2, 3])
+def test_live_publishes_wait_for_the_replay(app, at):
+    fill(app, 'a', [2, 3])
+    type(app).Seq = 3
+    live = lambda: app.pub_raw(None, 'a', None,
+                               dict(method='pub', params=dict(channel='a')))
+    # lands after initialize, in the middle of or after the backlog
+    ws = SlowWS(during_send=live, at=at)
+    app.greet(ws, ['a'], 'json', since=1, epoch=hub.EPOCH)
+    assert ws.sent[0]['method'] == 'initialize'
+    assert ws.sent[0]['params']['replayed'] == 2
+    assert [m['seq'] for m in ws.sent[1:]] == [2, 3, 4]
+    assert not app.Held
+    # and once it is greeted, publishes go straight out
+    live()
+    assert ws.sent[-1]['seq'] == 5
@@ -0,0 +1,80 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+from psycopg2 import errors
+from psycopg2.extensions import (TRANSACTION_STATUS_IDLE,
+                                 TRANSACTION_STATUS_INTRANS)
+from memoriesdb import api
+
+
+class FakeInfo:
+    transaction_status = TRANSACTION_STATUS_IDLE
+
+
+class FakeCursor:
+    '''the role id the database knows, FK violations for any other'''
+
+    def __init__(_, role_id, status=TRANSACTION_STATUS_IDLE, count=None):
+        _.connection, _.role_id, _.count, _.sent = _, role_id, count, []
+        _.info = FakeInfo()
+        _.info.transaction_status = status
+        pass
+
+    def execute(_, sql, args=()):
+        _.sent.append((sql, args))
+        if sql.startswith('INSERT') and args[2] != _.role_id:
+            raise errors.ForeignKeyViolation()
+        pass
+
+    def fetchone(_):
+        return (_.count,) if _.count is not None else ('new-id',)
+
+    def rollback(_):
+        _.info.transaction_status = TRANSACTION_STATUS_IDLE
+        pass
+
+    def commit(_):
+        pass
+    pass
+
+
+@pytest.fixture
+def stale(monkeypatch):
+    '''a metadata cache from before a re-seed: user is now role-2'''
+    monkeypatch.setattr(api, 'PREPARE', False)
+    monkeypatch.setattr(api, 'METADATA_CACHE', '/nonexistent')
+    monkeypatch.setattr(api, '_lookup_role', {'user': 'role-1'})
+    refreshed = []
+
+    def init(refresh=False):
+        refreshed.append(refresh)
+        api._lookup_role = {'user': 'role-2'}
+        pass
+    monkeypatch.setattr(api, 'init', init)
+    return refreshed
+
+
+def test_stale_role_ids_are_reloaded_on_fk_violation(stale):
+    cursor = FakeCursor('role-2')
+    assert api.insert_new_history('s', 'hi', _cursor=cursor) == 'new-id'
+    assert stale == [True]
+    assert [args[2] for sql, args in cursor.sent] == ['role-1', 'role-2']
+
+
+def test_no_retry_inside_the_callers_transaction(stale):
+    cursor = FakeCursor('role-2', TRANSACTION_STATUS_INTRANS)
+    with pytest.raises(errors.ForeignKeyViolation):
+        api.insert_new_history('s', 'hi', _cursor=cursor, _commit=False)
+    assert stale == []
+
+
+def test_metadata_cache_checks_the_ids():
+    meta = dict(roles=[('r1', 'user'), ('r2', 'assistant')],
+                categories={'category': 'c1', 'entity': 'c2', 'role': 'c3'})
+    cursor = FakeCursor(None, count=5)
+    assert api._metadata_current(meta, cursor)
+    sql, (ids, names) = cursor.sent[0]
+    assert ids == ['r1', 'r2', 'c1', 'c2', 'c3']
+    assert names == ['user', 'assistant', 'category', 'entity', 'role']
+    # a re-seed: some of them are gone
+    assert not api._metadata_current(meta, FakeCursor(None, count=3))
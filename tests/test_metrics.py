@@ -0,0 +1,47 @@
+from memoriesdb import metrics
+
+
+def test_counter_and_labels():
+    registry = []
+    c = metrics.Counter('jobs_total', 'jobs done', ('kind',), registry=registry)
+    c.inc(kind='a')
+    c.inc(2, kind='a')
+    c.inc(kind='say "hi"\n')
+    assert metrics.render(registry) == (
+        '# HELP jobs_total jobs done\n'
+        '# TYPE jobs_total counter\n'
+        'jobs_total{kind="a"} 3\n'
+        'jobs_total{kind="say \\"hi\\"\\n"} 1\n')
+
+
+def test_gauge_set_and_fn():
+    registry = []
+    g = metrics.Gauge('depth', 'queue depth', registry=registry)
+    g.set(5)
+    g.dec()
+    f = metrics.Gauge('per', 'computed', ('ch',), registry=registry,
+                      fn=lambda: {('x',): 1, ('y',): 2})
+    lines = metrics.render(registry).splitlines()
+    assert 'depth 4' in lines
+    assert 'per{ch="x"} 1' in lines and 'per{ch="y"} 2' in lines
+
+
+def test_failing_fn_renders_no_samples():
+    registry = []
+    metrics.Gauge('broken', 'x', registry=registry, fn=lambda: 1 / 0)
+    assert metrics.render(registry) == ('# HELP broken x\n'
+                                        '# TYPE broken gauge\n')
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = []
+    h = metrics.Histogram('lat', 'latency', buckets=(1, 5), registry=registry)
+    for v in (0.5, 2, 7):
+        h.observe(v)
+        pass
+    lines = metrics.render(registry).splitlines()[2:]
+    assert lines == ['lat_bucket{le="1"} 1',
+                     'lat_bucket{le="5"} 2',
+                     'lat_bucket{le="+Inf"} 3',
+                     'lat_sum 9.5',
+                     'lat_count 3']
@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+import pytest
+
+gevent = pytest.importorskip('gevent')
+pytest.importorskip('ollama')
+from memoriesdb.model_manager import ModelManager
+
+
+class FakeClient:
+    '''ollama.Client: ps() lists `loaded`, generate() loads a model'''
+
+    def __init__(_, *loaded, fail=False):
+        _.loaded, _.fail, _.generated = list(loaded), fail, []
+        pass
+
+    def ps(_):
+        if _.fail:
+            raise ConnectionError('ollama is down')
+        return SimpleNamespace(models=[SimpleNamespace(model=m, expires_at=None)
+                                       for m in _.loaded])
+
+    def generate(_, model, prompt, keep_alive):
+        _.generated.append(model)
+        _.loaded.append(model)
+        pass
+    pass
+
+
+@pytest.fixture(autouse=True)
+def no_poll(monkeypatch):
+    monkeypatch.setattr(ModelManager, 'poll', lambda _: None)
+    pass
+
+
+def test_route_prefers_a_warm_candidate():
+    models = ModelManager(client=FakeClient('qwen3:8b', 'llama3.1:latest'))
+    models.refresh()
+    assert models.route(['mistral', 'llama3.1', 'qwen3:8b']) == 'llama3.1'
+    assert models.route([None, 'mistral', 'gemma3']) == 'mistral' # all cold
+    assert models.route([]) is None
+
+
+def test_start_preloads_only_what_is_cold():
+    client = FakeClient('llama3.1:latest')
+    models = ModelManager(['llama3.1', 'qwen3:8b', 'gemma3'], max_warm=2,
+                          client=client).start()
+    gevent.sleep(0) # the loads run in greenlets
+    assert client.generated == ['qwen3:8b'] # gemma3 is past max_warm
+    assert models.is_warm('qwen3:8b') and not models.loading
+
+
+def test_start_without_ps_still_preloads():
+    client = FakeClient(fail=True)
+    models = ModelManager(['llama3.1'], client=client).start()
+    gevent.sleep(0)
+    assert client.generated == ['llama3.1'] and models.is_warm('llama3.1')
+
+
+def test_convo_routes_once_per_session(monkeypatch):
+    from memoriesdb import convo
+    rows = []
+    monkeypatch.setattr(convo, 'insert_new_model',
+                        lambda model, session_id: rows.append((model, session_id)))
+    c = convo.Convo(tools=[], model='llama3.1')
+    c.session_id = 's'
+    c.session_models = ['mistral', 'qwen3:8b'] # newest first
+    c.models = ModelManager(client=FakeClient('qwen3:8b'))
+    c.models.refresh()
+    c.route_model()
+    assert c.model == 'qwen3:8b' and rows == [('qwen3:8b', 's')]
+    c.models.client.loaded = ['llama3.1:latest']
+    c.models.refresh()
+    c.route_model() # sticks with it for the rest of the session
+    assert c.model == 'qwen3:8b' and len(rows) == 1
+
+
+def test_convo_records_nothing_when_the_session_model_stays(monkeypatch):
+    from memoriesdb import convo
+    rows = []
+    monkeypatch.setattr(convo, 'insert_new_model',
+                        lambda model, session_id: rows.append(model))
+    c = convo.Convo(tools=[], model='qwen3:8b')
+    c.session_id, c.session_models = 's', ['qwen3:8b']
+    c.models = ModelManager(client=FakeClient('qwen3:8b'))
+    c.models.refresh()
+    c.route_model()
+    assert c.model == 'qwen3:8b' and rows == []
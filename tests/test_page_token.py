@@ -0,0 +1,34 @@
+import base64, json, pytest
+from memoriesdb.api import encode_page_token, decode_page_token
+
+SESSION = '1f0c2d3e-4a5b-11ef-8000-0242ac120002'
+BEFORE  = '2a1b3c4d-4a5b-11ef-8000-0242ac120002'
+
+
+def token(value):
+    raw = json.dumps(value).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def test_round_trip():
+    assert decode_page_token(encode_page_token((SESSION, BEFORE))) == \
+        (SESSION, BEFORE)
+
+
+def test_token_is_url_safe():
+    assert set(encode_page_token((SESSION, BEFORE))) <= \
+        set('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_')
+
+
+@pytest.mark.parametrize('bad', [
+    '!!!',                                # not base64
+    token('nope'),                        # not a pair
+    token([SESSION]),
+    token([SESSION, BEFORE, BEFORE]),
+    token({'session': SESSION}),
+    token([SESSION, 'not-a-uuid']),
+    token([SESSION, 5]),
+])
+def test_bad_tokens_are_value_errors(bad):
+    with pytest.raises(ValueError):
+        decode_page_token(bad)
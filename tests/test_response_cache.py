@@ -0,0 +1,104 @@
+from collections import namedtuple
+import pytest
+from memoriesdb import response_cache
+from memoriesdb.response_cache import ResponseCache, fingerprint
+
+Message = namedtuple('Message', 'role content tool_calls')
+
+# unit vectors, the cache compares them with a plain dot product
+VECTORS = {
+    'what is 2+2?':  [1.0, 0.0],
+    'what is 2 + 2': [0.99, 0.141],
+    'tell me a joke': [0.0, 1.0],
+}
+
+
+def embed(text):
+    return VECTORS[text]
+
+
+def turn(text, system='be brief', history=()):
+    return ([dict(role='system', content=system), *history,
+             dict(role='user', content=text)])
+
+
+def answer(content='4', tool_calls=None):
+    return Message('assistant', content, tool_calls)
+
+
+HISTORY = [dict(role='user', content='hi'),
+           dict(role='assistant', content='hello')]
+
+
+def test_near_duplicates_hit_across_sessions():
+    cache = ResponseCache(threshold=0.95, embed=embed)
+    cache.put(cache.key('m', None, turn('what is 2+2?')), answer())
+    other_session = turn('what is 2 + 2')
+    hit = cache.get(cache.key('m', None, other_session))
+    assert hit.message.content == '4' and hit.cached >= 0.95
+    assert cache.get(cache.key('m', None, turn('tell me a joke'))) is None
+
+
+def test_follow_ups_only_hit_after_the_same_history():
+    cache = ResponseCache(threshold=0.95, embed=embed)
+    cache.put(cache.key('m', None, turn('what is 2+2?', history=HISTORY)),
+              answer())
+    same = turn('what is 2 + 2', history=HISTORY)
+    assert cache.get(cache.key('m', None, same)).message.content == '4'
+    # another conversation, maybe another user's: its answer isn't ours
+    other = turn('what is 2+2?', history=[dict(role='user', content='hi'),
+                                          dict(role='assistant', content='yo')])
+    assert cache.get(cache.key('m', None, other)) is None
+    assert cache.get(cache.key('m', None, turn('what is 2+2?'))) is None
+
+
+def test_fingerprint_is_model_tools_and_prompt():
+    msgs = turn('x')[:-1]
+    assert fingerprint('m', None, msgs) == fingerprint('m', None, list(msgs))
+    assert fingerprint('m', None, msgs) != fingerprint(
+        'm', None, msgs + [dict(role='user', content='earlier')])
+    assert fingerprint('m', None, msgs) != fingerprint('n', None, msgs)
+    assert fingerprint('m', None, msgs) != fingerprint('m', ['search'], msgs)
+    assert fingerprint('m', None, msgs) != fingerprint(
+        'm', None, turn('x', system='be verbose')[:-1])
+
+
+def test_only_plain_answers_to_user_turns():
+    cache = ResponseCache(embed=embed)
+    assert cache.key('m', None, [dict(role='tool', content='x')]) is None
+    key = cache.key('m', None, turn('what is 2+2?'))
+    cache.put(key, answer(tool_calls=[{'function': 'f'}]))
+    cache.put(key, answer(content=''))
+    assert cache.get(key) is None
+
+
+def test_ttl_and_lru(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, 'time', lambda: now[0])
+    cache = ResponseCache(ttl=10, size=2, embed=embed)
+    keys = [cache.key('m', None, turn(text, system=text))
+            for text in VECTORS]
+    cache.put(keys[0], answer('a'))
+    cache.put(keys[1], answer('b'))
+    assert cache.get(keys[0]).message.content == 'a' # now most recent
+    cache.put(keys[2], answer('c'))
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) and cache.get(keys[2])
+    now[0] += 11
+    # expired entries go when their fingerprint is looked up
+    assert cache.get(keys[0]) is None and cache.get(keys[2]) is None
+    assert not cache.entries
+
+
+def test_get_cache_is_shared(monkeypatch):
+    monkeypatch.setattr(response_cache, '_cache', None)
+    monkeypatch.setattr(response_cache, 'CACHE', '')
+    assert response_cache.get_cache() is None
+    monkeypatch.setattr(response_cache, 'CACHE', '1')
+    cache = response_cache.get_cache()
+    assert type(cache) is ResponseCache
+    assert response_cache.get_cache() is cache
+    monkeypatch.setattr(response_cache, '_cache', None)
+    monkeypatch.setattr(response_cache, 'CACHE', 'db')
+    assert isinstance(response_cache.get_cache(),
+                      response_cache.DbResponseCache)
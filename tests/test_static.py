@@ -0,0 +1,105 @@
+import gzip, hashlib
+import pytest
+
+bottle = pytest.importorskip('bottle')
+from memoriesdb import static
+
+APP_JS = b'console.log("hi")\n'
+INDEX = ('<script src="/app.js"></script>'
+         '<link href="style.css"><a href="sub/">sub</a>'
+         '<img src="https://example.com/x.png"><img src="missing.png">')
+
+
+@pytest.fixture
+def assets(tmp_path):
+    (tmp_path / 'index.html').write_text(INDEX)
+    (tmp_path / 'app.js').write_bytes(APP_JS)
+    (tmp_path / 'app.js.gz').write_bytes(gzip.compress(APP_JS))
+    (tmp_path / 'app.js.br').write_bytes(b'pretend brotli')
+    (tmp_path / 'style.css').write_text('body {}')
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'index.html').write_text('<a href="../app.js">')
+    return static.Assets(str(tmp_path))
+
+
+def request(**headers):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/',
+               'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+               'wsgi.url_scheme': 'http'}
+    environ.update({'HTTP_' + k.upper().replace('-', '_'): v
+                    for k, v in headers.items()})
+    bottle.request.bind(environ)
+    bottle.response.bind()
+    pass
+
+
+def serve(assets, path, **headers):
+    request(**headers)
+    try:
+        return assets.serve(path)
+    except bottle.HTTPResponse as res: # redirect() raises
+        return res
+
+
+def test_fingerprints(assets):
+    digest = hashlib.sha256(APP_JS).hexdigest()[:12]
+    assert assets.hashed['app.js'] == f'app.{digest}.js'
+    assert assets.real[f'app.{digest}.js'] == 'app.js'
+    # precompressed siblings are variants, not assets of their own
+    assert assets.variants['app.js'] == {'br', 'gzip'}
+    assert 'app.js.gz' not in assets.hashed
+
+
+def test_pages_reference_hashed_urls(assets):
+    body = assets.pages['index.html'][0].decode()
+    assert f'src="/{assets.hashed["app.js"]}"' in body
+    assert f'href="{assets.hashed["style.css"]}"' in body
+    assert 'src="https://example.com/x.png"' in body
+    assert 'src="missing.png"' in body
+    sub = assets.pages['sub/index.html'][0].decode()
+    assert f'href="../{assets.hashed["app.js"]}"' in sub
+
+
+def test_cache_control(assets):
+    hashed = serve(assets, '/' + assets.hashed['app.js'])
+    assert hashed.status_code == 200
+    assert hashed.headers['Cache-Control'] == static.IMMUTABLE
+    plain = serve(assets, '/app.js')
+    assert plain.headers['Cache-Control'] == static.REVALIDATE
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+
+
+@pytest.mark.parametrize('accept, encoding', [
+    ('gzip, deflate, br', 'br'),
+    ('gzip', 'gzip'),
+    ('', None),
+])
+def test_precompressed_variants(assets, accept, encoding):
+    res = serve(assets, '/app.js', accept_encoding=accept)
+    assert res.headers.get('Content-Encoding') == encoding
+    assert res.headers['Content-Type'].startswith('text/javascript') or \
+        res.headers['Content-Type'].startswith('application/javascript')
+
+
+def test_page_conditional_get(assets):
+    etag = assets.pages['index.html'][2]
+    res = serve(assets, '/index.html', accept_encoding='gzip')
+    assert res.headers['ETag'] == etag
+    assert res.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(res.body) == assets.pages['index.html'][0]
+    assert serve(assets, '/index.html', if_none_match=etag).status_code == 304
+    assert serve(assets, '/index.html', if_none_match='"other"'
+                 ).status_code == 200
+
+
+def test_file_conditional_get(assets):
+    first = serve(assets, '/app.js')
+    again = serve(assets, '/app.js',
+                  if_modified_since=first.headers['Last-Modified'])
+    assert again.status_code == 304
+
+
+def test_directories_redirect(assets):
+    res = serve(assets, '/sub')
+    assert res.status_code in (302, 303)
+    assert res.headers['Location'].endswith('/sub/')
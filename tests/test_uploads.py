@@ -0,0 +1,106 @@
+import io, os, hashlib
+import pytest
+
+pytest.importorskip('gevent')
+import gevent
+from memoriesdb import uploads
+
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, 'UPLOAD_DIR', str(tmp_path))
+    monkeypatch.setattr(uploads, 'THUMB_DIR', str(tmp_path / 'thumbs'))
+    return tmp_path
+
+
+def files(path):
+    return sorted(e.name for e in os.scandir(path) if e.is_file())
+
+
+def test_store_is_content_addressed(store_dir):
+    data = b'x' * (3 * uploads.CHUNK + 5) # a few chunks
+    first = uploads.store(io.BytesIO(data), '.png')
+    sha = hashlib.sha256(data).hexdigest()
+    assert first['filename'] == sha + '.png' and first['size'] == len(data)
+    assert not first['duplicate']
+    second = uploads.store(io.BytesIO(data), '.png')
+    assert second['duplicate'] and second['path'] == first['path']
+    assert files(store_dir) == [sha + '.png'] # no .part- leftovers
+
+
+def test_store_refuses_too_large(store_dir):
+    with pytest.raises(uploads.TooLarge):
+        uploads.store(io.BytesIO(b'x' * 100), limit=99)
+    assert files(store_dir) == []
+
+
+class RacingFile(io.BytesIO):
+    '''an identical upload lands while we are still reading ours'''
+
+    def read(self, n=-1):
+        chunk = super().read(n)
+        if not chunk:
+            sha = hashlib.sha256(self.getvalue()).hexdigest()
+            with open(os.path.join(uploads.UPLOAD_DIR, sha + '.jpg'), 'wb') as f:
+                f.write(self.getvalue())
+                pass
+            pass
+        return chunk
+    pass
+
+
+def test_concurrent_duplicates_store_once(store_dir):
+    info = uploads.store(RacingFile(b'same image'))
+    assert info['duplicate']
+    assert len(files(store_dir)) == 1
+
+
+def test_evict_least_recently_uploaded(store_dir):
+    os.makedirs(uploads.THUMB_DIR)
+    for n, name in enumerate(['a.jpg', 'b.jpg', 'c.jpg']):
+        path = store_dir / name
+        path.write_bytes(b'x' * 10)
+        os.utime(path, (n, n))
+        pass
+    (store_dir / 'thumbs' / 'a.jpg').write_bytes(b't')
+    (store_dir / '.part-upload').write_bytes(b'x' * 100) # in progress
+    uploads.evict(max_files=2, max_bytes=100)
+    assert files(store_dir) == ['.part-upload', 'b.jpg', 'c.jpg']
+    assert not (store_dir / 'thumbs' / 'a.jpg').exists()
+    uploads.evict(max_files=10, max_bytes=15)
+    assert files(store_dir) == ['.part-upload', 'c.jpg']
+
+
+class App:
+    def __init__(_):
+        _.published = []
+        pass
+
+    def pub(_, ws, msg):
+        _.published.append(msg)
+        pass
+    pass
+
+
+def test_completed_runs_hooks_for_new_files_only(store_dir, monkeypatch):
+    ran = []
+    monkeypatch.setattr(uploads, 'hooks', [ran.append, lambda info: 1 / 0])
+    monkeypatch.setattr(uploads, 'evict', lambda: ran.append('evict'))
+    app = App()
+    info = dict(sha256='s', size=1, filename='s.jpg', path='/secret/s.jpg',
+                duplicate=False)
+    uploads.completed(app, info)
+    gevent.sleep(0) # the hooks run in greenlets, a failing one is logged
+    assert ran == [info, 'evict']
+    params = app.published[0]['params']
+    assert params['channel'] == uploads.UPLOAD_CHANNEL
+    assert params['content'] == 's.jpg' and 'path' not in params
+    uploads.completed(app, dict(info, duplicate=True))
+    gevent.sleep(0)
+    assert ran == [info, 'evict'] and len(app.published) == 2
+
+
+def test_describe_without_a_caption_model(monkeypatch):
+    monkeypatch.setattr(uploads, 'CAPTION_MODEL', '')
+    assert uploads.describe(dict(filename='s.jpg', name='cat.jpg')) == 'cat.jpg'
+    assert uploads.describe(dict(filename='s.jpg')) == 's.jpg'